@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import redis
+
+from app.config import settings
+from app.metrics import registry
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Descarte na ingestão, por motivo
+FIXES_SHED = {
+    reason: registry.counter("tracking_fixes_shed_total", "Fixes descartados na admissão", {"reason": reason})
+    for reason in ("rate_limited", "decimated", "overloaded")
+}
+
+# Token bucket por chave em um hash {t: tokens, ts: epoch}; devolve quantos fixes cada chave pode gravar
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local result = {}
+for i, key in ipairs(KEYS) do
+    local cost = tonumber(ARGV[4 + i])
+    local state = redis.call('HMGET', key, 't', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local allowed = math.min(cost, math.floor(tokens))
+    redis.call('HSET', key, 't', tokens - allowed, 'ts', now)
+    redis.call('PEXPIRE', key, ttl)
+    result[i] = allowed
+end
+return result
+"""
+
+
+class Overloaded(Exception):
+    """Ingestão acima do limite global; ``retry_after`` em segundos"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("ingest overloaded")
+        self.retry_after = retry_after
+
+
+def _decimate(items: list, keep: int) -> list:
+    """``keep`` itens espaçados igualmente, sempre incluindo o último"""
+    if keep <= 0:
+        return []
+    n = len(items)
+    return [items[(i + 1) * n // keep - 1] for i in range(keep)]
+
+
+class VehicleRateLimiter:
+    """Token bucket por veículo: ``rate`` fixes/s com rajadas de até ``burst``.
+
+    Em memória por padrão; com Redis o balde é compartilhado entre os workers
+    (um script Lua por requisição, para todos os veículos dela). Se o Redis
+    falhar, volta ao balde local.
+    """
+
+    def __init__(self, rate: float, burst: int, redis_client=None, max_vehicles: int = 100000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_vehicles = max_vehicles
+        self.redis = redis_client
+        self._script = redis_client.register_script(_TOKEN_BUCKET_SCRIPT) if redis_client is not None else None
+        # vehicle_id -> (tokens, monotonic)
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self.redis_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(1 / self.rate)) if self.enabled else 1
+
+    def _admit_local(self, costs: Dict[Hashable, int]) -> Dict[Hashable, int]:
+        now = time.monotonic()
+        allowed = {}
+        with self._lock:
+            if len(self._buckets) > self.max_vehicles:
+                # Baldes já cheios de novo são equivalentes a não ter estado
+                full_after = self.burst / self.rate
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < full_after}
+            for key, cost in costs.items():
+                tokens, updated = self._buckets.get(key, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                granted = min(cost, int(tokens))
+                self._buckets[key] = (tokens - granted, now)
+                allowed[key] = granted
+        return allowed
+
+    def admit(self, costs: Dict[Hashable, int]) -> Dict[Hashable, int]:
+        """Quantos fixes de cada veículo cabem no balde agora"""
+        if not self.enabled:
+            return dict(costs)
+        if self._script is not None:
+            keys = list(costs)
+            try:
+                granted = self._script(
+                    keys=[f"ratelimit:vehicle:{key}" for key in keys],
+                    args=[self.rate, self.burst, time.time(),
+                          int(self.burst / self.rate * 1000) + 1000, *(costs[key] for key in keys)]
+                )
+                return dict(zip(keys, (int(g) for g in granted)))
+            except redis.RedisError:
+                self.redis_errors += 1
+                logger.warning("Falha no rate limit via Redis; usando o balde local", exc_info=True)
+        return self._admit_local(costs)
+
+    def admit_items(self, items: list, vehicle_id: Callable[[object], Hashable]) -> Tuple[list, int]:
+        """Filtra um lote: o excedente de cada veículo sai, mantendo fixes espaçados.
+
+        Retorna ``(mantidos, descartados)``; a ordem por veículo é preservada.
+        """
+        if not self.enabled:
+            return items, 0
+        groups: Dict[Hashable, list] = {}
+        for item in items:
+            groups.setdefault(vehicle_id(item), []).append(item)
+        allowed = self.admit({key: len(group) for key, group in groups.items()})
+        if all(allowed[key] >= len(group) for key, group in groups.items()):
+            return items, 0
+        kept = []
+        for key, group in groups.items():
+            kept.extend(group if allowed[key] >= len(group) else _decimate(group, allowed[key]))
+        return kept, len(items) - len(kept)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "backend": "redis" if self._script is not None else "memory",
+            "tracked_vehicles": len(self._buckets),
+            "redis_errors": self.redis_errors
+        }
+
+
+class ConcurrencyLimiter:
+    """Limite global de requisições de ingestão em andamento.
+
+    Acima de ``max_inflight``, até ``max_waiting`` requisições esperam no
+    máximo ``timeout`` segundos; as demais são recusadas na hora, antes de
+    ocupar uma conexão do banco.
+    """
+
+    def __init__(self, max_inflight: int, max_waiting: int, timeout: float):
+        self.max_inflight = max_inflight
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.inflight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inflight > 0
+
+    @property
+    def retry_after(self) -> int:
+        """Retry-After em segundos: o tempo máximo de espera na fila, arredondado para cima"""
+        return max(1, math.ceil(self.timeout))
+
+    async def acquire(self):
+        if not self.enabled:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise Overloaded(self.retry_after)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise Overloaded(self.retry_after)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.inflight += 1
+
+    def release(self):
+        if not self.enabled:
+            return
+        self.inflight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_inflight": self.max_inflight,
+            "max_waiting": self.max_waiting,
+            "timeout_ms": self.timeout * 1000,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
+
+
+vehicle_rate_limiter = VehicleRateLimiter(
+    settings.INGEST_RATE_LIMIT_PER_SECOND,
+    settings.INGEST_RATE_LIMIT_BURST,
+    redis_client if settings.INGEST_RATE_LIMIT_BACKEND == "redis" else None
+)
+ingest_limiter = ConcurrencyLimiter(
+    settings.INGEST_MAX_CONCURRENCY,
+    settings.INGEST_MAX_WAITING,
+    settings.INGEST_QUEUE_TIMEOUT_MS / 1000
+)
+
+
+def shed_reason() -> str:
+    """Motivo registrado para fixes acima do limite do veículo"""
+    return "decimated" if settings.INGEST_OVER_LIMIT_MODE == "decimate" else "rate_limited"
+
+
+def admission_stats() -> dict:
+    return {
+        "over_limit_mode": settings.INGEST_OVER_LIMIT_MODE,
+        "rate_limit": vehicle_rate_limiter.stats(),
+        "concurrency": ingest_limiter.stats(),
+        "shed": {reason: counter.value for reason, counter in FIXES_SHED.items()}
+    }
+
+
+registry.collector(
+    "tracking_ingest_inflight", "gauge", "Requisições de ingestão em andamento e na espera",
+    lambda: [({"state": "inflight"}, ingest_limiter.inflight), ({"state": "waiting"}, ingest_limiter.waiting)]
+)
@@ -0,0 +1,84 @@
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+
+def driver_summary(driver) -> dict:
+    """Dados do motorista enviados junto das posições"""
+    return {"id": driver.id, "name": driver.name, "phone": driver.phone}
+
+
+class AssignmentIndex:
+    """Motorista atual de cada veículo, em memória.
+
+    Carregado uma vez na inicialização (vínculos ativos) e mantido pelo CRUD a
+    cada vínculo, desvínculo ou alteração de motorista, para enriquecer as
+    posições sem consultar o banco por fix.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._drivers: Dict[int, dict] = {}
+        # driver_id -> veículos com vínculo ativo
+        self._vehicles_by_driver: Dict[int, Set[int]] = {}
+        self._listeners: List[Callable[[int, Optional[dict]], None]] = []
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def get(self, vehicle_id: int) -> Optional[dict]:
+        return self._drivers.get(vehicle_id)
+
+    def _set(self, vehicle_id: int, summary: Optional[dict]):
+        previous = self._drivers.pop(vehicle_id, None)
+        if previous is not None:
+            vehicles = self._vehicles_by_driver.get(previous["id"])
+            if vehicles is not None:
+                vehicles.discard(vehicle_id)
+                if not vehicles:
+                    del self._vehicles_by_driver[previous["id"]]
+        if summary is not None:
+            self._drivers[vehicle_id] = summary
+            self._vehicles_by_driver.setdefault(summary["id"], set()).add(vehicle_id)
+
+    def set(self, vehicle_id: int, summary: Optional[dict], propagate: bool = True):
+        """Define (ou remove, com None) o motorista de um veículo"""
+        with self._lock:
+            self._set(vehicle_id, summary)
+        if propagate:
+            for listener in self._listeners:
+                listener(vehicle_id, summary)
+
+    def update_driver(self, summary: dict, propagate: bool = True):
+        """Replica nome/telefone alterados em todos os veículos do motorista"""
+        with self._lock:
+            vehicle_ids = list(self._vehicles_by_driver.get(summary["id"], ()))
+            for vehicle_id in vehicle_ids:
+                self._drivers[vehicle_id] = summary
+        if propagate:
+            for vehicle_id in vehicle_ids:
+                for listener in self._listeners:
+                    listener(vehicle_id, summary)
+
+    def load(self, assignments: Iterable):
+        """Substitui o índice por pares (vehicle_id, driver)"""
+        with self._lock:
+            self._drivers.clear()
+            self._vehicles_by_driver.clear()
+            for vehicle_id, driver in assignments:
+                self._set(vehicle_id, driver_summary(driver))
+            self.loaded = True
+
+    def on_change(self, listener: Callable[[int, Optional[dict]], None]):
+        """Chamado a cada alteração local (ex.: avisar os outros workers)"""
+        self._listeners.append(listener)
+
+    def enrich(self, data: dict) -> dict:
+        """Cópia de uma posição (dict com vehicle_id) com o motorista atual"""
+        return {**data, "driver": self._drivers.get(data["vehicle_id"])}
+
+    def stats(self) -> dict:
+        return {"loaded": self.loaded, "assigned_vehicles": len(self._drivers)}
+
+
+assignment_index = AssignmentIndex()
@@ -0,0 +1,152 @@
+import abc
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, List[dict]], Awaitable[None]]
+
+
+class Broker(abc.ABC):
+    """Distribui mensagens entre workers; cada worker faz o fan-out local.
+
+    ``publish`` apenas acumula: as mensagens publicadas no mesmo intervalo
+    (``linger_seconds``) saem juntas em um único envio por canal.
+    """
+
+    def __init__(self, handler: Handler, linger_seconds: float = 0.005):
+        self._handler = handler
+        self.linger_seconds = linger_seconds
+        self._buffers: Dict[str, List[dict]] = {}
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._pending_flushes = set()
+        self.batches_published = 0
+        self.messages_published = 0
+        self.batches_received = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self._flush_buffers()
+
+    def publish(self, channel: str, message: dict):
+        self._buffers.setdefault(channel, []).append(message)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.linger_seconds, self._schedule_flush)
+
+    def publish_threadsafe(self, loop: asyncio.AbstractEventLoop, channel: str, message: dict):
+        """Publica a partir de outra thread"""
+        loop.call_soon_threadsafe(self.publish, channel, message)
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        task = asyncio.ensure_future(self._flush_buffers())
+        self._pending_flushes.add(task)
+        task.add_done_callback(self._pending_flushes.discard)
+
+    async def _flush_buffers(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        # Um envio por vez, para preservar a ordem entre lotes
+        async with self._flush_lock:
+            buffers, self._buffers = self._buffers, {}
+            for channel, messages in buffers.items():
+                try:
+                    await self._send(channel, messages)
+                    self.batches_published += 1
+                    self.messages_published += len(messages)
+                except Exception:
+                    logger.exception("Falha ao publicar %d mensagens em %s", len(messages), channel)
+
+    @abc.abstractmethod
+    async def _send(self, channel: str, messages: List[dict]):
+        """Entrega o lote aos workers; cada backend implementa o transporte"""
+
+    async def _deliver(self, channel: str, messages: List[dict]):
+        self.batches_received += 1
+        try:
+            await self._handler(channel, messages)
+        except Exception:
+            logger.exception("Erro ao processar mensagens do canal %s", channel)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "batches_published": self.batches_published,
+            "messages_published": self.messages_published,
+            "batches_received": self.batches_received
+        }
+
+
+class InMemoryBroker(Broker):
+    """Broker de processo único (desenvolvimento e testes)"""
+
+    async def _send(self, channel: str, messages: List[dict]):
+        await self._deliver(channel, messages)
+
+
+class RedisBroker(Broker):
+    """Broker via Redis pub/sub: cada lote é um PUBLISH com uma lista JSON"""
+
+    def __init__(self, handler: Handler, redis_url: str, channels: List[str],
+                 prefix: str = "tracking", linger_seconds: float = 0.005):
+        super().__init__(handler, linger_seconds)
+        self.redis_url = redis_url
+        self.channels = channels
+        self.prefix = prefix
+        self._client = None
+        self._listener: Optional[asyncio.Task] = None
+
+    def _channel_name(self, channel: str) -> str:
+        return f"{self.prefix}:{channel}"
+
+    async def start(self):
+        import redis.asyncio as aioredis
+
+        self._client = aioredis.from_url(self.redis_url, decode_responses=True)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        await super().stop()
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._client is not None:
+            await self._client.close()
+
+    async def _send(self, channel: str, messages: List[dict]):
+        await self._client.publish(self._channel_name(channel), json.dumps(messages, default=str))
+
+    async def _listen(self):
+        names = {self._channel_name(channel): channel for channel in self.channels}
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.subscribe(*names)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    await self._deliver(names[message["channel"]], json.loads(message["data"]))
+            except asyncio.CancelledError:
+                await pubsub.reset()
+                raise
+            except Exception:
+                logger.exception("Conexão com o Redis pub/sub perdida; reconectando")
+                await pubsub.reset()
+                await asyncio.sleep(1)
+
+
+def create_broker(backend: str, handler: Handler, channels: List[str], redis_url: str,
+                  prefix: str = "tracking", linger_seconds: float = 0.005) -> Broker:
+    if backend == "redis":
+        return RedisBroker(handler, redis_url, channels, prefix, linger_seconds)
+    if backend == "memory":
+        return InMemoryBroker(handler, linger_seconds)
+    raise ValueError(f"Unknown broker backend: {backend}")
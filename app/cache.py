@@ -0,0 +1,327 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ausente do cache (diferente de "sabidamente inexistente", guardado como None)
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class LRUCache:
+    """Cache em processo limitado por número de entradas, com TTL por entrada"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key: str, now: Optional[float] = None):
+        """Valor guardado, None para entrada negativa ou ``_MISSING``"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry.expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = _Entry(value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _Flight:
+    __slots__ = ("event", "value", "failed")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+class TieredCache:
+    """L1 em processo (LRU + TTL) na frente de um Redis opcional (L2).
+
+    Valores são dicts serializáveis em JSON; no Redis ficam como string sob a
+    mesma chave. Sem Redis, ou se ele falhar, o L1 atende sozinho. Resultados
+    vazios do carregador viram entradas negativas de vida curta, e cargas
+    simultâneas da mesma chave são feitas uma única vez.
+    """
+
+    def __init__(self, redis_client=None, ttl: float = 300.0, l1_ttl: Optional[float] = None,
+                 max_entries: int = 10000, negative_ttl: float = 5.0,
+                 observe_rtt: Optional[Callable[[float], None]] = None):
+        self.redis = redis_client
+        # Recebe a duração (s) de cada chamada ao Redis
+        self.observe_rtt = observe_rtt or (lambda seconds: None)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Com Redis, o L1 vive pouco para não servir dados antigos de outros workers
+        self.l1 = LRUCache(max_entries, ttl if redis_client is None or l1_ttl is None else l1_ttl)
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.coalesced_loads = 0
+        self.l2_errors = 0
+
+    def report_l2_error(self, operation: str):
+        self.l2_errors += 1
+        logger.warning("Falha no Redis (%s); usando apenas o cache local", operation, exc_info=True)
+
+    def _lookup(self, key: str):
+        value = self.l1.lookup(key)
+        if value is not _MISSING:
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.l1_hits += 1
+            return value
+        if self.redis is not None:
+            try:
+                start = perf_counter()
+                data = self.redis.get(key)
+                self.observe_rtt(perf_counter() - start)
+            except Exception:
+                self.report_l2_error("get")
+                data = None
+            if data:
+                value = json.loads(data)
+                self.l1.set(key, value)
+                self.l2_hits += 1
+                return value
+        self.misses += 1
+        return _MISSING
+
+    def get(self, key: str):
+        value = self._lookup(key)
+        return None if value is _MISSING else value
+
+    def get_many(self, keys: Iterable[str], chunk_size: int = 1000) -> Dict[str, dict]:
+        """Valores encontrados; as faltas do L1 vão ao Redis em MGETs por lote"""
+        found = {}
+        pending = []
+        now = time.monotonic()
+        for key in keys:
+            value = self.l1.lookup(key, now)
+            if value is _MISSING:
+                pending.append(key)
+            elif value is None:
+                self.negative_hits += 1
+            else:
+                self.l1_hits += 1
+                found[key] = value
+
+        if pending and self.redis is not None:
+            remaining = []
+            for offset in range(0, len(pending), chunk_size):
+                chunk = pending[offset:offset + chunk_size]
+                try:
+                    start = perf_counter()
+                    values = self.redis.mget(chunk)
+                    self.observe_rtt(perf_counter() - start)
+                except Exception:
+                    self.report_l2_error("mget")
+                    remaining.extend(pending[offset:])
+                    break
+                for key, data in zip(chunk, values):
+                    if data:
+                        value = json.loads(data)
+                        self.l1.set(key, value)
+                        found[key] = value
+                        self.l2_hits += 1
+                    else:
+                        remaining.append(key)
+            pending = remaining
+        self.misses += len(pending)
+        return found
+
+    def set(self, key: str, value: dict, ttl: Optional[float] = None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: Dict[str, dict], ttl: Optional[float] = None, pipe=None):
+        """Grava nos dois níveis; com ``pipe``, o chamador executa o pipeline"""
+        ttl = self.ttl if ttl is None else ttl
+        for key, value in items.items():
+            self.l1.set(key, value, min(ttl, self.l1.ttl))
+        if self.redis is None or not items:
+            return
+        execute = pipe is None
+        if execute:
+            pipe = self.redis.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.setex(key, int(ttl), json.dumps(value, default=str))
+        if execute:
+            try:
+                start = perf_counter()
+                pipe.execute()
+                self.observe_rtt(perf_counter() - start)
+            except Exception:
+                self.report_l2_error("set")
+
+    def set_negative(self, key: str):
+        # Só no L1: evita repetir a consulta ao banco para chaves sem dado
+        self.l1.set(key, None, self.negative_ttl)
+
+    def delete(self, key: str):
+        self.l1.delete(key)
+        if self.redis is not None:
+            try:
+                self.redis.delete(key)
+            except Exception:
+                self.report_l2_error("delete")
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[dict]], timeout: float = 10.0):
+        """Lê do cache ou carrega uma única vez, mesmo com chamadas simultâneas"""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self.coalesced_loads += 1
+            if flight.event.wait(timeout) and not flight.failed:
+                return flight.value
+            return loader()
+
+        try:
+            self.loads += 1
+            value = loader()
+            if value is None:
+                self.set_negative(key)
+            else:
+                self.set(key, value)
+            flight.value = value
+            return value
+        except Exception:
+            flight.failed = True
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def get_many_or_load(self, keys: Iterable[str],
+                         loader: Callable[[list], Dict[str, dict]]) -> Dict[str, dict]:
+        """Como ``get_many``, carregando todas as faltas em uma única chamada"""
+        keys = list(keys)
+        found = self.get_many(keys)
+        missing = [key for key in keys if key not in found and self.l1.lookup(key) is not None]
+        if missing:
+            self.loads += 1
+            loaded = loader(missing)
+            self.set_many(loaded)
+            found.update(loaded)
+            for key in missing:
+                if key not in loaded:
+                    self.set_negative(key)
+        return found
+
+    def stats(self) -> dict:
+        lookups = self.l1_hits + self.l2_hits + self.negative_hits + self.misses
+        return {
+            "l2": "redis" if self.redis is not None else None,
+            "l1_entries": len(self.l1),
+            "l1_max_entries": self.l1.max_entries,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else None,
+            "evictions": self.l1.evictions,
+            "expirations": self.l1.expirations,
+            "loads": self.loads,
+            "coalesced_loads": self.coalesced_loads,
+            "l2_errors": self.l2_errors
+        }
+
+
+class FleetVersion:
+    """Contador que muda a cada posição gravada, alteração de cadastro ou de vínculo.
+
+    Fica num hash do Redis (versão e horário da mudança) para ser o mesmo em
+    todos os workers; sem Redis, vale só no processo. Serve de ETag barato
+    para as leituras da frota: conferir o ``If-None-Match`` custa um HMGET,
+    sem consultar banco ou cache de posições.
+    """
+
+    def __init__(self, redis_client, key: str, settle_seconds: float = 0.0):
+        self.redis = redis_client
+        self.key = key
+        # O L1 de cada worker pode servir uma posição antiga por até settle_seconds
+        self.settle_seconds = settle_seconds
+        self._local = 0
+        self._lock = threading.Lock()
+
+    def bump(self, pipe=None):
+        """Nova versão; com ``pipe``, o chamador executa o pipeline"""
+        if self.redis is None:
+            with self._lock:
+                self._local += 1
+            return
+        execute = pipe is None
+        if execute:
+            pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(self.key, "version", 1)
+        pipe.hset(self.key, "changed_at", time.time())
+        if execute:
+            try:
+                pipe.execute()
+            except Exception:
+                logger.warning("Falha ao incrementar a versão da frota", exc_info=True)
+
+    def current(self) -> Optional[int]:
+        """Versão atual, ou None enquanto ela não serve de ETag (Redis fora ou
+        mudança recente que o L1 de algum worker ainda pode não refletir)"""
+        if self.redis is None:
+            return self._local
+        try:
+            version, changed_at = self.redis.hmget(self.key, "version", "changed_at")
+        except Exception:
+            return None
+        if changed_at is not None and time.time() - float(changed_at) < self.settle_seconds:
+            return None
+        return int(version or 0)
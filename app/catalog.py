@@ -0,0 +1,79 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+
+class CatalogCache:
+    """Cache versionado de respostas já serializadas do cadastro de veículos.
+
+    O cadastro muda pouco: cada consulta (filtros + paginação) é serializada
+    uma vez e reaproveitada até a próxima criação, alteração ou remoção, que
+    incrementa a versão e descarta tudo. O ETag é o hash do conteúdo, então
+    continua válido entre workers.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.version = 0
+        self._entries: "OrderedDict[Hashable, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, loader: Callable[[], str]) -> Tuple[str, str]:
+        """Retorna ``(etag, payload)``; ``loader`` produz o JSON em caso de falta"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            version = self.version
+
+        payload = loader()
+        entry = (f'"{hashlib.blake2b(payload.encode(), digest_size=12).hexdigest()}"', payload)
+        with self._lock:
+            # Só guarda se o cadastro não mudou durante a consulta
+            if version == self.version:
+                self._entries[key] = entry
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, propagate: bool = True):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+        if propagate:
+            for listener in self._listeners:
+                listener()
+
+    def on_invalidate(self, listener: Callable[[], None]):
+        """Chamado a cada invalidação local (ex.: avisar os outros workers)"""
+        self._listeners.append(listener)
+
+    @staticmethod
+    def not_modified(etag: str, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        return etag in tags or "*" in tags
+
+    def hit_ratio(self) -> Optional[float]:
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 4) if lookups else None
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+vehicle_catalog = CatalogCache()
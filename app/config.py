@@ -14,6 +14,62 @@ class Settings(BaseSettings):
     # Redis
     REDIS_URL: str = "redis://localhost:6379"
     
+    # Cache da última posição: L1 em memória na frente do Redis (L2)
+    CACHE_TTL_SECONDS: int = 300
+    CACHE_L1_TTL_SECONDS: float = 2.0
+    CACHE_L1_MAX_ENTRIES: int = 100000
+    CACHE_NEGATIVE_TTL_SECONDS: float = 5.0
+    
+    # Veículos sem posição há mais que isso saem do Geo do Redis e do índice da frota
+    GEO_MAX_AGE_SECONDS: int = 300
+    GEO_SWEEP_INTERVAL_SECONDS: int = 30
+    
+    # Trajeto com simplify/max_points: máximo de posições brutas lidas do banco
+    TRACK_MAX_RAW_POINTS: int = 50000
+    
+    # Ingestão em processos separados por vehicle_id % INGEST_SHARDS (0 = desligada).
+    # POST /api/positions/ingest responde 202 e os shards gravam em lotes
+    INGEST_SHARDS: int = 0
+    INGEST_BATCH_SIZE: int = 500
+    INGEST_LINGER_MS: float = 50.0
+    # Fixes pendentes por shard: até INGEST_QUEUE_SIZE lotes de INGEST_BATCH_SIZE
+    INGEST_QUEUE_SIZE: int = 1000
+    
+    # Admissão na ingestão. Token bucket por veículo (0 = sem limite), em memória
+    # ou no Redis (compartilhado entre workers). Acima do limite, "reject"
+    # responde 429 e "decimate" aceita sem gravar; lotes só perdem o excedente
+    INGEST_RATE_LIMIT_PER_SECOND: float = 0.0
+    INGEST_RATE_LIMIT_BURST: int = 10
+    INGEST_RATE_LIMIT_BACKEND: str = "memory"
+    INGEST_OVER_LIMIT_MODE: str = "reject"
+    # Requisições de ingestão simultâneas (0 = sem limite) e fila de espera; além disso, 503
+    INGEST_MAX_CONCURRENCY: int = 64
+    INGEST_MAX_WAITING: int = 256
+    INGEST_QUEUE_TIMEOUT_MS: float = 500.0
+    
+    # Alertas avaliados a cada fix: velocidade por tipo de veículo (encerra abaixo
+    # do limite menos a histerese), parada acima de RULES_IDLE_SECONDS e veículo
+    # sem enviar posição por RULES_OFFLINE_SECONDS (verificado a cada tick)
+    RULES_ENABLED: bool = True
+    RULES_SPEED_LIMIT_CAR_KMH: float = 120.0
+    RULES_SPEED_LIMIT_MOTORCYCLE_KMH: float = 110.0
+    RULES_SPEED_HYSTERESIS_KMH: float = 5.0
+    RULES_IDLE_SECONDS: int = 600
+    RULES_OFFLINE_SECONDS: int = 900
+    RULES_TIMER_TICK_SECONDS: float = 5.0
+    # Estado das regras: "memory" (um único processo) ou "redis" (compartilhado
+    # pelos workers; necessário com mais de um)
+    RULES_STATE_BACKEND: str = "memory"
+    
+    # Profiling sob demanda (desligado por padrão). A captura via
+    # /api/admin/profile exige o cabeçalho X-Admin-Token
+    PROFILING_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.01
+    PROFILING_SLOW_MS: float = 200.0
+    PROFILING_ADMIN_TOKEN: str = ""
+    PROFILING_OUTPUT_DIR: str = "profiles"
+    PROFILING_MAX_SECONDS: int = 60
+    
     # Mapbox
     MAPBOX_ACCESS_TOKEN: str = "your_mapbox_token_here"
     
@@ -22,6 +78,32 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Estatísticas diárias por veículo
+    STATS_FLUSH_INTERVAL_SECONDS: int = 60
+    STATS_MOVING_SPEED_KMH: float = 3.0
+    STATS_MAX_GAP_SECONDS: int = 600
+    # Expiração da última posição de cada veículo no Redis (veículos parados há mais
+    # tempo recomeçam o hodômetro sem o trecho desde a última posição)
+    STATS_LAST_POSITION_TTL_SECONDS: int = 259200
+    
+    # WebSocket: fila de envio por conexão e política para clientes lentos
+    # (drop_oldest, coalesce ou disconnect)
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"
+    WS_SNAPSHOT_CACHE_SECONDS: float = 1.0
+    
+    # WebSocket: heartbeat e conexões ociosas (só o painel) e limites por tipo de cliente
+    WS_PING_INTERVAL_SECONDS: float = 20.0
+    WS_IDLE_TIMEOUT_SECONDS: float = 60.0
+    WS_SEND_TIMEOUT_SECONDS: float = 10.0
+    WS_MAX_MONITORING_CONNECTIONS: int = 1000
+    WS_MAX_VEHICLE_CONNECTIONS: int = 20000
+    
+    # Broker entre workers: "memory" (processo único) ou "redis" (pub/sub)
+    BROKER_BACKEND: str = "memory"
+    BROKER_CHANNEL_PREFIX: str = "tracking"
+    BROKER_BATCH_LINGER_MS: float = 5.0
+    
     class Config:
         env_file = ".env"
 
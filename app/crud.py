@@ -1,15 +1,102 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional
-from datetime import datetime, timedelta
+from sqlalchemy import desc, func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
+import logging
 import redis
 import json
+import time
+import numpy as np
 from app import models, schemas
 from app.config import settings
+from app.assignments import assignment_index, driver_summary
+from app.cache import FleetVersion, TieredCache
+from app.catalog import vehicle_catalog
+from app.metrics import FIXES_INGESTED, REDIS_RTT, observe_stage, registry
+from app.redis_client import redis_client
+from app.geo import GEOHASH_PRECISION, geohash_encode, geohash_query_cells, haversine_km_np, radius_bbox
+from app.fleet_index import fleet_index
+from app.rules import rule_engine
+from app.stats import stats_aggregator, to_epoch
 
+logger = logging.getLogger(__name__)
+
+# Hodômetro: última posição de cada veículo compartilhada entre os processos
+if redis_client is not None:
+    stats_aggregator.use_redis(redis_client)
+    # Regras com um único estado por veículo entre os workers
+    if settings.RULES_STATE_BACKEND == "redis":
+        rule_engine.use_redis(redis_client)
+
+# Última posição de cada veículo (chave vehicle:{id}:position)
+position_cache = TieredCache(
+    redis_client,
+    ttl=settings.CACHE_TTL_SECONDS,
+    l1_ttl=settings.CACHE_L1_TTL_SECONDS,
+    max_entries=settings.CACHE_L1_MAX_ENTRIES,
+    negative_ttl=settings.CACHE_NEGATIVE_TTL_SECONDS,
+    observe_rtt=REDIS_RTT.observe
+)
+
+
+# Versão da frota para os ETags das leituras de posição (ver FleetVersion)
+fleet_version = FleetVersion(redis_client, "vehicles:version", settle_seconds=position_cache.l1.ttl)
+vehicle_catalog.on_invalidate(fleet_version.bump)
+assignment_index.on_change(lambda vehicle_id, summary: fleet_version.bump())
+
+
+def position_key(vehicle_id: int) -> str:
+    return f"vehicle:{vehicle_id}:position"
+
+
+def position_message(vehicle, position: schemas.PositionCreate, timestamp: datetime) -> dict:
+    """Dados de uma mensagem ``position_update``"""
+    return {
+        "vehicle_id": vehicle.id,
+        "license_plate": vehicle.license_plate,
+        "vehicle_type": vehicle.vehicle_type,
+        "status": vehicle.status,
+        "latitude": position.latitude,
+        "longitude": position.longitude,
+        "speed": position.speed,
+        "heading": position.heading,
+        "timestamp": timestamp.isoformat()
+    }
+
+
+registry.collector(
+    "tracking_cache_lookups_total", "counter", "Consultas ao cache de posições por resultado",
+    lambda: [({"result": result}, position_cache.stats()[result])
+             for result in ("l1_hits", "l2_hits", "negative_hits", "misses")]
+)
+registry.collector(
+    "tracking_cache_hit_ratio", "gauge", "Fração das consultas ao cache de posições atendidas",
+    lambda: [({"cache": "positions"}, position_cache.stats()["hit_ratio"]),
+             ({"cache": "catalog"}, vehicle_catalog.hit_ratio())]
+)
+registry.collector(
+    "tracking_cache_evictions_total", "counter", "Entradas descartadas do L1 por limite de tamanho",
+    lambda: [({}, position_cache.l1.evictions)]
+)
+
+
+# Geo e horário da última posição recebida (epoch) de cada veículo
+GEO_KEY = "vehicles:locations"
+LAST_SEEN_KEY = "vehicles:last_seen"
+
+# Remove um lote de membros antigos dos dois conjuntos de forma atômica,
+# para não apagar um veículo que acabou de enviar posição
+_SWEEP_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+    redis.call('ZREM', KEYS[2], unpack(ids))
+end
+return #ids
+"""
+_sweep_stale = redis_client.register_script(_SWEEP_SCRIPT) if redis_client is not None else None
 
-# Redis client
-redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
 
 class VehicleCRUD:
     @staticmethod
@@ -21,8 +108,33 @@ class VehicleCRUD:
         return db.query(models.Vehicle).filter(models.Vehicle.license_plate == license_plate).first()
     
     @staticmethod
-    def get_vehicles(db: Session, skip: int = 0, limit: int = 100):
-        return db.query(models.Vehicle).offset(skip).limit(limit).all()
+    def get_vehicles_by_ids(db: Session, vehicle_ids):
+        return db.query(models.Vehicle).filter(models.Vehicle.id.in_(vehicle_ids)).all()
+    
+    @staticmethod
+    def get_vehicle_ids(db: Session, vehicle_ids=None, vehicle_type=None, status=None):
+        query = db.query(models.Vehicle.id)
+        if vehicle_ids is not None:
+            query = query.filter(models.Vehicle.id.in_(vehicle_ids))
+        if vehicle_type is not None:
+            query = query.filter(models.Vehicle.vehicle_type == vehicle_type)
+        if status is not None:
+            query = query.filter(models.Vehicle.status == status)
+        return [row[0] for row in query.order_by(models.Vehicle.id)]
+    
+    @staticmethod
+    def get_vehicles(db: Session, skip: int = 0, limit: int = 100, vehicle_type=None,
+                     status=None, plate_prefix: Optional[str] = None):
+        query = db.query(models.Vehicle)
+        if vehicle_type is not None:
+            query = query.filter(models.Vehicle.vehicle_type == vehicle_type)
+        if status is not None:
+            query = query.filter(models.Vehicle.status == status)
+        if plate_prefix:
+            escaped = plate_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.filter(models.Vehicle.license_plate.like(f"{escaped}%", escape="\\"))
+        # Ordem estável para a paginação
+        return query.order_by(models.Vehicle.id).offset(skip).limit(limit).all()
     
     @staticmethod
     def create_vehicle(db: Session, vehicle: schemas.VehicleCreate):
@@ -30,6 +142,7 @@ class VehicleCRUD:
         db.add(db_vehicle)
         db.commit()
         db.refresh(db_vehicle)
+        vehicle_catalog.invalidate()
         return db_vehicle
     
     @staticmethod
@@ -41,53 +154,178 @@ class VehicleCRUD:
                 setattr(db_vehicle, field, value)
             db.commit()
             db.refresh(db_vehicle)
+            fleet_index.set_vehicle(db_vehicle)
+            vehicle_catalog.invalidate()
         return db_vehicle
     
     @staticmethod
     def delete_vehicle(db: Session, vehicle_id: int):
         db_vehicle = VehicleCRUD.get_vehicle(db, vehicle_id)
         if db_vehicle:
+            db.query(models.VehicleAssignment).filter(
+                models.VehicleAssignment.vehicle_id == vehicle_id
+            ).delete(synchronize_session=False)
             db.delete(db_vehicle)
             db.commit()
+            stats_aggregator.forget(vehicle_id)
+            rule_engine.forget(vehicle_id)
+            fleet_index.remove(vehicle_id)
+            position_cache.delete(position_key(vehicle_id))
+            PositionCRUD.remove_locations([vehicle_id])
+            vehicle_catalog.invalidate()
+            if assignment_index.get(vehicle_id) is not None:
+                assignment_index.set(vehicle_id, None)
         return db_vehicle
 
 
 class PositionCRUD:
+    @staticmethod
+    def _cache_positions(items):
+        """Grava no cache e no Geo do Redis; ``items`` é [(vehicle, position, timestamp)]"""
+        pipe = redis_client.pipeline(transaction=False) if redis_client is not None else None
+        position_cache.set_many({
+            position_key(vehicle.id): PositionCRUD._cached_position(vehicle, position, timestamp)
+            for vehicle, position, timestamp in items
+        }, pipe=pipe)
+        if not items:
+            return
+        fleet_version.bump(pipe)
+        if pipe is None:
+            return
+        # Adicionar ao GeoRedis para consultas espaciais, com o horário para a expiração
+        for vehicle, position, _ in items:
+            pipe.geoadd(GEO_KEY, (position.longitude, position.latitude, vehicle.id))
+        pipe.zadd(LAST_SEEN_KEY, {vehicle.id: time.time() for vehicle, _, _ in items})
+        try:
+            start = time.perf_counter()
+            pipe.execute()
+            REDIS_RTT.observe_since(start)
+        except redis.RedisError:
+            position_cache.report_l2_error("pipeline")
+    
+    @staticmethod
+    def _cached_position(vehicle: models.Vehicle, position: schemas.PositionCreate, timestamp: datetime) -> dict:
+        redis_position = schemas.RedisPosition(
+            vehicle_id=vehicle.id,
+            license_plate=vehicle.license_plate,
+            vehicle_type=vehicle.vehicle_type,
+            latitude=position.latitude,
+            longitude=position.longitude,
+            speed=position.speed,
+            heading=position.heading,
+            timestamp=timestamp
+        )
+        # Mesmo formato usado desde o início no Redis
+        return json.loads(json.dumps(redis_position.model_dump(), default=str))
+    
     @staticmethod
     def create_position(db: Session, position: schemas.PositionCreate):
-        db_position = models.VehiclePosition(**position.model_dump())
+        start = time.perf_counter()
+        db_position = models.VehiclePosition(
+            **position.model_dump(exclude_none=True),
+            geohash=geohash_encode(position.latitude, position.longitude)
+        )
         db.add(db_position)
         db.commit()
         db.refresh(db_position)
+        observe_stage("db", start)
+        FIXES_INGESTED.inc()
+        
+        stats_aggregator.record(
+            position.vehicle_id,
+            position.latitude,
+            position.longitude,
+            position.speed,
+            db_position.timestamp
+        )
         
-        # Cache no Redis
+        # Cache da última posição
         vehicle = VehicleCRUD.get_vehicle(db, position.vehicle_id)
         if vehicle:
-            redis_position = schemas.RedisPosition(
-                vehicle_id=vehicle.id,
-                license_plate=vehicle.license_plate,
-                vehicle_type=vehicle.vehicle_type,
-                latitude=position.latitude,
-                longitude=position.longitude,
-                speed=position.speed,
-                heading=position.heading,
-                timestamp=db_position.timestamp
-            )
-            redis_key = f"vehicle:{vehicle.id}:position"
-            redis_client.setex(
-                redis_key,
-                timedelta(minutes=5),
-                json.dumps(redis_position.model_dump(), default=str)
+            fleet_index.update(
+                vehicle, position.latitude, position.longitude,
+                position.speed, position.heading, db_position.timestamp
             )
+            start = time.perf_counter()
+            PositionCRUD._cache_positions([(vehicle, position, db_position.timestamp)])
+            observe_stage("redis", start)
             
-            # Adicionar ao GeoRedis para consultas espaciais
-            redis_client.geoadd(
-                "vehicles:locations",
-                (position.longitude, position.latitude, vehicle.id)
+            # Regras de alerta no próprio fix, no processo que o gravou
+            AlertCRUD.evaluate_positions(
+                db, [vehicle.id], [vehicle.vehicle_type], [position.speed], [db_position.timestamp]
             )
         
         return db_position
     
+    @staticmethod
+    def create_positions_bulk(db: Session, positions: List[schemas.PositionCreate], vehicles: dict,
+                              evaluate_rules: bool = True, newer_than: Optional[Dict[int, float]] = None):
+        """Insere um lote de posições com um único commit.
+        
+        ``vehicles`` mapeia vehicle_id -> Vehicle já carregado pelo chamador.
+        Retorna, por veículo, o fix mais recente do lote. Com
+        ``evaluate_rules=False`` as regras ficam com o chamador (shards).
+        ``newer_than`` (vehicle_id -> epoch do último fix já gravado) deixa
+        fora do cache e do retorno os veículos cujo lote só tem fixes atrasados.
+        """
+        received_at = datetime.now(timezone.utc)
+        timestamps = [position.timestamp or received_at for position in positions]
+        start = time.perf_counter()
+        db.add_all([
+            models.VehiclePosition(
+                **position.model_dump(exclude={"timestamp"}),
+                timestamp=timestamp,
+                geohash=geohash_encode(position.latitude, position.longitude)
+            )
+            for position, timestamp in zip(positions, timestamps)
+        ])
+        db.commit()
+        observe_stage("db", start)
+        FIXES_INGESTED.inc(len(positions))
+        
+        stats_aggregator.record_batch(
+            [position.vehicle_id for position in positions],
+            [position.latitude for position in positions],
+            [position.longitude for position in positions],
+            [position.speed for position in positions],
+            timestamps
+        )
+        
+        latest = {}
+        for position, timestamp in zip(positions, timestamps):
+            current = latest.get(position.vehicle_id)
+            if current is None or to_epoch(timestamp) >= to_epoch(current[1]):
+                latest[position.vehicle_id] = (position, timestamp)
+        if newer_than:
+            latest = {
+                vehicle_id: item for vehicle_id, item in latest.items()
+                if to_epoch(item[1]) > newer_than.get(vehicle_id, float("-inf"))
+            }
+        
+        # Cache apenas da última posição de cada veículo
+        for vehicle_id, (position, timestamp) in latest.items():
+            fleet_index.update(
+                vehicles[vehicle_id], position.latitude, position.longitude,
+                position.speed, position.heading, timestamp
+            )
+        start = time.perf_counter()
+        PositionCRUD._cache_positions([
+            (vehicles[vehicle_id], position, timestamp)
+            for vehicle_id, (position, timestamp) in latest.items()
+        ])
+        observe_stage("redis", start)
+        
+        if evaluate_rules:
+            AlertCRUD.evaluate_positions(
+                db,
+                [position.vehicle_id for position in positions],
+                [vehicles[position.vehicle_id].vehicle_type for position in positions],
+                [position.speed for position in positions],
+                timestamps
+            )
+        
+        return latest
+    
     @staticmethod
     def get_latest_position(db: Session, vehicle_id: int):
         return db.query(models.VehiclePosition).filter(
@@ -95,16 +333,64 @@ class PositionCRUD:
         ).order_by(desc(models.VehiclePosition.timestamp)).first()
     
     @staticmethod
-    def get_vehicle_positions(db: Session, vehicle_id: int, limit: int = 100):
-        return db.query(models.VehiclePosition).filter(
+    def get_latest_positions(db: Session, vehicle_ids) -> dict:
+        """Última posição de vários veículos em uma única consulta"""
+        vp = models.VehiclePosition
+        latest = db.query(
+            vp.vehicle_id, func.max(vp.timestamp).label("timestamp")
+        ).filter(vp.vehicle_id.in_(vehicle_ids)).group_by(vp.vehicle_id).subquery()
+        rows = db.query(
+            vp.vehicle_id, models.Vehicle.license_plate, models.Vehicle.vehicle_type,
+            vp.latitude, vp.longitude, vp.speed, vp.heading, vp.timestamp
+        ).join(
+            latest, (vp.vehicle_id == latest.c.vehicle_id) & (vp.timestamp == latest.c.timestamp)
+        ).join(models.Vehicle, models.Vehicle.id == vp.vehicle_id).all()
+        return {
+            row.vehicle_id: schemas.RedisPosition.model_validate(row._asdict()).model_dump(mode="json")
+            for row in rows
+        }
+    
+    @staticmethod
+    def get_vehicle_positions(db: Session, vehicle_id: int, limit: int = 100,
+                              since: Optional[datetime] = None, until: Optional[datetime] = None):
+        """Posições mais recentes primeiro, pelo índice (vehicle_id, timestamp)"""
+        query = db.query(models.VehiclePosition).filter(
             models.VehiclePosition.vehicle_id == vehicle_id
-        ).order_by(desc(models.VehiclePosition.timestamp)).limit(limit).all()
+        )
+        if since is not None:
+            query = query.filter(models.VehiclePosition.timestamp >= since)
+        if until is not None:
+            query = query.filter(models.VehiclePosition.timestamp <= until)
+        return query.order_by(desc(models.VehiclePosition.timestamp)).limit(limit).all()
+    
+    @staticmethod
+    def get_vehicle_track(db: Session, vehicle_id: int, limit: int = 100,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None):
+        """Últimas posições como tuplas de colunas, em ordem cronológica"""
+        vp = models.VehiclePosition
+        query = db.query(
+            vp.id, vp.vehicle_id, vp.latitude, vp.longitude,
+            vp.speed, vp.heading, vp.accuracy, vp.timestamp
+        ).filter(vp.vehicle_id == vehicle_id)
+        if since is not None:
+            query = query.filter(vp.timestamp >= since)
+        if until is not None:
+            query = query.filter(vp.timestamp <= until)
+        rows = query.order_by(desc(vp.timestamp)).limit(limit).all()
+        rows.reverse()
+        return rows
     
     @staticmethod
     def get_positions_in_area(lat: float, lng: float, radius_km: float = 5):
-        """Busca veículos em um raio usando Redis Geo"""
+        """Busca veículos em um raio usando Redis Geo (ou o índice da frota, sem Redis)"""
+        if redis_client is None:
+            return [
+                dict(entry.to_dict(), distance=round(distance, 4), coordinates=[entry.longitude, entry.latitude])
+                for entry, distance in fleet_index.nearest(lat, lng, k=max(len(fleet_index), 1), max_radius_km=radius_km)
+            ]
+        
         results = redis_client.georadius(
-            "vehicles:locations",
+            GEO_KEY,
             lng,
             lat,
             radius_km,
@@ -113,16 +399,17 @@ class PositionCRUD:
             withcoord=True
         )
         
+        # Dados completos em uma única leitura do cache
+        cached = position_cache.get_many([position_key(int(result[0])) for result in results])
         vehicles_in_area = []
         for result in results:
             vehicle_id = int(result[0])
             distance = result[1]
             coordinates = result[2]
             
-            # Buscar dados completos do Redis
-            redis_data = redis_client.get(f"vehicle:{vehicle_id}:position")
-            if redis_data:
-                vehicle_data = json.loads(redis_data)
+            vehicle_data = cached.get(position_key(vehicle_id))
+            if vehicle_data:
+                vehicle_data = dict(vehicle_data)
                 vehicle_data["distance"] = distance
                 vehicle_data["coordinates"] = coordinates
                 vehicles_in_area.append(vehicle_data)
@@ -130,9 +417,392 @@ class PositionCRUD:
         return vehicles_in_area
     
     @staticmethod
-    def get_cached_position(vehicle_id: int):
-        """Busca posição do cache Redis"""
-        redis_data = redis_client.get(f"vehicle:{vehicle_id}:position")
-        if redis_data:
-            return json.loads(redis_data)
-        return None
\ No newline at end of file
+    def remove_locations(vehicle_ids):
+        if redis_client is None or not vehicle_ids:
+            return
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zrem(GEO_KEY, *vehicle_ids)
+        pipe.zrem(LAST_SEEN_KEY, *vehicle_ids)
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            # Chamado depois do commit: a varredura do Geo tira os membros que sobrarem
+            logger.warning("Falha ao remover %d veículos do Geo do Redis", len(vehicle_ids), exc_info=True)
+    
+    @staticmethod
+    def reconcile_last_seen(chunk_size: int = 1000) -> int:
+        """Dá horário de última posição aos membros do Geo que não têm (gravados
+        antes da expiração existir); sem isso a varredura nunca os remove"""
+        if redis_client is None:
+            return 0
+        now = time.time()
+        added = 0
+        start = 0
+        while True:
+            chunk = redis_client.zrange(GEO_KEY, start, start + chunk_size - 1)
+            if not chunk:
+                return added
+            # NX: não mexe em quem já tem horário
+            added += redis_client.zadd(LAST_SEEN_KEY, dict.fromkeys(chunk, now), nx=True)
+            start += chunk_size
+    
+    @staticmethod
+    def sweep_stale_locations(max_age_seconds: float, batch_size: int = 1000) -> int:
+        """Tira do Geo (e do índice em memória) os veículos sem posição recente"""
+        removed = fleet_index.expire(max_age_seconds)
+        if _sweep_stale is None:
+            return removed
+        cutoff = time.time() - max_age_seconds
+        while True:
+            count = _sweep_stale(keys=[LAST_SEEN_KEY, GEO_KEY], args=[cutoff, batch_size])
+            removed += count
+            if count < batch_size:
+                return removed
+    
+    @staticmethod
+    def search_history(db: Session, lat: float, lng: float, radius_m: float,
+                       start: datetime, end: datetime):
+        """Quem esteve num raio em torno do ponto durante o intervalo.
+        
+        Expande a área em células geohash, faz uma busca no índice de cobertura
+        por célula e refina com a distância exata.
+        """
+        vp = models.VehiclePosition
+        radius_km = radius_m / 1000
+        columns = (vp.vehicle_id, vp.latitude, vp.longitude, vp.timestamp)
+        
+        rows = []
+        for cell in geohash_query_cells(radius_bbox(lat, lng, radius_km)):
+            query = db.query(*columns).filter(vp.timestamp >= start, vp.timestamp <= end)
+            if len(cell) == GEOHASH_PRECISION:
+                query = query.filter(vp.geohash == cell)
+            else:
+                # Célula mais grossa que a gravada: faixa de prefixo no índice
+                query = query.filter(vp.geohash >= cell, vp.geohash < cell + "~")
+            rows.extend(query.all())
+        
+        if not rows:
+            return []
+        
+        vehicle_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        lats = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+        lngs = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+        distances = haversine_km_np(lat, lng, lats, lngs) * 1000
+        
+        matches = {}
+        for i in np.nonzero(distances <= radius_m)[0].tolist():
+            vehicle_id = int(vehicle_ids[i])
+            timestamp = rows[i][3]
+            match = matches.get(vehicle_id)
+            if match is None:
+                matches[vehicle_id] = {
+                    "vehicle_id": vehicle_id,
+                    "first_seen": timestamp,
+                    "last_seen": timestamp,
+                    "closest_distance_m": float(distances[i]),
+                    "fix_count": 1
+                }
+                continue
+            match["first_seen"] = min(match["first_seen"], timestamp)
+            match["last_seen"] = max(match["last_seen"], timestamp)
+            match["closest_distance_m"] = min(match["closest_distance_m"], float(distances[i]))
+            match["fix_count"] += 1
+        
+        return sorted(matches.values(), key=lambda m: m["closest_distance_m"])
+    
+    @staticmethod
+    def warm_fleet_index(db: Session, chunk_size: int = 1000):
+        """Carrega no índice em memória as posições ainda presentes no cache Redis"""
+        if redis_client is None:
+            return 0
+        vehicle_ids = [int(member) for member in redis_client.zrange(GEO_KEY, 0, -1)]
+        loaded = 0
+        for start in range(0, len(vehicle_ids), chunk_size):
+            chunk = vehicle_ids[start:start + chunk_size]
+            cached = position_cache.get_many([position_key(vehicle_id) for vehicle_id in chunk])
+            vehicles = {v.id: v for v in VehicleCRUD.get_vehicles_by_ids(db, chunk)}
+            for vehicle_id in chunk:
+                position = cached.get(position_key(vehicle_id))
+                if position is None or vehicle_id not in vehicles:
+                    continue
+                fleet_index.update(
+                    vehicles[vehicle_id],
+                    position["latitude"],
+                    position["longitude"],
+                    position.get("speed"),
+                    position.get("heading"),
+                    datetime.fromisoformat(position["timestamp"])
+                )
+                loaded += 1
+        return loaded
+    
+    @staticmethod
+    def get_latest_positions_cached(db: Session, vehicle_ids) -> dict:
+        """Última posição de vários veículos: cache (L1 e MGET) e uma consulta para as faltas"""
+        def load(keys):
+            ids = [int(key.split(":")[1]) for key in keys]
+            return {position_key(vid): data for vid, data in PositionCRUD.get_latest_positions(db, ids).items()}
+        
+        found = position_cache.get_many_or_load([position_key(vid) for vid in vehicle_ids], load)
+        return {vid: found[position_key(vid)] for vid in vehicle_ids if position_key(vid) in found}
+    
+    @staticmethod
+    def get_cached_position(db: Session, vehicle_id: int):
+        """Última posição do cache; em falta, do banco (uma carga por vez por veículo)"""
+        return position_cache.get_or_load(
+            position_key(vehicle_id),
+            lambda: PositionCRUD.get_latest_positions(db, [vehicle_id]).get(vehicle_id)
+        )
+
+
+class StatsCRUD:
+    @staticmethod
+    def get_daily_stats(db: Session, vehicle_id: int, date_from, date_to):
+        return db.query(models.VehicleDailyStats).filter(
+            models.VehicleDailyStats.vehicle_id == vehicle_id,
+            models.VehicleDailyStats.day >= date_from,
+            models.VehicleDailyStats.day <= date_to
+        ).order_by(models.VehicleDailyStats.day).all()
+
+
+
+class CommandCRUD:
+    @staticmethod
+    def create_command(db: Session, vehicle_id: int, command: schemas.VehicleCommandCreate):
+        db_command = models.VehicleCommand(vehicle_id=vehicle_id, **command.model_dump())
+        db.add(db_command)
+        db.commit()
+        db.refresh(db_command)
+        return db_command
+    
+    @staticmethod
+    def get_commands(db: Session, vehicle_id: int, status: Optional[models.CommandStatus] = None, limit: int = 100):
+        query = db.query(models.VehicleCommand).filter(models.VehicleCommand.vehicle_id == vehicle_id)
+        if status is not None:
+            query = query.filter(models.VehicleCommand.status == status)
+        return query.order_by(desc(models.VehicleCommand.id)).limit(limit).all()
+    
+    @staticmethod
+    def get_pending_commands(db: Session, vehicle_id: int):
+        return db.query(models.VehicleCommand).filter(
+            models.VehicleCommand.vehicle_id == vehicle_id,
+            models.VehicleCommand.status == models.CommandStatus.PENDING
+        ).order_by(models.VehicleCommand.id).all()
+    
+    @staticmethod
+    def ack_command(db: Session, vehicle_id: int, command_id: int):
+        db_command = db.query(models.VehicleCommand).filter(
+            models.VehicleCommand.id == command_id,
+            models.VehicleCommand.vehicle_id == vehicle_id
+        ).first()
+        if db_command and db_command.status != models.CommandStatus.ACKED:
+            db_command.status = models.CommandStatus.ACKED
+            db_command.acked_at = datetime.now(timezone.utc)
+            db.commit()
+        return db_command
+
+
+class DriverCRUD:
+    @staticmethod
+    def get_driver(db: Session, driver_id: int):
+        return db.query(models.Driver).filter(models.Driver.id == driver_id).first()
+    
+    @staticmethod
+    def get_driver_by_email(db: Session, email: str):
+        return db.query(models.Driver).filter(models.Driver.email == email).first()
+    
+    @staticmethod
+    def get_drivers(db: Session, skip: int = 0, limit: int = 100, is_active: Optional[bool] = None):
+        query = db.query(models.Driver)
+        if is_active is not None:
+            query = query.filter(models.Driver.is_active == is_active)
+        return query.order_by(models.Driver.id).offset(skip).limit(limit).all()
+    
+    @staticmethod
+    def create_driver(db: Session, driver: schemas.DriverCreate):
+        db_driver = models.Driver(**driver.model_dump())
+        db.add(db_driver)
+        db.commit()
+        db.refresh(db_driver)
+        return db_driver
+    
+    @staticmethod
+    def update_driver(db: Session, driver_id: int, driver_update: schemas.DriverUpdate):
+        db_driver = DriverCRUD.get_driver(db, driver_id)
+        if db_driver:
+            for field, value in driver_update.model_dump(exclude_unset=True).items():
+                setattr(db_driver, field, value)
+            db.commit()
+            db.refresh(db_driver)
+            assignment_index.update_driver(driver_summary(db_driver))
+        return db_driver
+
+
+class AssignmentCRUD:
+    @staticmethod
+    def get_active_assignment(db: Session, vehicle_id: int):
+        """Vínculo ativo do veículo, pelo índice (vehicle_id, is_active)"""
+        return db.query(models.VehicleAssignment).filter(
+            models.VehicleAssignment.vehicle_id == vehicle_id,
+            models.VehicleAssignment.is_active.is_(True)
+        ).first()
+    
+    @staticmethod
+    def get_assignments(db: Session, vehicle_id: int, limit: int = 100):
+        return db.query(models.VehicleAssignment).filter(
+            models.VehicleAssignment.vehicle_id == vehicle_id
+        ).order_by(desc(models.VehicleAssignment.id)).limit(limit).all()
+    
+    @staticmethod
+    def _close_active(db: Session, column, value, now: datetime) -> List[int]:
+        """Encerra os vínculos ativos (do veículo ou do motorista); retorna os veículos afetados"""
+        active = db.query(models.VehicleAssignment).filter(
+            column == value, models.VehicleAssignment.is_active.is_(True)
+        ).all()
+        for assignment in active:
+            assignment.is_active = False
+            assignment.unassigned_at = now
+        return [assignment.vehicle_id for assignment in active]
+    
+    @staticmethod
+    def assign_driver(db: Session, vehicle_id: int, driver):
+        """Vincula o motorista ao veículo, encerrando o vínculo anterior de ambos"""
+        now = datetime.now(timezone.utc)
+        released = AssignmentCRUD._close_active(db, models.VehicleAssignment.vehicle_id, vehicle_id, now)
+        released += AssignmentCRUD._close_active(db, models.VehicleAssignment.driver_id, driver.id, now)
+        db_assignment = models.VehicleAssignment(
+            vehicle_id=vehicle_id, driver_id=driver.id, assigned_at=now, is_active=True
+        )
+        db.add(db_assignment)
+        db.commit()
+        db.refresh(db_assignment)
+        for released_vehicle in set(released) - {vehicle_id}:
+            assignment_index.set(released_vehicle, None)
+        assignment_index.set(vehicle_id, driver_summary(driver))
+        return db_assignment
+    
+    @staticmethod
+    def unassign_driver(db: Session, vehicle_id: int) -> bool:
+        released = AssignmentCRUD._close_active(
+            db, models.VehicleAssignment.vehicle_id, vehicle_id, datetime.now(timezone.utc)
+        )
+        if not released:
+            return False
+        db.commit()
+        assignment_index.set(vehicle_id, None)
+        return True
+    
+    @staticmethod
+    def get_current_driver(db: Session, vehicle_id: int) -> Optional[dict]:
+        """Motorista atual: do índice em memória ou, antes de carregá-lo, do banco"""
+        if assignment_index.loaded:
+            return assignment_index.get(vehicle_id)
+        assignment = AssignmentCRUD.get_active_assignment(db, vehicle_id)
+        if assignment is None or assignment.driver is None:
+            return None
+        return driver_summary(assignment.driver)
+    
+    @staticmethod
+    def warm_assignment_index(db: Session) -> int:
+        """Carrega todos os vínculos ativos em uma consulta"""
+        rows = db.query(models.VehicleAssignment.vehicle_id, models.Driver).join(
+            models.Driver, models.Driver.id == models.VehicleAssignment.driver_id
+        ).filter(models.VehicleAssignment.is_active.is_(True)).all()
+        assignment_index.load(rows)
+        return len(rows)
+
+
+class AlertCRUD:
+    @staticmethod
+    def get_alerts(db: Session, vehicle_id: Optional[int] = None, rule: Optional[models.AlertType] = None,
+                   is_active: Optional[bool] = None, skip: int = 0, limit: int = 100):
+        query = db.query(models.VehicleAlert)
+        if vehicle_id is not None:
+            query = query.filter(models.VehicleAlert.vehicle_id == vehicle_id)
+        if rule is not None:
+            query = query.filter(models.VehicleAlert.rule == rule)
+        if is_active is not None:
+            query = query.filter(models.VehicleAlert.is_active.is_(is_active))
+        return query.order_by(desc(models.VehicleAlert.id)).offset(skip).limit(limit).all()
+    
+    @staticmethod
+    def evaluate_positions(db: Session, vehicle_ids: List[int], vehicle_types: list, speeds: list,
+                           timestamps: List[datetime]) -> List[dict]:
+        """Regras de alerta para fixes gravados: "sem sinal" e depois velocidade e parada"""
+        # Recebido agora: conta para "sem sinal" mesmo que o fix seja antigo
+        rule_engine.touch_many(dict.fromkeys(vehicle_ids))
+        events = rule_engine.evaluate_batch(vehicle_ids, vehicle_types, speeds, timestamps)
+        return AlertCRUD.apply_events(db, events) if events else []
+    
+    @staticmethod
+    def apply_events(db: Session, events: List[dict]) -> List[dict]:
+        """Grava os eventos do motor de regras e publica os alertas alterados.
+        
+        Um alerta já ativo no banco não é aberto de novo (o índice único parcial
+        cobre a corrida entre workers); encerrar só afeta o alerta ativo.
+        """
+        try:
+            changed = AlertCRUD._apply_events(db, events)
+        except SQLAlchemyError:
+            # A posição já foi gravada: falha nos alertas não derruba a ingestão
+            db.rollback()
+            logger.exception("Falha ao gravar %d eventos de alerta", len(events))
+            return []
+        if changed:
+            rule_engine.publish(changed)
+        return changed
+    
+    @staticmethod
+    def _apply_events(db: Session, events: List[dict]) -> List[dict]:
+        vehicle_ids = {event["vehicle_id"] for event in events}
+        active = {
+            (alert.vehicle_id, alert.rule.value): alert
+            for alert in db.query(models.VehicleAlert).filter(
+                models.VehicleAlert.vehicle_id.in_(vehicle_ids),
+                models.VehicleAlert.is_active.is_(True)
+            )
+        }
+        known = {row[0] for row in db.query(models.Vehicle.id).filter(models.Vehicle.id.in_(vehicle_ids))}
+        changed = []
+        for event in events:
+            key = (event["vehicle_id"], event["rule"])
+            if event["state"] == "resolved":
+                alert = active.pop(key, None)
+                if alert is not None:
+                    alert.is_active = False
+                    alert.resolved_at = event["at"]
+                    changed.append(schemas.VehicleAlert.model_validate(alert).model_dump(mode="json"))
+            elif key not in active and event["vehicle_id"] in known:
+                alert = models.VehicleAlert(
+                    vehicle_id=event["vehicle_id"], rule=models.AlertType(event["rule"]),
+                    value=event["value"], started_at=event["at"], is_active=True
+                )
+                try:
+                    with db.begin_nested():
+                        db.add(alert)
+                except IntegrityError:
+                    # Aberto por outro worker entre a consulta e a gravação
+                    continue
+                active[key] = alert
+                changed.append(schemas.VehicleAlert.model_validate(alert).model_dump(mode="json"))
+        if changed:
+            db.commit()
+        return changed
+    
+    @staticmethod
+    def warm_rule_engine(db: Session) -> int:
+        """Alertas ativos do banco e última posição da frota (para "sem sinal")"""
+        for entry in fleet_index.entries():
+            rule_engine.touch(entry.vehicle_id, to_epoch(entry.timestamp) if entry.timestamp else None)
+        # Depois do touch, para não encerrar "sem sinal" de quem continua parado
+        rows = db.query(models.VehicleAlert.vehicle_id, models.VehicleAlert.rule).filter(
+            models.VehicleAlert.is_active.is_(True)
+        ).all()
+        rule_engine.load_active(rows)
+        return len(rows)
+    
+    @staticmethod
+    def check_offline(db: Session) -> List[dict]:
+        """Avança a roda de "sem sinal" e grava o que mudou"""
+        events = rule_engine.poll()
+        return AlertCRUD.apply_events(db, events) if events else []
@@ -1,7 +1,10 @@
+import time
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.metrics import DB_POOL_CHECKOUT
+from app.profiling import add_span
 
 # Usar SQLite por padrão, com opção de PostgreSQL
 if settings.POSTGRES_URL:
@@ -25,6 +28,12 @@ Base = declarative_base()
 def get_db():
     db = SessionLocal()
     try:
+        # Obtém a conexão já aqui para medir a espera pelo pool
+        start = time.perf_counter()
+        db.connection()
+        elapsed = time.perf_counter() - start
+        DB_POOL_CHECKOUT.observe(elapsed)
+        add_span("pool", elapsed)
         yield db
     finally:
         db.close()
\ No newline at end of file
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaStream:
+    """Modo coalescido de um cliente de monitoramento.
+
+    Guarda o estado mais recente de cada veículo alterado desde o último tick
+    e, a cada tick, envia um único frame ``position_delta`` apenas com os
+    campos que mudaram em relação ao que o cliente já recebeu. Posições
+    intermediárias substituídas no mesmo tick são descartadas.
+
+    Se um frame não chega ao cliente (descartado ou substituído na fila de
+    envio), ``resync`` faz o próximo tick reenviar o estado completo.
+    """
+
+    def __init__(self, emit: Callable[[str], bool], tick_seconds: float = 0.25):
+        self._emit = emit
+        self.tick_seconds = tick_seconds
+        self._pending: Dict[int, dict] = {}
+        self._sent: Dict[int, dict] = {}
+        self._task = None
+        # Frame completo sendo enfileirado: substituir o anterior não perde nada
+        self._emitting_full = False
+        self.frames_sent = 0
+        self.updates_coalesced = 0
+        self.resyncs = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def update(self, position_data: dict):
+        vehicle_id = position_data["vehicle_id"]
+        if vehicle_id in self._pending:
+            self.updates_coalesced += 1
+        self._pending[vehicle_id] = position_data
+
+    def resync(self):
+        """O cliente perdeu um frame: o próximo leva todos os veículos completos"""
+        if self._emitting_full:
+            return
+        for vehicle_id, state in self._sent.items():
+            self._pending.setdefault(vehicle_id, state)
+        self._sent.clear()
+        self.resyncs += 1
+
+    def build_frame(self):
+        """Frame com os campos alterados desde o último envio, ou None"""
+        if not self._pending:
+            return None
+        pending, self._pending = self._pending, {}
+        vehicles = []
+        for vehicle_id, position_data in pending.items():
+            previous = self._sent.get(vehicle_id)
+            current = {key: getattr(value, "value", value) for key, value in position_data.items()}
+            if previous is None:
+                changed = current
+            else:
+                changed = {key: value for key, value in current.items() if previous.get(key) != value}
+                if not changed:
+                    continue
+                changed["vehicle_id"] = vehicle_id
+            self._sent[vehicle_id] = current
+            vehicles.append(changed)
+        if not vehicles:
+            return None
+        return json.dumps({
+            "type": "position_delta",
+            "data": {"vehicles": vehicles},
+            "timestamp": datetime.now().isoformat()
+        }, default=str)
+
+    def tick(self) -> bool:
+        """Monta e envia o frame do tick; retorna False se ele não foi aceito"""
+        # Sem nada enviado (início ou após resync), o frame leva o estado completo
+        full = not self._sent
+        frame = self.build_frame()
+        if frame is None:
+            return True
+        self._emitting_full = full
+        try:
+            delivered = self._emit(frame)
+        finally:
+            self._emitting_full = False
+        if delivered:
+            self.frames_sent += 1
+        else:
+            self.resync()
+        return delivered
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Erro ao montar frame de delta")
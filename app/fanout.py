@@ -0,0 +1,291 @@
+import asyncio
+import enum
+import json
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Hashable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SlowConsumerPolicy(str, enum.Enum):
+    DROP_OLDEST = "drop_oldest"  # descarta a mensagem mais antiga da fila
+    COALESCE = "coalesce"        # mantém só a última mensagem por chave (ex.: por veículo)
+    DISCONNECT = "disconnect"    # desconecta o cliente
+
+
+class ClientConnection:
+    """Fila de envio limitada e tarefa de escrita própria de um WebSocket.
+
+    Um cliente lento só atrasa a própria fila; o broadcast apenas enfileira.
+    """
+
+    __slots__ = (
+        "websocket", "client_type", "max_queue", "policy", "send_timeout", "_keys", "_payloads",
+        "_wakeup", "_task", "_on_close", "closed", "close_reason", "sent", "dropped", "coalesced",
+        "connected_at", "last_seen", "on_drop"
+    )
+
+    def __init__(self, websocket, client_type: str, max_queue: int,
+                 policy: SlowConsumerPolicy, on_close: Callable[["ClientConnection"], None],
+                 send_timeout: Optional[float] = None):
+        self.websocket = websocket
+        self.client_type = client_type
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self._keys = deque()
+        self._payloads: Dict[Hashable, str] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._on_close = on_close
+        self.closed = False
+        self.close_reason: Optional[str] = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.connected_at = self.last_seen = time.monotonic()
+        # Avisado com a chave de cada mensagem descartada ou substituída na fila
+        self.on_drop: Optional[Callable[[Hashable], None]] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._keys)
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def enqueue(self, payload: str, key: Optional[Hashable] = None, replace: bool = False) -> bool:
+        """Enfileira sem bloquear; retorna False se a mensagem foi descartada.
+
+        Com ``replace``, a mensagem substitui a de mesma chave ainda na fila
+        qualquer que seja a política.
+        """
+        if self.closed:
+            return False
+        if key is None:
+            key = object()
+        elif key in self._payloads and (replace or self.policy == SlowConsumerPolicy.COALESCE):
+            # Substitui a mensagem ainda não enviada pela mais recente
+            self._payloads[key] = payload
+            self.coalesced += 1
+            self._dropped(key)
+            return True
+
+        if len(self._keys) >= self.max_queue:
+            if self.policy == SlowConsumerPolicy.DISCONNECT:
+                self.dropped += 1
+                self.close("slow_consumer", code=1013)
+                return False
+            oldest = self._keys.popleft()
+            self._payloads.pop(oldest, None)
+            self.dropped += 1
+            self._dropped(oldest)
+
+        if key in self._payloads:
+            # Chave repetida sem coalescência: envia as duas mensagens
+            key = object()
+        self._keys.append(key)
+        self._payloads[key] = payload
+        self._wakeup.set()
+        return True
+
+    def _dropped(self, key: Hashable):
+        if self.on_drop is not None:
+            self.on_drop(key)
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self._keys:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                key = self._keys.popleft()
+                payload = self._payloads.pop(key)
+                # Conexão meio-aberta: o envio trava até o timeout
+                await asyncio.wait_for(self.websocket.send_text(payload), self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.debug("Timeout de envio para WebSocket; encerrando conexão")
+            self.close("send_timeout", code=1011)
+        except Exception:
+            logger.debug("Falha ao enviar para WebSocket; encerrando conexão")
+            self.close("send_error")
+        finally:
+            self.close("closed")
+
+    def close(self, reason: str = "closed", code: Optional[int] = None):
+        """Encerra a fila; com ``code``, fecha também o socket para liberar o loop de recepção"""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        self._keys.clear()
+        self._payloads.clear()
+        self._wakeup.set()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        if code is not None:
+            asyncio.ensure_future(self._close_socket(code))
+        self._on_close(self)
+
+    async def _close_socket(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
+
+class FanoutHub:
+    """Envio de mensagens já serializadas para muitas conexões.
+
+    Cada mensagem é codificada uma vez pelo chamador; o hub só distribui a
+    mesma string para a fila de cada conexão.
+    """
+
+    def __init__(self, max_queue: int = 256, policy: SlowConsumerPolicy = SlowConsumerPolicy.DROP_OLDEST,
+                 on_disconnect: Optional[Callable[[object, str], None]] = None,
+                 send_timeout: Optional[float] = 10.0, max_connections: Optional[Dict[str, int]] = None):
+        self.max_queue = max_queue
+        self.policy = SlowConsumerPolicy(policy)
+        self.send_timeout = send_timeout
+        # Limite de conexões por tipo de cliente (ausente = sem limite)
+        self.max_connections = max_connections or {}
+        self.connections: Dict[object, ClientConnection] = {}
+        self._counts: Dict[str, int] = {}
+        self._on_disconnect = on_disconnect
+        self.messages_published = 0
+        self.deliveries = 0
+        self.drops = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self.rejected = 0
+        self.opened = 0
+        self.closed_by_reason: Dict[str, int] = {}
+        self.lifetime_total = 0.0
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    def has_capacity(self, client_type: str) -> bool:
+        limit = self.max_connections.get(client_type)
+        if limit is not None and self._counts.get(client_type, 0) >= limit:
+            self.rejected += 1
+            return False
+        return True
+
+    def register(self, websocket, client_type: str) -> ClientConnection:
+        connection = ClientConnection(
+            websocket, client_type, self.max_queue, self.policy, self._closed, self.send_timeout
+        )
+        self.connections[websocket] = connection
+        self._counts[client_type] = self._counts.get(client_type, 0) + 1
+        self.opened += 1
+        connection.start()
+        return connection
+
+    def touch(self, websocket):
+        """Registra atividade do cliente (qualquer mensagem recebida, inclusive pong)"""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+
+    def unregister(self, websocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is not None:
+            connection.close()
+
+    def _closed(self, connection: ClientConnection):
+        self.drops += connection.dropped
+        self.coalesced += connection.coalesced
+        if connection.policy == SlowConsumerPolicy.DISCONNECT and connection.dropped:
+            self.slow_disconnects += 1
+        reason = connection.close_reason
+        self.closed_by_reason[reason] = self.closed_by_reason.get(reason, 0) + 1
+        self.lifetime_total += time.monotonic() - connection.connected_at
+        self._counts[connection.client_type] -= 1
+        if self.connections.get(connection.websocket) is connection:
+            del self.connections[connection.websocket]
+            if self._on_disconnect is not None:
+                self._on_disconnect(connection.websocket, connection.client_type)
+
+    def publish(self, payload: str, websockets: Iterable, key: Optional[Hashable] = None,
+                replace: bool = False) -> int:
+        """Enfileira ``payload`` para as conexões; retorna quantas aceitaram"""
+        self.messages_published += 1
+        delivered = 0
+        for websocket in websockets:
+            connection = self.connections.get(websocket)
+            if connection is not None and connection.enqueue(payload, key, replace):
+                delivered += 1
+        self.deliveries += delivered
+        return delivered
+
+    def _heartbeat_targets(self, client_types: Optional[frozenset]):
+        return [c for c in self.connections.values() if client_types is None or c.client_type in client_types]
+
+    def reap(self, idle_timeout: float, client_types: Optional[Iterable[str]] = None) -> int:
+        """Fecha conexões sem nenhuma mensagem do cliente há mais de ``idle_timeout``
+        (só dos tipos em ``client_types``, se informado)"""
+        deadline = time.monotonic() - idle_timeout
+        targets = self._heartbeat_targets(frozenset(client_types) if client_types is not None else None)
+        idle = [c for c in targets if c.last_seen < deadline]
+        for connection in idle:
+            # 1001 (going away): o cliente pode reconectar
+            connection.close("idle", code=1001)
+        return len(idle)
+
+    def start_heartbeat(self, ping_interval: float, idle_timeout: float,
+                        client_types: Optional[Iterable[str]] = None):
+        """Ping em JSON e encerramento por inatividade para clientes que respondem
+        ``pong``; os demais dependem do ping do protocolo WebSocket (servidor ASGI)"""
+        if self._heartbeat is None and ping_interval > 0:
+            types = frozenset(client_types) if client_types is not None else None
+            self._heartbeat = asyncio.create_task(self._run_heartbeat(ping_interval, idle_timeout, types))
+
+    def stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    async def _run_heartbeat(self, ping_interval: float, idle_timeout: float,
+                             client_types: Optional[frozenset]):
+        """Envia ping a cada intervalo e descarta quem não respondeu a tempo"""
+        while True:
+            await asyncio.sleep(ping_interval)
+            try:
+                reaped = self.reap(idle_timeout, client_types)
+                if reaped:
+                    logger.info("%d conexões WebSocket ociosas encerradas", reaped)
+                payload = json.dumps({"type": "ping", "timestamp": time.time()})
+                for connection in self._heartbeat_targets(client_types):
+                    connection.enqueue(payload)
+            except Exception:
+                logger.exception("Erro no heartbeat dos WebSockets")
+
+    def stats(self) -> dict:
+        depths = [c.queue_depth for c in self.connections.values()]
+        now = time.monotonic()
+        closed = sum(self.closed_by_reason.values())
+        return {
+            "connections": len(self.connections),
+            "connections_by_type": {k: v for k, v in self._counts.items() if v},
+            "max_connections": self.max_connections,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "closed": dict(self.closed_by_reason),
+            "lifetime_avg_seconds": round(self.lifetime_total / closed, 3) if closed else None,
+            "oldest_connection_seconds": round(max((now - c.connected_at for c in self.connections.values()), default=0), 3),
+            "max_idle_seconds": round(max((now - c.last_seen for c in self.connections.values()), default=0), 3),
+            "policy": self.policy.value,
+            "max_queue": self.max_queue,
+            "messages_published": self.messages_published,
+            "deliveries": self.deliveries,
+            "dropped": self.drops + sum(c.dropped for c in self.connections.values()),
+            "coalesced": self.coalesced + sum(c.coalesced for c in self.connections.values()),
+            "slow_disconnects": self.slow_disconnects,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0)
+        }
@@ -0,0 +1,195 @@
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.geo import EARTH_RADIUS_KM, haversine_km
+from app.stats import to_epoch
+
+# km por grau de latitude
+_KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _value(field):
+    # Enums (VehicleType/VehicleStatus) são guardados pelo valor
+    return getattr(field, "value", field)
+
+
+class _MessageVehicle:
+    __slots__ = ("id", "license_plate", "vehicle_type", "status")
+
+    def __init__(self, position_data: dict):
+        self.id = position_data["vehicle_id"]
+        self.license_plate = position_data.get("license_plate")
+        self.vehicle_type = position_data.get("vehicle_type")
+        self.status = position_data.get("status")
+
+
+class FleetEntry:
+    __slots__ = (
+        "vehicle_id", "license_plate", "vehicle_type", "status",
+        "latitude", "longitude", "speed", "heading", "timestamp", "cell", "seen_at"
+    )
+
+    def to_dict(self) -> dict:
+        return {
+            "vehicle_id": self.vehicle_id,
+            "license_plate": self.license_plate,
+            "vehicle_type": self.vehicle_type,
+            "status": self.status,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "speed": self.speed,
+            "heading": self.heading,
+            "timestamp": self.timestamp.isoformat() if self.timestamp else None
+        }
+
+
+class FleetIndex:
+    """Última posição de cada veículo em memória, indexada por uma grade lat/lng.
+
+    Atende buscas de vizinhos mais próximos sem tocar no banco nem no Redis.
+    """
+
+    def __init__(self, cell_size_deg: float = 0.01):
+        self.cell_size_deg = cell_size_deg
+        self._lock = threading.Lock()
+        self._entries: Dict[int, FleetEntry] = {}
+        self._cells: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_size_deg), math.floor(lng / self.cell_size_deg))
+
+    def update(self, vehicle, latitude: float, longitude: float, speed: Optional[float] = None,
+               heading: Optional[float] = None, timestamp: Optional[datetime] = None):
+        """Registra a posição mais recente de um veículo"""
+        cell = self.cell_of(latitude, longitude)
+        with self._lock:
+            entry = self._entries.get(vehicle.id)
+            if entry is None:
+                entry = self._entries[vehicle.id] = FleetEntry()
+                entry.vehicle_id = vehicle.id
+                entry.cell = None
+            elif entry.timestamp and timestamp and to_epoch(timestamp) < to_epoch(entry.timestamp):
+                return
+            entry.license_plate = vehicle.license_plate
+            entry.vehicle_type = _value(vehicle.vehicle_type)
+            entry.status = _value(vehicle.status)
+            entry.latitude = latitude
+            entry.longitude = longitude
+            entry.speed = speed
+            entry.heading = heading
+            entry.timestamp = timestamp
+            entry.seen_at = time.monotonic()
+            if entry.cell != cell:
+                if entry.cell is not None:
+                    self._discard_from_cell(entry.cell, vehicle.id)
+                self._cells[cell].add(vehicle.id)
+                entry.cell = cell
+
+    def update_from_message(self, position_data: dict):
+        """Atualiza a partir de uma mensagem ``position_update`` (ex.: vinda de outro worker)"""
+        vehicle = _MessageVehicle(position_data)
+        timestamp = position_data.get("timestamp")
+        self.update(
+            vehicle,
+            position_data["latitude"],
+            position_data["longitude"],
+            position_data.get("speed"),
+            position_data.get("heading"),
+            datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp
+        )
+
+    def entries(self) -> List[FleetEntry]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def set_vehicle(self, vehicle):
+        """Atualiza placa, tipo e status de um veículo já indexado"""
+        with self._lock:
+            entry = self._entries.get(vehicle.id)
+            if entry is not None:
+                entry.license_plate = vehicle.license_plate
+                entry.vehicle_type = _value(vehicle.vehicle_type)
+                entry.status = _value(vehicle.status)
+
+    def remove(self, vehicle_id: int):
+        with self._lock:
+            entry = self._entries.pop(vehicle_id, None)
+            if entry is not None:
+                self._discard_from_cell(entry.cell, vehicle_id)
+
+    def expire(self, max_age_seconds: float) -> int:
+        """Remove veículos sem posição recebida há mais de ``max_age_seconds``"""
+        cutoff = time.monotonic() - max_age_seconds
+        with self._lock:
+            stale = [vid for vid, entry in self._entries.items() if entry.seen_at < cutoff]
+            for vehicle_id in stale:
+                entry = self._entries.pop(vehicle_id)
+                self._discard_from_cell(entry.cell, vehicle_id)
+        return len(stale)
+
+    def get(self, vehicle_id: int) -> Optional[FleetEntry]:
+        return self._entries.get(vehicle_id)
+
+    def _discard_from_cell(self, cell, vehicle_id: int):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(vehicle_id)
+            if not members:
+                del self._cells[cell]
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield (ci, cj)
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def nearest(self, lat: float, lng: float, k: int = 5, vehicle_type: Optional[str] = None,
+                status: Optional[str] = None, max_radius_km: float = 50.0) -> List[Tuple[FleetEntry, float]]:
+        """Os ``k`` veículos mais próximos, por busca em anéis crescentes da grade"""
+        ci, cj = self.cell_of(lat, lng)
+        # Menor largura de célula (km) dentro do raio máximo, para o limite inferior
+        max_lat = min(89.9, abs(lat) + math.degrees(max_radius_km / EARTH_RADIUS_KM))
+        cell_km = self.cell_size_deg * _KM_PER_DEG * math.cos(math.radians(max_lat))
+        max_rings = int(max_radius_km / cell_km) + 1
+
+        best: List[Tuple[float, int, FleetEntry]] = []  # heap máximo via distância negativa
+        with self._lock:
+            for r in range(max_rings + 1):
+                for cell in self._ring(ci, cj, r):
+                    members = self._cells.get(cell)
+                    if not members:
+                        continue
+                    for vehicle_id in members:
+                        entry = self._entries[vehicle_id]
+                        if vehicle_type and entry.vehicle_type != vehicle_type:
+                            continue
+                        if status and entry.status != status:
+                            continue
+                        distance = haversine_km(lat, lng, entry.latitude, entry.longitude)
+                        if distance > max_radius_km:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-distance, vehicle_id, entry))
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, (-distance, vehicle_id, entry))
+                # Tudo fora dos anéis 0..r está a pelo menos r células de distância
+                if len(best) >= k and -best[0][0] <= r * cell_km:
+                    break
+
+        return [(entry, -neg) for neg, _, entry in sorted(best, reverse=True)]
+
+
+fleet_index = FleetIndex()
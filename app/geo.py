@@ -0,0 +1,174 @@
+import math
+import numpy as np
+
+
+# Raio médio da Terra em km
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Distância em km entre dois pontos (lat/lng em graus)"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_km_np(lat1, lng1, lat2, lng2):
+    """Versão vetorizada de haversine_km para arrays NumPy"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(lng2) - np.asarray(lng1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+# Precisão do geohash gravado em vehicle_positions (células de ~1,2 km x 0,6 km)
+GEOHASH_PRECISION = 6
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Codifica lat/lng em geohash"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch = (ch << 1) | 1
+                lng_lo = mid
+            else:
+                ch <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_GEOHASH_BASE32[ch])
+            bit = 0
+            ch = 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int):
+    """Altura e largura (graus) de uma célula geohash"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def radius_bbox(lat: float, lng: float, radius_km: float):
+    """Retângulo (min_lat, min_lng, max_lat, max_lng) que contém o círculo"""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlng = min(180.0, dlat / cos_lat)
+    return (
+        max(-90.0, lat - dlat),
+        max(-180.0, lng - dlng),
+        min(90.0, lat + dlat),
+        min(180.0, lng + dlng),
+    )
+
+
+def geohash_cover(bbox, precision: int):
+    """Células geohash de uma precisão que cobrem o retângulo"""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    height, width = geohash_cell_size(precision)
+    cells = []
+    row = math.floor((min_lat + 90.0) / height)
+    while row * height - 90.0 <= max_lat and row * height < 180.0:
+        col = math.floor((min_lng + 180.0) / width)
+        while col * width - 180.0 <= max_lng and col * width < 360.0:
+            cells.append(geohash_encode(
+                row * height - 90.0 + height / 2,
+                col * width - 180.0 + width / 2,
+                precision
+            ))
+            col += 1
+        row += 1
+    return cells
+
+
+def geohash_query_cells(bbox, max_cells: int = 32, max_precision: int = GEOHASH_PRECISION):
+    """Escolhe a precisão mais fina (até ``max_precision``) com no máximo ``max_cells`` células"""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    for precision in range(max_precision, 1, -1):
+        height, width = geohash_cell_size(precision)
+        rows = math.floor((max_lat - min_lat) / height) + 2
+        cols = math.floor((max_lng - min_lng) / width) + 2
+        if rows * cols <= max_cells:
+            return geohash_cover(bbox, precision)
+    return geohash_cover(bbox, 1)
+
+
+def simplification_weights(lat, lng):
+    """Importância (m) de cada ponto de uma trajetória segundo Douglas-Peucker.
+
+    Manter os pontos com peso acima de uma tolerância equivale a rodar o
+    Douglas-Peucker com essa tolerância; manter os N maiores pesos dá a
+    melhor trajetória com N pontos. As extremidades têm peso infinito.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    n = len(lat)
+    weights = np.zeros(n)
+    if n == 0:
+        return weights
+    weights[0] = weights[-1] = np.inf
+
+    # Projeção equirretangular local em metros
+    cos_lat = math.cos(math.radians(float(lat.mean())))
+    x = np.radians(lng) * cos_lat * EARTH_RADIUS_KM * 1000
+    y = np.radians(lat) * EARTH_RADIUS_KM * 1000
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        ax, ay = x[first], y[first]
+        dx, dy = x[last] - ax, y[last] - ay
+        px = x[first + 1:last] - ax
+        py = y[first + 1:last] - ay
+        seg2 = dx * dx + dy * dy
+        if seg2 == 0:
+            dist = np.hypot(px, py)
+        else:
+            t = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+            dist = np.hypot(px - t * dx, py - t * dy)
+        i = int(np.argmax(dist))
+        idx = first + 1 + i
+        # Um ponto nunca pesa mais que o ponto que dividiu o segmento pai
+        weight = min(float(dist[i]), parent)
+        weights[idx] = weight
+        stack.append((first, idx, weight))
+        stack.append((idx, last, weight))
+    return weights
+
+
+def simplify_track(lat, lng, tolerance_m=None, max_points=None):
+    """Índices (em ordem) dos pontos mantidos após a simplificação"""
+    weights = simplification_weights(lat, lng)
+    keep = np.arange(len(weights))
+    if tolerance_m is not None:
+        keep = keep[weights > tolerance_m]
+    if max_points is not None and len(keep) > max_points:
+        top = np.argpartition(-weights[keep], max_points - 1)[:max_points]
+        keep = np.sort(keep[top])
+    return keep
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, JSONResponse
@@ -15,6 +15,9 @@ from typing import Optional
 import asyncio
 from contextlib import asynccontextmanager
 import logging
+from app.cache import TieredCache
+from app.catalog import vehicle_catalog
+from app.fanout import FanoutHub
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -37,7 +40,10 @@ try:
 except:
     REDIS_AVAILABLE = False
     logger.warning("Redis não disponível, usando cache em memória")
-    in_memory_cache = {}
+    redis_client = None
+
+# Cache da última posição: LRU em memória (limitado e com TTL) na frente do Redis
+position_cache = TieredCache(redis_client, ttl=300, l1_ttl=2, max_entries=10000)
 
 # Enums
 class VehicleType(str, enum.Enum):
@@ -55,12 +61,12 @@ class Vehicle(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     license_plate = Column(String(20), unique=True, index=True, nullable=False)
-    vehicle_type = Column(String(20), nullable=False)
+    vehicle_type = Column(String(20), nullable=False, index=True)
     brand = Column(String(100))
     model = Column(String(100))
     year = Column(Integer)
     color = Column(String(50))
-    status = Column(String(20), default=VehicleStatus.ACTIVE.value)
+    status = Column(String(20), default=VehicleStatus.ACTIVE.value, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -83,25 +89,22 @@ Base.metadata.create_all(bind=engine)
 class ConnectionManager:
     def __init__(self):
         self.active_connections: list[WebSocket] = []
+        # Fila de envio e tarefa de escrita por conexão
+        self.hub = FanoutHub(on_disconnect=lambda websocket, _: self.disconnect(websocket))
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
+        self.hub.register(websocket, "monitoring")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self.hub.unregister(websocket)
 
     async def broadcast(self, message: dict):
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.append(connection)
-        
-        for connection in disconnected:
-            self.disconnect(connection)
+        # Serializa uma vez e apenas enfileira para cada conexão
+        self.hub.publish(json.dumps(message, default=str), list(self.active_connections))
 
 manager = ConnectionManager()
 
@@ -187,28 +190,54 @@ async def health_check():
         "redis": REDIS_AVAILABLE
     }
 
+def load_vehicles(db: Session, vehicle_type: Optional[str], status: Optional[str],
+                  plate_prefix: Optional[str]) -> str:
+    query = db.query(Vehicle)
+    if vehicle_type:
+        query = query.filter(Vehicle.vehicle_type == vehicle_type)
+    if status:
+        query = query.filter(Vehicle.status == status)
+    if plate_prefix:
+        escaped = plate_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(Vehicle.license_plate.like(f"{escaped}%", escape="\\"))
+    vehicles = query.order_by(Vehicle.id).all()
+    return json.dumps({
+        "success": True,
+        "count": len(vehicles),
+        "vehicles": [
+            {
+                "id": v.id,
+                "license_plate": v.license_plate,
+                "vehicle_type": v.vehicle_type,
+                "brand": v.brand,
+                "model": v.model,
+                "year": v.year,
+                "color": v.color,
+                "status": v.status,
+                "created_at": v.created_at.isoformat() if v.created_at else None
+            }
+            for v in vehicles
+        ]
+    })
+
 @app.get("/api/vehicles")
-async def get_vehicles(db: Session = Depends(get_db)):
+async def get_vehicles(
+    request: Request,
+    vehicle_type: Optional[str] = None,
+    status: Optional[str] = None,
+    plate_prefix: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
     try:
-        vehicles = db.query(Vehicle).all()
-        return {
-            "success": True,
-            "count": len(vehicles),
-            "vehicles": [
-                {
-                    "id": v.id,
-                    "license_plate": v.license_plate,
-                    "vehicle_type": v.vehicle_type,
-                    "brand": v.brand,
-                    "model": v.model,
-                    "year": v.year,
-                    "color": v.color,
-                    "status": v.status,
-                    "created_at": v.created_at.isoformat() if v.created_at else None
-                }
-                for v in vehicles
-            ]
-        }
+        # Filtros no banco; a resposta serializada fica em cache até o cadastro mudar
+        etag, payload = vehicle_catalog.get(
+            (vehicle_type, status, plate_prefix),
+            lambda: load_vehicles(db, vehicle_type, status, plate_prefix)
+        )
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if vehicle_catalog.not_modified(etag, request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        return Response(content=payload, media_type="application/json", headers=headers)
     except Exception as e:
         logger.error(f"Erro ao buscar veículos: {e}")
         return JSONResponse(
@@ -251,6 +280,7 @@ async def create_vehicle(data: dict, db: Session = Depends(get_db)):
         db.add(vehicle)
         db.commit()
         db.refresh(vehicle)
+        vehicle_catalog.invalidate()
         
         # Notificar via WebSocket
         await manager.broadcast({
@@ -327,14 +357,7 @@ async def create_position(data: dict, db: Session = Depends(get_db)):
             "timestamp": position.timestamp.isoformat() if position.timestamp else None
         }
         
-        if REDIS_AVAILABLE:
-            redis_client.setex(
-                f"vehicle:{vehicle.id}:position",
-                300,  # 5 minutos
-                json.dumps(cache_data)
-            )
-        else:
-            in_memory_cache[f"vehicle:{vehicle.id}:position"] = cache_data
+        position_cache.set(f"vehicle:{vehicle.id}:position", cache_data)  # 5 minutos
         
         # Notificar via WebSocket
         await manager.broadcast({
@@ -390,6 +413,14 @@ async def get_vehicle_positions(vehicle_id: int, limit: int = 50, db: Session =
             content={"success": False, "error": str(e)}
         )
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {"positions": position_cache.stats(), "catalog": vehicle_catalog.stats()}
+
+@app.get("/api/ws/stats")
+async def websocket_stats():
+    return manager.hub.stats()
+
 # WebSocket endpoint
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -441,6 +472,7 @@ async def setup_test_data(db: Session = Depends(get_db)):
             db.add(vehicle)
         
         db.commit()
+        vehicle_catalog.invalidate()
         
         return {
             "success": True,
@@ -0,0 +1,192 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.profiling import add_span
+
+# Buckets em segundos: de 50 µs a 10 s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _labels_text(labels: Optional[Dict[str, str]], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in (labels or {}).items()]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotônico.
+
+    ``+=`` não é atômico entre threads (rotas síncronas rodam no threadpool),
+    então o incremento é feito sob um lock próprio.
+    """
+
+    __slots__ = ("name", "labels", "value", "_lock")
+    kind = "counter"
+
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        yield self.name, _labels_text(self.labels), self.value
+
+
+class Gauge:
+    __slots__ = ("name", "labels", "value")
+    kind = "gauge"
+
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        yield self.name, _labels_text(self.labels), self.value
+
+
+class Histogram:
+    """Histograma com buckets fixos e contadores pré-alocados, atualizados sob lock"""
+
+    __slots__ = ("name", "labels", "buckets", "counts", "sum", "count", "_lock")
+    kind = "histogram"
+
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None,
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def observe_since(self, start: float):
+        """Atalho para ``observe(perf_counter() - start)``"""
+        self.observe(time.perf_counter() - start)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        # Cópia consistente: buckets, soma e contagem do mesmo instante
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket
+            yield f"{self.name}_bucket", _labels_text(self.labels, f'le="{_number(bound)}"'), cumulative
+        yield f"{self.name}_sum", _labels_text(self.labels), total
+        yield f"{self.name}_count", _labels_text(self.labels), count
+
+
+class _Collector:
+    """Métrica lida só na hora da coleta (ex.: estatísticas já mantidas por outro módulo)"""
+
+    __slots__ = ("name", "kind", "fn")
+
+    def __init__(self, name: str, kind: str, fn: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        self.name = name
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for labels, value in self.fn():
+            if value is not None:
+                yield self.name, _labels_text(labels), value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, List] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def _register(self, metric, help_text: str):
+        self._help.setdefault(metric.name, (metric.kind, help_text))
+        self._metrics.setdefault(metric.name, []).append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Optional[Dict[str, str]] = None) -> Counter:
+        return self._register(Counter(name, labels), help_text)
+
+    def gauge(self, name: str, help_text: str, labels: Optional[Dict[str, str]] = None) -> Gauge:
+        return self._register(Gauge(name, labels), help_text)
+
+    def histogram(self, name: str, help_text: str, labels: Optional[Dict[str, str]] = None,
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, labels, buckets), help_text)
+
+    def collector(self, name: str, kind: str, help_text: str,
+                  fn: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        """``fn`` devolve pares (labels, valor) no momento da coleta"""
+        return self._register(_Collector(name, kind, fn), help_text)
+
+    def render(self) -> str:
+        """Formato texto de exposição do Prometheus"""
+        lines = []
+        for name, metrics in self._metrics.items():
+            kind, help_text = self._help[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics:
+                for sample_name, labels, value in metric.samples():
+                    lines.append(f"{sample_name}{labels} {_number(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = MetricsRegistry()
+
+# Ingestão de posições, por etapa. "validation" é a decodificação e validação
+# explícitas de /ingest (em POST / e /batch o FastAPI valida antes do handler);
+# "lookup" é a admissão e a busca dos veículos no banco
+INGEST_STAGES = {
+    stage: registry.histogram(
+        "tracking_ingest_stage_seconds", "Tempo de cada etapa da ingestão de posições", {"stage": stage}
+    )
+    for stage in ("validation", "lookup", "db", "redis", "broadcast", "total")
+}
+
+
+def observe_stage(stage: str, start: float):
+    """Registra uma etapa da ingestão no histograma e na requisição amostrada"""
+    elapsed = time.perf_counter() - start
+    INGEST_STAGES[stage].observe(elapsed)
+    add_span(stage, elapsed)
+
+
+FIXES_INGESTED = registry.counter("tracking_fixes_total", "Posições recebidas (use rate() para fixes/s)")
+
+# WebSocket: tempo para distribuir uma mensagem às filas dos clientes
+WS_FANOUT = registry.histogram("tracking_ws_fanout_seconds", "Tempo de fan-out de uma mensagem aos clientes")
+
+# Infraestrutura
+DB_POOL_CHECKOUT = registry.histogram(
+    "tracking_db_pool_checkout_seconds", "Espera para obter uma conexão do pool do banco"
+)
+REDIS_RTT = registry.histogram("tracking_redis_rtt_seconds", "Tempo de ida e volta das chamadas ao Redis")
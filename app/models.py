@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Enum, ForeignKey, Boolean, Text, Index, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 import enum
 from app.database import Base
 
@@ -22,20 +22,32 @@ class Vehicle(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     license_plate = Column(String(20), unique=True, index=True, nullable=False)
-    vehicle_type = Column(Enum(VehicleType), nullable=False)
+    vehicle_type = Column(Enum(VehicleType), nullable=False, index=True)
     brand = Column(String(100))
     model = Column(String(100))
     year = Column(Integer)
     color = Column(String(50))
-    status = Column(Enum(VehicleStatus), default=VehicleStatus.ACTIVE)
+    status = Column(Enum(VehicleStatus), default=VehicleStatus.ACTIVE, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     positions = relationship("VehiclePosition", back_populates="vehicle", cascade="all, delete-orphan")
+    daily_stats = relationship("VehicleDailyStats", cascade="all, delete-orphan")
+    commands = relationship("VehicleCommand", cascade="all, delete-orphan")
+    alerts = relationship("VehicleAlert", cascade="all, delete-orphan")
 
 
 class VehiclePosition(Base):
     __tablename__ = "vehicle_positions"
+    __table_args__ = (
+        # Histórico e replay por veículo em ordem cronológica
+        Index("ix_vehicle_positions_vehicle_timestamp", "vehicle_id", "timestamp"),
+        # Índice de cobertura para buscas espaço-temporais (index-only scan por célula)
+        Index(
+            "ix_vehicle_positions_geohash_timestamp",
+            "geohash", "timestamp", "vehicle_id", "latitude", "longitude"
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=False)
@@ -45,10 +57,47 @@ class VehiclePosition(Base):
     heading = Column(Float)  # em graus (0-360)
     accuracy = Column(Float)  # precisão em metros
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    geohash = Column(String(12))  # célula geohash calculada na ingestão
     
     vehicle = relationship("Vehicle", back_populates="positions")
 
 
+class VehicleDailyStats(Base):
+    __tablename__ = "vehicle_daily_stats"
+    __table_args__ = (
+        UniqueConstraint("vehicle_id", "day", name="uq_vehicle_daily_stats_vehicle_day"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    distance_km = Column(Float, nullable=False, default=0.0)
+    moving_seconds = Column(Float, nullable=False, default=0.0)
+    idle_seconds = Column(Float, nullable=False, default=0.0)
+    fix_count = Column(Integer, nullable=False, default=0)
+    max_speed = Column(Float, nullable=False, default=0.0)  # em km/h
+
+
+class CommandStatus(str, enum.Enum):
+    PENDING = "pending"
+    ACKED = "acked"
+
+
+class VehicleCommand(Base):
+    __tablename__ = "vehicle_commands"
+    __table_args__ = (
+        Index("ix_vehicle_commands_vehicle_status", "vehicle_id", "status"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=False)
+    command = Column(String(50), nullable=False)
+    payload = Column(JSON)
+    status = Column(Enum(CommandStatus), nullable=False, default=CommandStatus.PENDING)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    acked_at = Column(DateTime(timezone=True))
+
+
 class Driver(Base):
     __tablename__ = "drivers"
     
@@ -63,10 +112,43 @@ class Driver(Base):
 
 class VehicleAssignment(Base):
     __tablename__ = "vehicle_assignments"
+    __table_args__ = (
+        # Vínculo ativo de um veículo (e de um motorista) sem varrer o histórico
+        Index("ix_vehicle_assignments_vehicle_active", "vehicle_id", "is_active"),
+        Index("ix_vehicle_assignments_driver_active", "driver_id", "is_active"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=False)
     driver_id = Column(Integer, ForeignKey("drivers.id"))
     assigned_at = Column(DateTime(timezone=True), server_default=func.now())
     unassigned_at = Column(DateTime(timezone=True))
-    is_active = Column(Boolean, default=True)
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+    
+    driver = relationship("Driver")
+
+
+class AlertType(str, enum.Enum):
+    SPEEDING = "speeding"
+    IDLE = "idle"
+    OFFLINE = "offline"
+
+
+class VehicleAlert(Base):
+    __tablename__ = "vehicle_alerts"
+    __table_args__ = (
+        # No máximo um alerta ativo por veículo e regra, mesmo com vários workers
+        Index(
+            "uq_vehicle_alerts_vehicle_rule_active", "vehicle_id", "rule", unique=True,
+            sqlite_where=text("is_active"), postgresql_where=text("is_active")
+        ),
+        Index("ix_vehicle_alerts_vehicle_started", "vehicle_id", "started_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=False)
+    rule = Column(Enum(AlertType), nullable=False)
+    value = Column(Float)  # km/h (velocidade) ou segundos (parada e sem sinal)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    resolved_at = Column(DateTime(timezone=True))
+    is_active = Column(Boolean, nullable=False, default=True)
@@ -0,0 +1,235 @@
+import cProfile
+import collections
+import contextvars
+import io
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import traceback
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Tempo acumulado por etapa (span) de uma requisição amostrada.
+
+    Spans com ponto no nome (ex.: ``db.sql``) estão contidos em outra etapa
+    e não entram na conta do tempo restante.
+    """
+
+    __slots__ = ("method", "path", "spans", "counts", "total")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.spans: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.total = 0.0
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def to_dict(self) -> dict:
+        spans = {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()}
+        accounted = sum(s for name, s in self.spans.items() if "." not in name)
+        spans["other"] = round(max(self.total - accounted, 0.0) * 1000, 3)
+        return {
+            "method": self.method,
+            "path": self.path,
+            "total_ms": round(self.total * 1000, 3),
+            "spans_ms": spans,
+            "counts": dict(self.counts)
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def add_span(name: str, seconds: float):
+    """Registra uma etapa na requisição amostrada atual (sem amostragem, não faz nada)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+class span:
+    """``with span("cache"):`` mede o bloco se a requisição estiver sendo amostrada"""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add_span(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class TraceRecorder:
+    """Guarda as requisições amostradas recentes e registra as lentas no log"""
+
+    def __init__(self, slow_ms: float = 200.0, keep: int = 200):
+        self.slow_seconds = slow_ms / 1000
+        self.recent: Deque[dict] = collections.deque(maxlen=keep)
+        self.slow: Deque[dict] = collections.deque(maxlen=keep)
+        self.sampled = 0
+        self.slow_count = 0
+
+    def finish(self, method: str, path: str, trace: Optional[Trace], elapsed: float):
+        if trace is not None:
+            trace.total = elapsed
+            self.sampled += 1
+            self.recent.append(trace.to_dict())
+        if elapsed < self.slow_seconds:
+            return
+        self.slow_count += 1
+        if trace is None:
+            logger.warning("Requisição lenta %s %s: %.1f ms (não amostrada)", method, path, elapsed * 1000)
+            return
+        report = trace.to_dict()
+        self.slow.append(report)
+        breakdown = ", ".join(f"{name}={ms}ms" for name, ms in report["spans_ms"].items())
+        logger.warning("Requisição lenta %s %s: %.1f ms [%s]", method, path, elapsed * 1000, breakdown)
+
+    def stats(self) -> dict:
+        return {
+            "slow_ms": self.slow_seconds * 1000,
+            "sampled": self.sampled,
+            "slow": self.slow_count,
+            "recent": list(self.recent)[-20:],
+            "recent_slow": list(self.slow)[-20:]
+        }
+
+
+trace_recorder = TraceRecorder()
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que amostra requisições e registra as lentas com suas etapas.
+
+    Só é instalado com PROFILING_ENABLED; desligado, o custo nos caminhos
+    instrumentados é uma leitura de ContextVar.
+    """
+
+    def __init__(self, app, sample_rate: float = 0.01, recorder: TraceRecorder = trace_recorder):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = None
+        token = None
+        if random.random() < self.sample_rate:
+            trace = Trace(scope.get("method", ""), scope.get("path", ""))
+            token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.perf_counter() - start
+            if token is not None:
+                _current_trace.reset(token)
+            self.recorder.finish(scope.get("method", ""), scope.get("path", ""), trace, elapsed)
+
+
+def instrument_engine(engine):
+    """Registra o tempo de cada comando SQL como span ``db.sql``"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current_trace.get() is not None:
+            conn.info.setdefault("_span_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_span_start")
+        if starts:
+            add_span("db.sql", time.perf_counter() - starts.pop())
+
+
+class ProfileCapture:
+    """Captura sob demanda, limitada no tempo, gravada em arquivo.
+
+    ``cprofile`` perfila a thread do event loop (código async); ``sampling``
+    coleta as pilhas de todas as threads em intervalos fixos, incluindo o
+    threadpool dos endpoints síncronos, no formato de pilhas colapsadas
+    (flamegraph.pl / speedscope).
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self.running = False
+
+    def try_start(self) -> bool:
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+            return True
+
+    def finish(self):
+        with self._lock:
+            self.running = False
+
+    def _path(self, mode: str, suffix: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"{mode}-{time.strftime('%Y%m%d-%H%M%S')}.{suffix}")
+
+    def start_cprofile(self) -> cProfile.Profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop_cprofile(self, profiler: cProfile.Profile, top: int = 25) -> dict:
+        profiler.disable()
+        path = self._path("cprofile", "prof")
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        return {"file": path, "summary": out.getvalue()}
+
+    def sample(self, seconds: float, interval: float = 0.005, top: int = 25) -> dict:
+        """Bloqueia por ``seconds``; deve rodar fora do event loop"""
+        stacks: Dict[str, int] = collections.Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = ";".join(
+                    f"{os.path.basename(f.filename)}:{f.name}" for f in traceback.extract_stack(frame)
+                )
+                stacks[stack] += 1
+            samples += 1
+            time.sleep(interval)
+
+        path = self._path("sampling", "folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        leaves: Dict[str, int] = collections.Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "file": path,
+            "samples": samples,
+            "top_frames": [{"frame": frame, "samples": count} for frame, count in leaves.most_common(top)]
+        }
@@ -0,0 +1,10 @@
+import redis
+
+from app.config import settings
+
+# Redis opcional: sem ele o cache fica só em memória e as buscas por raio usam o índice da frota
+try:
+    redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    redis_client.ping()
+except redis.RedisError:
+    redis_client = None
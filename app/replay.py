@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import json
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from fastapi import WebSocket
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from app import crud, models
+from app.stats import to_epoch
+
+
+def read_vehicle_positions(db: Session, vehicle_id: int, start: datetime, end: datetime, limit: int,
+                           after: Optional[tuple] = None) -> list:
+    """Próximas ``limit`` posições de um veículo em ordem cronológica.
+
+    Paginação por chave: ``after`` é o (timestamp, id) da última linha lida.
+    """
+    vp = models.VehiclePosition
+    stmt = select(
+        vp.id, vp.timestamp, vp.vehicle_id, vp.latitude, vp.longitude, vp.speed, vp.heading
+    ).where(
+        vp.vehicle_id == vehicle_id,
+        vp.timestamp >= start,
+        vp.timestamp <= end
+    )
+    if after is not None:
+        stmt = stmt.where(or_(vp.timestamp > after[0], and_(vp.timestamp == after[0], vp.id > after[1])))
+    return db.execute(stmt.order_by(vp.timestamp, vp.id).limit(limit)).all()
+
+
+class ReplayCursor:
+    """Intercala as posições de vários veículos por horário usando um heap.
+
+    Cada veículo guarda só o bloco atual (``chunk_size`` linhas). Quando um
+    bloco acaba, o próximo é lido por chave numa sessão aberta só para a
+    leitura, então a reprodução não segura conexão do pool entre os ticks.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], vehicle_ids: List[int], start: datetime,
+                 end: datetime, chunk_size: int = 500):
+        self.session_factory = session_factory
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+        self._buffers: Dict[int, deque] = {vehicle_id: deque() for vehicle_id in vehicle_ids}
+        # Última linha lida de cada veículo; veículos sem mais linhas saem do dict
+        self._after: Dict[int, Optional[tuple]] = dict.fromkeys(vehicle_ids)
+        # (epoch, vehicle_id, linha) da próxima linha de cada veículo
+        self._heap: list = []
+        self._pending = list(vehicle_ids)
+        self._db: Optional[Session] = None
+        self.exhausted = not vehicle_ids
+
+    def _refill(self, vehicle_id: int):
+        if self._db is None:
+            self._db = self.session_factory()
+        rows = read_vehicle_positions(
+            self._db, vehicle_id, self.start, self.end, self.chunk_size, self._after[vehicle_id]
+        )
+        if len(rows) < self.chunk_size:
+            del self._after[vehicle_id]
+        else:
+            self._after[vehicle_id] = (rows[-1].timestamp, rows[-1].id)
+        self._buffers[vehicle_id].extend(rows)
+
+    def _push_next(self, vehicle_id: int):
+        buffer = self._buffers[vehicle_id]
+        if not buffer and vehicle_id in self._after:
+            self._refill(vehicle_id)
+        if buffer:
+            row = buffer.popleft()
+            heapq.heappush(self._heap, (to_epoch(row.timestamp), vehicle_id, row))
+
+    def take_until(self, sim_time: float, limit: int) -> list:
+        """Linhas com horário até ``sim_time`` (epoch), no máximo ``limit``"""
+        rows = []
+        try:
+            pending, self._pending = self._pending, []
+            for vehicle_id in pending:
+                self._push_next(vehicle_id)
+            while len(rows) < limit and self._heap and self._heap[0][0] <= sim_time:
+                _, vehicle_id, row = heapq.heappop(self._heap)
+                rows.append(row)
+                self._push_next(vehicle_id)
+        finally:
+            # A sessão só vive durante a leitura deste tick
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        self.exhausted = not self._heap
+        return rows
+
+
+def _load_vehicles(session_factory: Callable[[], Session], vehicle_ids: List[int]) -> dict:
+    db = session_factory()
+    try:
+        return {
+            v.id: {"license_plate": v.license_plate, "vehicle_type": v.vehicle_type}
+            for v in crud.VehicleCRUD.get_vehicles_by_ids(db, vehicle_ids)
+        }
+    finally:
+        db.close()
+
+
+async def stream_replay(websocket: WebSocket, session_factory: Callable[[], Session], vehicle_ids: List[int],
+                        start: datetime, end: datetime, speed: float = 1.0,
+                        tick_seconds: float = 0.1, max_batch: int = 1000):
+    """Reproduz o histórico: um frame ``position_batch`` por tick com as posições
+    (no formato de ``position_update``) que venceram desde o anterior"""
+    loop = asyncio.get_running_loop()
+    vehicles = await loop.run_in_executor(None, _load_vehicles, session_factory, vehicle_ids)
+    cursor = ReplayCursor(session_factory, list(vehicles), start, end)
+
+    sim_start = to_epoch(start)
+    wall_start = loop.time()
+    while not cursor.exhausted:
+        sim_now = sim_start + (loop.time() - wall_start) * speed
+        rows = await loop.run_in_executor(None, cursor.take_until, sim_now, max_batch)
+        if rows:
+            await websocket.send_text(json.dumps({
+                "type": "position_batch",
+                "data": [
+                    {
+                        "vehicle_id": row.vehicle_id,
+                        **vehicles[row.vehicle_id],
+                        "latitude": row.latitude,
+                        "longitude": row.longitude,
+                        "speed": row.speed,
+                        "heading": row.heading,
+                        "timestamp": row.timestamp.isoformat()
+                    }
+                    for row in rows
+                ],
+                "timestamp": rows[-1].timestamp.isoformat()
+            }))
+        # Lote cheio: atrasado em relação ao relógio, segue sem esperar
+        if len(rows) < max_batch:
+            await asyncio.sleep(tick_seconds)
+
+    await websocket.send_text(json.dumps({
+        "type": "replay_complete",
+        "data": {"vehicle_ids": list(vehicles), "start": start.isoformat(), "end": end.isoformat()},
+        "timestamp": datetime.now().isoformat()
+    }))
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from typing import Optional
+import asyncio
+import hmac
+from app.config import settings
+from app.profiling import ProfileCapture, trace_recorder
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+capture = ProfileCapture(settings.PROFILING_OUTPUT_DIR)
+
+
+def _check_admin(token: Optional[str]):
+    if not settings.PROFILING_ENABLED or not settings.PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling disabled")
+    # Comparação em tempo constante para não vazar o token por timing
+    if token is None or not hmac.compare_digest(token.encode(), settings.PROFILING_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.post("/profile")
+async def run_profile(
+    seconds: float = Query(10.0, gt=0),
+    mode: str = Query("sampling", pattern="^(sampling|cprofile)$"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Captura limitada no tempo; o resultado é gravado em PROFILING_OUTPUT_DIR"""
+    _check_admin(x_admin_token)
+    seconds = min(seconds, settings.PROFILING_MAX_SECONDS)
+    if not capture.try_start():
+        raise HTTPException(status_code=409, detail="A profile capture is already running")
+    try:
+        if mode == "cprofile":
+            # Perfila a thread do event loop enquanto as requisições seguem normalmente
+            profiler = capture.start_cprofile()
+            await asyncio.sleep(seconds)
+            result = capture.stop_cprofile(profiler)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(None, capture.sample, seconds)
+    finally:
+        capture.finish()
+    return {"mode": mode, "seconds": seconds, **result}
+
+
+@router.get("/profile/requests")
+def profiled_requests(x_admin_token: Optional[str] = Header(None)):
+    """Requisições amostradas recentes e as lentas, com o tempo por etapa"""
+    _check_admin(x_admin_token)
+    return {"sample_rate": settings.PROFILING_SAMPLE_RATE, **trace_recorder.stats()}
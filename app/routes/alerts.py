@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app import crud, schemas
+from app.database import get_db
+from app.models import AlertType
+from app.rules import rule_engine
+
+router = APIRouter(prefix="/api/alerts", tags=["alerts"])
+
+
+@router.get("/", response_model=List[schemas.VehicleAlert])
+def read_alerts(
+    vehicle_id: Optional[int] = None,
+    rule: Optional[AlertType] = None,
+    is_active: Optional[bool] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    return crud.AlertCRUD.get_alerts(db, vehicle_id, rule, is_active, skip, limit)
+
+
+@router.get("/stats")
+def read_alert_stats():
+    """Veículos acompanhados e alertas ativos no motor de regras deste worker"""
+    return rule_engine.stats()
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app import crud, schemas
+from app.database import get_db
+
+router = APIRouter(prefix="/api/drivers", tags=["drivers"])
+
+
+@router.post("/", response_model=schemas.Driver)
+def create_driver(driver: schemas.DriverCreate, db: Session = Depends(get_db)):
+    if driver.email and crud.DriverCRUD.get_driver_by_email(db, driver.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return crud.DriverCRUD.create_driver(db, driver)
+
+
+@router.get("/", response_model=List[schemas.Driver])
+def read_drivers(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    is_active: Optional[bool] = None,
+    db: Session = Depends(get_db)
+):
+    return crud.DriverCRUD.get_drivers(db, skip, limit, is_active)
+
+
+@router.get("/{driver_id}", response_model=schemas.Driver)
+def read_driver(driver_id: int, db: Session = Depends(get_db)):
+    db_driver = crud.DriverCRUD.get_driver(db, driver_id)
+    if db_driver is None:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    return db_driver
+
+
+@router.put("/{driver_id}", response_model=schemas.Driver)
+def update_driver(driver_id: int, driver_update: schemas.DriverUpdate, db: Session = Depends(get_db)):
+    if driver_update.email:
+        existing = crud.DriverCRUD.get_driver_by_email(db, driver_update.email)
+        if existing is not None and existing.id != driver_id:
+            raise HTTPException(status_code=400, detail="Email already registered")
+    db_driver = crud.DriverCRUD.update_driver(db, driver_id, driver_update)
+    if db_driver is None:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    return db_driver
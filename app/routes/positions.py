@@ -1,41 +1,213 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Optional
+from datetime import datetime
+import json
+import time
 from app import crud, schemas
-from app.database import get_db
+from app.admission import FIXES_SHED, Overloaded, admission_stats, ingest_limiter, shed_reason, vehicle_rate_limiter
+from app.assignments import assignment_index
+from app.catalog import vehicle_catalog
+from app.database import SessionLocal, get_db
+from app.fleet_index import fleet_index
+from app.metrics import INGEST_STAGES, observe_stage
+from app.models import VehicleStatus, VehicleType
+from app.sharding import ingest_shards
+from app.stats import as_utc
 from app.websocket_manager import websocket_manager
 
 router = APIRouter(prefix="/api/positions", tags=["positions"])
 
 
-@router.post("/", response_model=schemas.Position)
+async def ingest_slot():
+    """Vaga no limite global de ingestão, obtida antes da conexão com o banco"""
+    try:
+        await ingest_limiter.acquire()
+    except Overloaded as e:
+        FIXES_SHED["overloaded"].inc()
+        raise HTTPException(
+            status_code=503, detail="Ingest overloaded, retry later", headers={"Retry-After": str(e.retry_after)}
+        )
+    try:
+        yield
+    finally:
+        ingest_limiter.release()
+
+
+def _rate_limited(shed: int):
+    """Nada do pedido coube no limite do veículo: 429 (reject) ou 202 sem gravar (decimate)"""
+    FIXES_SHED[shed_reason()].inc(shed)
+    if shed_reason() == "decimated":
+        return JSONResponse(status_code=202, content={"accepted": shed, "persisted": 0, "shed": shed})
+    raise HTTPException(
+        status_code=429,
+        detail="Position rate limit exceeded for vehicle",
+        headers={"Retry-After": str(vehicle_rate_limiter.retry_after())}
+    )
+
+
+@router.post("/", response_model=schemas.Position, dependencies=[Depends(ingest_slot)])
 async def create_position(position: schemas.PositionCreate, db: Session = Depends(get_db)):
+    start = time.perf_counter()
+    if not vehicle_rate_limiter.admit({position.vehicle_id: 1})[position.vehicle_id]:
+        return _rate_limited(1)
     # Verifica se o veículo existe
     vehicle = crud.VehicleCRUD.get_vehicle(db, position.vehicle_id)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
+    observe_stage("lookup", start)
     
     # Cria a posição
     db_position = crud.PositionCRUD.create_position(db, position)
     
     # Prepara dados para WebSocket
-    position_data = {
-        "vehicle_id": vehicle.id,
-        "license_plate": vehicle.license_plate,
-        "vehicle_type": vehicle.vehicle_type,
-        "latitude": position.latitude,
-        "longitude": position.longitude,
-        "speed": position.speed,
-        "heading": position.heading,
-        "timestamp": db_position.timestamp.isoformat()
-    }
+    position_data = crud.position_message(vehicle, position, db_position.timestamp)
     
     # Envia atualização via WebSocket
+    broadcast_start = time.perf_counter()
     await websocket_manager.send_position_update(position_data)
+    observe_stage("broadcast", broadcast_start)
+    INGEST_STAGES["total"].observe_since(start)
     
     return db_position
 
 
+@router.post("/batch", response_model=schemas.PositionBatchResult, dependencies=[Depends(ingest_slot)])
+async def create_positions_batch(batch: schemas.PositionBatchCreate, db: Session = Depends(get_db)):
+    """Ingestão em lote: um commit e um pipeline Redis para todo o lote.
+    
+    Fixes acima do limite de cada veículo ficam fora do lote (``shed``).
+    """
+    start = time.perf_counter()
+    positions, shed = vehicle_rate_limiter.admit_items(batch.positions, lambda p: p.vehicle_id)
+    if not positions:
+        return _rate_limited(shed)
+    if shed:
+        FIXES_SHED[shed_reason()].inc(shed)
+    vehicle_ids = {position.vehicle_id for position in positions}
+    vehicles = {v.id: v for v in crud.VehicleCRUD.get_vehicles_by_ids(db, vehicle_ids)}
+    missing = vehicle_ids - vehicles.keys()
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Vehicles not found: {sorted(missing)}")
+    observe_stage("lookup", start)
+    
+    latest = crud.PositionCRUD.create_positions_bulk(db, positions, vehicles)
+    
+    # Envia apenas a posição mais recente de cada veículo
+    broadcast_start = time.perf_counter()
+    for vehicle_id, (position, timestamp) in latest.items():
+        await websocket_manager.send_position_update(
+            crud.position_message(vehicles[vehicle_id], position, timestamp)
+        )
+    observe_stage("broadcast", broadcast_start)
+    INGEST_STAGES["total"].observe_since(start)
+    
+    return {"created": len(positions), "vehicles": len(vehicles), "shed": shed}
+
+
+@router.post("/ingest", status_code=202, response_model=schemas.PositionIngestResult,
+             dependencies=[Depends(ingest_slot)])
+async def ingest_positions(request: Request):
+    """Ingestão assíncrona: um fix, uma lista ou {"positions": [...]}.
+    
+    Com INGEST_SHARDS, o corpo só é decodificado aqui e os fixes seguem para
+    os shards (validação e gravação em outros processos); sem shards, é
+    gravado como em /batch antes de responder.
+    """
+    start = time.perf_counter()
+    try:
+        body = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    fixes = body.get("positions") if isinstance(body, dict) and "positions" in body else body
+    if isinstance(fixes, dict):
+        fixes = [fixes]
+    if not isinstance(fixes, list) or not 1 <= len(fixes) <= 5000:
+        raise HTTPException(status_code=400, detail="Expected 1 to 5000 positions")
+    if not all(isinstance(fix, dict) and type(fix.get("vehicle_id")) is int for fix in fixes):
+        raise HTTPException(status_code=422, detail="Every position needs an integer vehicle_id")
+    
+    if not ingest_shards.running:
+        try:
+            batch = schemas.PositionBatchCreate(positions=fixes)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        observe_stage("validation", start)
+        db = SessionLocal()
+        try:
+            result = await create_positions_batch(batch, db)
+        finally:
+            db.close()
+        if isinstance(result, Response):
+            return result
+        return {"accepted": result["created"], "rejected": 0, "shed": result["shed"]}
+    
+    # Com shards, a validação com Pydantic acontece nos processos dos shards
+    observe_stage("validation", start)
+    fixes, shed = vehicle_rate_limiter.admit_items(fixes, lambda fix: fix["vehicle_id"])
+    if not fixes:
+        return _rate_limited(shed)
+    if shed:
+        FIXES_SHED[shed_reason()].inc(shed)
+    accepted = ingest_shards.submit(fixes)
+    INGEST_STAGES["total"].observe_since(start)
+    if accepted < len(fixes):
+        # Algum shard sem espaço: nada foi enfileirado e o cliente reenvia o lote todo
+        raise HTTPException(
+            status_code=503,
+            detail=f"Ingest queues full: {len(fixes)} positions rejected",
+            headers={"Retry-After": "1"}
+        )
+    return {"accepted": accepted, "rejected": 0, "shed": shed}
+
+
+@router.get("/ingest/stats")
+def ingest_stats():
+    """Filas e contadores dos shards de ingestão e da admissão"""
+    return {**ingest_shards.stats(), "admission": admission_stats()}
+
+
+@router.get("/latest")
+def get_latest_positions(
+    request: Request,
+    response: Response,
+    ids: Optional[str] = Query(None, description="IDs separados por vírgula; omitido = frota toda"),
+    vehicle_type: Optional[VehicleType] = None,
+    status: Optional[VehicleStatus] = None,
+    db: Session = Depends(get_db)
+):
+    """Última posição de vários veículos: cache em lote e uma consulta para as faltas"""
+    vehicle_ids = None
+    if ids:
+        try:
+            vehicle_ids = sorted({int(v) for v in ids.split(",") if v.strip()})
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid ids")
+        if len(vehicle_ids) > 5000:
+            raise HTTPException(status_code=400, detail="Too many ids (max 5000)")
+    
+    # A versão da frota muda com qualquer posição, cadastro (placa, status) ou vínculo:
+    # o If-None-Match é conferido antes de qualquer consulta
+    version = crud.fleet_version.current()
+    etag = None
+    if version is not None:
+        etag = f'"fleet-{version}"'
+        if vehicle_catalog.not_modified(etag, request.headers.get("if-none-match")):
+            return Response(status_code=304, headers={"ETag": f"W/{etag}"})
+    
+    vehicle_ids = crud.VehicleCRUD.get_vehicle_ids(db, vehicle_ids, vehicle_type, status)
+    positions = crud.PositionCRUD.get_latest_positions_cached(db, vehicle_ids)
+    vehicles = [
+        assignment_index.enrich(positions[vehicle_id]) for vehicle_id in vehicle_ids if vehicle_id in positions
+    ]
+    if etag is not None:
+        response.headers["ETag"] = f"W/{etag}"
+    return {"count": len(vehicles), "vehicles": vehicles}
+
+
 @router.get("/nearby")
 def get_nearby_vehicles(
     lat: float,
@@ -52,4 +224,69 @@ def get_nearby_vehicles(
         "radius_km": radius_km,
         "count": len(vehicles),
         "vehicles": vehicles
+    }
+
+
+@router.get("/nearest")
+def get_nearest_vehicles(
+    lat: float,
+    lng: float,
+    k: int = Query(5, ge=1, le=100),
+    vehicle_type: Optional[VehicleType] = None,
+    status: Optional[VehicleStatus] = None,
+    max_radius_km: float = Query(50.0, gt=0, le=500)
+):
+    """Os k veículos mais próximos, a partir do índice em memória"""
+    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    
+    nearest = fleet_index.nearest(
+        lat, lng, k,
+        vehicle_type=vehicle_type.value if vehicle_type else None,
+        status=status.value if status else None,
+        max_radius_km=max_radius_km
+    )
+    vehicles = []
+    for entry, distance in nearest:
+        vehicle = entry.to_dict()
+        vehicle["distance_km"] = distance
+        vehicles.append(vehicle)
+    return {
+        "center": {"lat": lat, "lng": lng},
+        "k": k,
+        "count": len(vehicles),
+        "vehicles": vehicles
+    }
+
+
+@router.get("/history/search")
+def search_position_history(
+    lat: float,
+    lng: float,
+    start: datetime,
+    end: datetime,
+    radius_m: float = Query(500, gt=0, le=50000),
+    db: Session = Depends(get_db)
+):
+    """Quais veículos estiveram a até ``radius_m`` do ponto entre ``start`` e ``end``"""
+    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    start, end = as_utc(start), as_utc(end)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'start' must not be after 'end'")
+    
+    matches = crud.PositionCRUD.search_history(db, lat, lng, radius_m, start, end)
+    vehicles = {v.id: v for v in crud.VehicleCRUD.get_vehicles_by_ids(db, [m["vehicle_id"] for m in matches])}
+    for match in matches:
+        vehicle = vehicles.get(match["vehicle_id"])
+        match["license_plate"] = vehicle.license_plate if vehicle else None
+        match["vehicle_type"] = vehicle.vehicle_type if vehicle else None
+    
+    return {
+        "center": {"lat": lat, "lng": lng},
+        "radius_m": radius_m,
+        "start": start,
+        "end": end,
+        "count": len(matches),
+        "vehicles": matches
     }
\ No newline at end of file
@@ -1,11 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+import numpy as np
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from datetime import date, datetime, timezone
 from app import crud, schemas
+from app.assignments import assignment_index
+from app.catalog import vehicle_catalog
+from app.config import settings
 from app.database import get_db
+from app.geo import simplify_track
+from app.models import CommandStatus, VehicleStatus, VehicleType
+from app.profiling import span
+from app.websocket_manager import websocket_manager
+from app.stats import DailyTotals, as_utc, stats_aggregator
 
 router = APIRouter(prefix="/api/vehicles", tags=["vehicles"])
 
+_vehicle_list = TypeAdapter(List[schemas.Vehicle])
+
 
 @router.post("/", response_model=schemas.Vehicle)
 def create_vehicle(vehicle: schemas.VehicleCreate, db: Session = Depends(get_db)):
@@ -17,23 +31,50 @@ def create_vehicle(vehicle: schemas.VehicleCreate, db: Session = Depends(get_db)
 
 @router.get("/", response_model=List[schemas.Vehicle])
 def read_vehicles(
-    skip: int = 0,
-    limit: int = 100,
-    vehicle_type: Optional[str] = None,
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    vehicle_type: Optional[VehicleType] = None,
+    status: Optional[VehicleStatus] = None,
+    plate_prefix: Optional[str] = Query(None, max_length=20),
     db: Session = Depends(get_db)
 ):
-    vehicles = crud.VehicleCRUD.get_vehicles(db, skip=skip, limit=limit)
-    if vehicle_type:
-        vehicles = [v for v in vehicles if v.vehicle_type.value == vehicle_type]
-    return vehicles
+    """Cadastro filtrado no banco e servido do cache até a próxima alteração"""
+    key = (skip, limit, vehicle_type, status, plate_prefix)
+    
+    def load():
+        vehicles = crud.VehicleCRUD.get_vehicles(db, skip, limit, vehicle_type, status, plate_prefix)
+        with span("serialization"):
+            return _vehicle_list.dump_json(vehicles).decode()
+    
+    etag, payload = vehicle_catalog.get(key, load)
+    # no-cache: o navegador revalida sempre e recebe 304 se nada mudou
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if vehicle_catalog.not_modified(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
 
 
 @router.get("/{vehicle_id}", response_model=schemas.VehicleWithPositions)
-def read_vehicle(vehicle_id: int, db: Session = Depends(get_db)):
+def read_vehicle(
+    vehicle_id: int,
+    include_positions: bool = True,
+    positions_limit: int = Query(100, ge=1, le=1000),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
     db_vehicle = crud.VehicleCRUD.get_vehicle(db, vehicle_id)
     if db_vehicle is None:
         raise HTTPException(status_code=404, detail="Vehicle not found")
-    return db_vehicle
+    # Não usa o relacionamento: carregaria todo o histórico do veículo
+    positions = []
+    if include_positions:
+        positions = crud.PositionCRUD.get_vehicle_positions(db, vehicle_id, positions_limit, since, until)
+    return schemas.VehicleWithPositions(
+        **schemas.Vehicle.model_validate(db_vehicle).model_dump(),
+        positions=[schemas.Position.model_validate(p) for p in positions]
+    )
 
 
 @router.put("/{vehicle_id}", response_model=schemas.Vehicle)
@@ -60,21 +101,192 @@ def delete_vehicle(vehicle_id: int, db: Session = Depends(get_db)):
 def get_vehicle_positions(
     vehicle_id: int,
     limit: int = Query(100, ge=1, le=1000),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    simplify: Optional[float] = Query(None, gt=0, description="Tolerância em metros (Douglas-Peucker)"),
+    max_points: Optional[int] = Query(None, ge=2),
+    output_format: str = Query("json", alias="format", pattern="^(json|geojson)$"),
     db: Session = Depends(get_db)
 ):
-    return crud.PositionCRUD.get_vehicle_positions(db, vehicle_id, limit)
+    """Posições do veículo, opcionalmente simplificadas.
+
+    Com ``simplify``/``max_points`` o ``limit`` não se aplica: são lidas até
+    TRACK_MAX_RAW_POINTS posições da janela ``start``–``end`` antes de simplificar.
+    """
+    # Com e sem fuso na mesma consulta: sem fuso é UTC
+    start = as_utc(start) if start is not None else None
+    end = as_utc(end) if end is not None else None
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="'start' must not be after 'end'")
+    simplified = simplify is not None or max_points is not None
+    if not simplified and output_format == "json":
+        return crud.PositionCRUD.get_vehicle_positions(db, vehicle_id, limit, since=start, until=end)
+    
+    raw_limit = settings.TRACK_MAX_RAW_POINTS if simplified else limit
+    rows = crud.PositionCRUD.get_vehicle_track(db, vehicle_id, raw_limit, since=start, until=end)
+    lats = np.fromiter((r.latitude for r in rows), dtype=np.float64, count=len(rows))
+    lngs = np.fromiter((r.longitude for r in rows), dtype=np.float64, count=len(rows))
+    keep = simplify_track(lats, lngs, tolerance_m=simplify, max_points=max_points).tolist()
+    
+    if output_format == "geojson":
+        return JSONResponse({
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[lngs[i], lats[i]] for i in keep]
+            },
+            "properties": {
+                "vehicle_id": vehicle_id,
+                "point_count": len(keep),
+                "original_point_count": len(rows),
+                "start": rows[keep[0]].timestamp.isoformat() if keep else None,
+                "end": rows[keep[-1]].timestamp.isoformat() if keep else None
+            }
+        })
+    
+    # Mesma ordem da rota sem simplificação: mais recente primeiro
+    return [rows[i]._asdict() for i in reversed(keep)]
 
 
 @router.get("/{vehicle_id}/position/latest")
 def get_latest_position(vehicle_id: int, db: Session = Depends(get_db)):
-    # Tenta buscar do cache primeiro
-    cached = crud.PositionCRUD.get_cached_position(vehicle_id)
-    if cached:
-        return cached
-    
-    # Se não tem cache, busca do banco
-    position = crud.PositionCRUD.get_latest_position(db, vehicle_id)
+    # Cache em dois níveis; em falta, busca do banco
+    position = crud.PositionCRUD.get_cached_position(db, vehicle_id)
     if position is None:
         raise HTTPException(status_code=404, detail="No position data found")
     
-    return position
\ No newline at end of file
+    # Motorista atual do índice em memória (sem consulta)
+    return assignment_index.enrich(position)
+
+
+@router.get("/{vehicle_id}/driver", response_model=Optional[schemas.DriverSummary])
+def read_vehicle_driver(vehicle_id: int, db: Session = Depends(get_db)):
+    """Motorista atual do veículo (null se não houver)"""
+    if crud.VehicleCRUD.get_vehicle(db, vehicle_id) is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    return crud.AssignmentCRUD.get_current_driver(db, vehicle_id)
+
+
+@router.put("/{vehicle_id}/driver", response_model=schemas.VehicleAssignment)
+def assign_vehicle_driver(
+    vehicle_id: int,
+    assignment: schemas.VehicleAssignmentCreate,
+    db: Session = Depends(get_db)
+):
+    """Vincula um motorista; o vínculo anterior do veículo e do motorista é encerrado"""
+    if crud.VehicleCRUD.get_vehicle(db, vehicle_id) is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    driver = crud.DriverCRUD.get_driver(db, assignment.driver_id)
+    if driver is None:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    if not driver.is_active:
+        raise HTTPException(status_code=400, detail="Driver is inactive")
+    return crud.AssignmentCRUD.assign_driver(db, vehicle_id, driver)
+
+
+@router.delete("/{vehicle_id}/driver")
+def unassign_vehicle_driver(vehicle_id: int, db: Session = Depends(get_db)):
+    if not crud.AssignmentCRUD.unassign_driver(db, vehicle_id):
+        raise HTTPException(status_code=404, detail="No active assignment")
+    return {"message": "Driver unassigned successfully"}
+
+
+@router.get("/{vehicle_id}/assignments", response_model=List[schemas.VehicleAssignment])
+def read_vehicle_assignments(
+    vehicle_id: int,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Histórico de vínculos, mais recente primeiro"""
+    return crud.AssignmentCRUD.get_assignments(db, vehicle_id, limit)
+
+
+@router.get("/{vehicle_id}/alerts", response_model=List[schemas.VehicleAlert])
+def read_vehicle_alerts(
+    vehicle_id: int,
+    is_active: Optional[bool] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Alertas do veículo, mais recente primeiro"""
+    return crud.AlertCRUD.get_alerts(db, vehicle_id=vehicle_id, is_active=is_active, limit=limit)
+
+
+@router.get("/{vehicle_id}/stats", response_model=schemas.VehicleStats)
+def get_vehicle_stats(
+    vehicle_id: int,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    db: Session = Depends(get_db)
+):
+    """Distância, tempo em movimento e parado por dia, a partir do rollup diário"""
+    if crud.VehicleCRUD.get_vehicle(db, vehicle_id) is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    
+    today = datetime.now(timezone.utc).date()
+    date_to = date_to or today
+    date_from = date_from or date_to
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    
+    # Soma o rollup gravado com os deltas ainda em memória
+    days = {}
+    for row in crud.StatsCRUD.get_daily_stats(db, vehicle_id, date_from, date_to):
+        totals = days[row.day] = DailyTotals()
+        totals.add(row.distance_km, row.moving_seconds, row.idle_seconds, row.fix_count, row.max_speed)
+    for day, pending in stats_aggregator.pending_for(vehicle_id, date_from, date_to).items():
+        days.setdefault(day, DailyTotals()).merge(pending)
+    
+    daily = [
+        schemas.VehicleDailyStats(
+            day=day,
+            distance_km=totals.distance_km,
+            moving_seconds=totals.moving_seconds,
+            idle_seconds=totals.idle_seconds,
+            fix_count=totals.fix_count,
+            max_speed=totals.max_speed
+        )
+        for day, totals in sorted(days.items())
+    ]
+    return schemas.VehicleStats(
+        vehicle_id=vehicle_id,
+        date_from=date_from,
+        date_to=date_to,
+        distance_km=sum(d.distance_km for d in daily),
+        moving_seconds=sum(d.moving_seconds for d in daily),
+        idle_seconds=sum(d.idle_seconds for d in daily),
+        fix_count=sum(d.fix_count for d in daily),
+        days=daily
+    )
+
+
+@router.post("/{vehicle_id}/commands", response_model=schemas.VehicleCommand)
+async def send_vehicle_command(
+    vehicle_id: int,
+    command: schemas.VehicleCommandCreate,
+    db: Session = Depends(get_db)
+):
+    """Registra o comando e o entrega ao veículo; se offline, fica pendente até a reconexão"""
+    if crud.VehicleCRUD.get_vehicle(db, vehicle_id) is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    
+    db_command = crud.CommandCRUD.create_command(db, vehicle_id, command)
+    await websocket_manager.send_to_vehicle(vehicle_id, schemas.WebSocketMessage(
+        type="command",
+        data={
+            "command_id": db_command.id,
+            "command": db_command.command,
+            "payload": db_command.payload or {}
+        }
+    ))
+    return db_command
+
+
+@router.get("/{vehicle_id}/commands", response_model=List[schemas.VehicleCommand])
+def read_vehicle_commands(
+    vehicle_id: int,
+    status: Optional[CommandStatus] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    return crud.CommandCRUD.get_commands(db, vehicle_id, status, limit)
\ No newline at end of file
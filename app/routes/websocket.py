@@ -1,34 +1,202 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
+from pydantic import ValidationError
+from typing import Optional
+from datetime import datetime
+from app import crud, schemas
+from app.admission import FIXES_SHED, Overloaded, ingest_limiter, shed_reason, vehicle_rate_limiter
+from app.database import SessionLocal
+from app.replay import stream_replay
+from app.schemas import WebSocketMessage
+from app.stats import as_utc
 from app.websocket_manager import websocket_manager
+import asyncio
 import json
 
 router = APIRouter()
 
 
+def _command_message(command) -> str:
+    return WebSocketMessage(
+        type="command",
+        data={
+            "command_id": command.id,
+            "command": command.command,
+            "payload": command.payload or {},
+            "target_vehicle": command.vehicle_id
+        },
+        timestamp=datetime.now()
+    ).model_dump_json()
+
+
+def _pending_commands(vehicle_id: int):
+    db = SessionLocal()
+    try:
+        return [_command_message(c) for c in crud.CommandCRUD.get_pending_commands(db, vehicle_id)]
+    finally:
+        db.close()
+
+
+def _store_position(position: schemas.PositionCreate):
+    """Grava uma posição recebida pelo WebSocket; None se o veículo não existe"""
+    db = SessionLocal()
+    try:
+        vehicle = crud.VehicleCRUD.get_vehicle(db, position.vehicle_id)
+        if vehicle is None:
+            return None
+        db_position = crud.PositionCRUD.create_position(db, position)
+        return crud.position_message(vehicle, position, db_position.timestamp)
+    finally:
+        db.close()
+
+
+async def _ingest_position(vehicle_id: int, message: dict):
+    """Ingestão pelo WebSocket do veículo: {"type": "position", "latitude": ..., "longitude": ...}"""
+    try:
+        position = schemas.PositionCreate(**{**message, "vehicle_id": vehicle_id})
+    except (ValidationError, TypeError):
+        websocket_manager.deliver_to_vehicle(
+            vehicle_id, json.dumps({"type": "error", "data": {"detail": "Invalid position"}})
+        )
+        return
+    if not vehicle_rate_limiter.admit({vehicle_id: 1})[vehicle_id]:
+        FIXES_SHED[shed_reason()].inc()
+        if shed_reason() == "rate_limited":
+            websocket_manager.deliver_to_vehicle(
+                vehicle_id, json.dumps({"type": "error", "data": {"detail": "Position rate limit exceeded"}})
+            )
+        return
+    try:
+        async with ingest_limiter.slot():
+            position_data = await asyncio.get_running_loop().run_in_executor(None, _store_position, position)
+    except Overloaded as e:
+        FIXES_SHED["overloaded"].inc()
+        websocket_manager.deliver_to_vehicle(
+            vehicle_id,
+            json.dumps({"type": "error", "data": {"detail": "Ingest overloaded", "retry_after": e.retry_after}})
+        )
+        return
+    if position_data is None:
+        websocket_manager.deliver_to_vehicle(
+            vehicle_id, json.dumps({"type": "error", "data": {"detail": "Vehicle not found"}})
+        )
+        return
+    await websocket_manager.send_position_update(position_data)
+
+
+def _ack_command(vehicle_id: int, command_id: int):
+    db = SessionLocal()
+    try:
+        crud.CommandCRUD.ack_command(db, vehicle_id, command_id)
+    finally:
+        db.close()
+
+
 @router.websocket("/ws/vehicle/{vehicle_id}")
 async def vehicle_websocket(websocket: WebSocket, vehicle_id: int):
-    await websocket_manager.connect(websocket, "vehicles")
+    if not await websocket_manager.connect_vehicle(websocket, vehicle_id):
+        return
+    loop = asyncio.get_running_loop()
     try:
+        # Reenvia os comandos ainda sem confirmação
+        for payload in await loop.run_in_executor(None, _pending_commands, vehicle_id):
+            websocket_manager.deliver_to_vehicle(vehicle_id, payload)
+        
         while True:
             data = await websocket.receive_text()
+            websocket_manager.hub.touch(websocket)
             # Processar dados do veículo
             try:
                 message = json.loads(data)
-                # Aqui você pode processar comandos para o veículo
-                # como desligar motor, travar portas, etc.
-                print(f"Message from vehicle {vehicle_id}: {message}")
             except json.JSONDecodeError:
-                pass
+                continue
+            if isinstance(message, dict) and message.get("type") == "ack" and "command_id" in message:
+                try:
+                    command_id = int(message["command_id"])
+                except (TypeError, ValueError):
+                    continue
+                await loop.run_in_executor(None, _ack_command, vehicle_id, command_id)
+                continue
+            if isinstance(message, dict) and message.get("type") == "pong":
+                continue
+            if isinstance(message, dict) and message.get("type") == "position":
+                await _ingest_position(vehicle_id, message)
+                continue
+            print(f"Message from vehicle {vehicle_id}: {message}")
     except WebSocketDisconnect:
         websocket_manager.disconnect(websocket, "vehicles")
 
 
 @router.websocket("/ws/monitoring")
-async def monitoring_websocket(websocket: WebSocket):
-    await websocket_manager.connect(websocket, "monitoring")
+async def monitoring_websocket(
+    websocket: WebSocket,
+    mode: str = Query("full", pattern="^(full|delta)$"),
+    tick_ms: int = Query(250, ge=50, le=10000),
+    vehicle_ids: Optional[str] = Query(None, description="Assinatura inicial: IDs separados por vírgula"),
+    vehicle_types: Optional[str] = Query(None),
+    bbox: Optional[str] = Query(None, description="min_lng,min_lat,max_lng,max_lat")
+):
+    if not await websocket_manager.connect(websocket, "monitoring"):
+        return
+    if mode == "delta":
+        websocket_manager.set_delta_mode(websocket, tick_ms)
+    if vehicle_ids or vehicle_types or bbox:
+        try:
+            websocket_manager.subscriptions.subscribe(
+                websocket,
+                vehicle_ids=[int(v) for v in (vehicle_ids or "").split(",") if v.strip()],
+                vehicle_types=[v.strip() for v in (vehicle_types or "").split(",") if v.strip()],
+                bbox=tuple(float(v) for v in bbox.split(",")) if bbox else None
+            )
+        except ValueError:
+            websocket_manager.disconnect(websocket, "monitoring")
+            await websocket.close(code=1008, reason="Invalid subscription")
+            return
+    # Estado atual da frota logo após conectar
+    websocket_manager.send_snapshot(websocket)
     try:
         while True:
-            # Manter conexão aberta
-            await websocket.receive_text()
+            # Mensagens de subscribe/unsubscribe do cliente
+            data = await websocket.receive_text()
+            websocket_manager.hub.touch(websocket)
+            await websocket_manager.handle_monitoring_message(websocket, data)
+    except WebSocketDisconnect:
+        websocket_manager.disconnect(websocket, "monitoring")
+
+
+@router.get("/api/ws/stats")
+def websocket_stats():
+    """Conexões, tempo de vida, profundidade das filas de envio e descartes"""
+    return {
+        "monitoring": len(websocket_manager.active_connections["monitoring"]),
+        "vehicles": len(websocket_manager.active_connections["vehicles"]),
+        "vehicles_identified": len(websocket_manager.vehicle_sockets),
+        "delta_clients": len(websocket_manager.delta_streams),
+        "fanout": websocket_manager.hub.stats(),
+        "broker": websocket_manager.broker.stats()
+    }
+
+
+@router.websocket("/ws/replay")
+async def replay_websocket(
+    websocket: WebSocket,
+    vehicle_ids: str = Query(..., description="IDs separados por vírgula"),
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    speed: float = Query(1.0, gt=0, le=1000)
+):
+    await websocket.accept()
+    try:
+        ids = sorted({int(v) for v in vehicle_ids.split(",") if v.strip()})
+    except ValueError:
+        await websocket.close(code=1008, reason="Invalid vehicle_ids")
+        return
+    start, end = as_utc(start), as_utc(end)
+    if not ids or len(ids) > 200 or start > end:
+        await websocket.close(code=1008, reason="Invalid replay window")
+        return
+    
+    try:
+        await stream_replay(websocket, SessionLocal, ids, start, end, speed)
+        await websocket.close()
     except WebSocketDisconnect:
-        websocket_manager.disconnect(websocket, "monitoring")
\ No newline at end of file
+        pass
\ No newline at end of file
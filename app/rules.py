@@ -0,0 +1,671 @@
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+import redis
+
+from app.config import settings
+from app.metrics import registry
+from app.stats import to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Bits de alerta ativo por veículo
+SPEEDING, IDLE, OFFLINE = 1, 2, 4
+_RULE_NAMES = {SPEEDING: "speeding", IDLE: "idle", OFFLINE: "offline"}
+
+ALERTS = {
+    (rule, state): registry.counter("tracking_alerts_total", "Alertas abertos e encerrados", {"rule": rule, "state": state})
+    for rule in _RULE_NAMES.values() for state in ("raised", "resolved")
+}
+
+
+def _event(vehicle_id: int, rule: int, state: str, epoch: float, value: Optional[float] = None) -> dict:
+    return {
+        "vehicle_id": vehicle_id,
+        "rule": _RULE_NAMES[rule],
+        "state": state,
+        "value": value,
+        "at": datetime.fromtimestamp(epoch, timezone.utc)
+    }
+
+
+# Velocidade e parada de cada veículo num hash {ts, idle_since, speeding, idle}.
+# Percorre os fixes de cada veículo (KEYS[i]) em ordem, como RuleEngine.evaluate,
+# e devolve os eventos como (i, j, código, início da parada) achatados
+_EVALUATE_SCRIPT = """
+local hysteresis = tonumber(ARGV[1])
+local idle_speed = tonumber(ARGV[2])
+local idle_seconds = tonumber(ARGV[3])
+local result = {}
+local arg = 4
+local function emit(i, j, code, extra)
+    result[#result + 1] = i
+    result[#result + 1] = j
+    result[#result + 1] = code
+    result[#result + 1] = extra or ''
+end
+for i, key in ipairs(KEYS) do
+    local count = tonumber(ARGV[arg])
+    arg = arg + 1
+    local state = redis.call('HMGET', key, 'ts', 'idle_since', 'speeding', 'idle')
+    local last_ts_raw = state[1]
+    local last_ts = tonumber(last_ts_raw)
+    local idle_since = state[2]
+    local speeding = state[3] == '1'
+    local idle = state[4] == '1'
+    for j = 1, count do
+        local ts_raw, speed_raw, limit_raw = ARGV[arg], ARGV[arg + 1], ARGV[arg + 2]
+        arg = arg + 3
+        local ts = tonumber(ts_raw)
+        if not last_ts or ts >= last_ts then
+            last_ts, last_ts_raw = ts, ts_raw
+            if speed_raw ~= '' then
+                local speed = tonumber(speed_raw)
+                local limit = tonumber(limit_raw) or math.huge
+                if not speeding and speed > limit then
+                    speeding = true
+                    emit(i, j, 'speeding_raised')
+                elseif speeding and speed <= limit - hysteresis then
+                    speeding = false
+                    emit(i, j, 'speeding_resolved')
+                end
+                if speed >= idle_speed then
+                    idle_since = false
+                    if idle then
+                        idle = false
+                        emit(i, j, 'idle_resolved')
+                    end
+                elseif not idle_since then
+                    idle_since = ts_raw
+                elseif not idle and ts - tonumber(idle_since) >= idle_seconds then
+                    idle = true
+                    emit(i, j, 'idle_raised', idle_since)
+                end
+            end
+        end
+    end
+    if last_ts_raw then
+        redis.call('HSET', key, 'ts', last_ts_raw, 'speeding', speeding and '1' or '0', 'idle', idle and '1' or '0')
+    end
+    if idle_since then
+        redis.call('HSET', key, 'idle_since', idle_since)
+    else
+        redis.call('HDEL', key, 'idle_since')
+    end
+end
+return result
+"""
+
+# "Sem sinal": KEYS[1] guarda o prazo de cada veículo (ZSET por epoch) e KEYS[2]
+# os que estão sem sinal, pelo horário do último fix. Um fix mais novo que esse
+# horário encerra o alerta; devolve os veículos que voltaram
+_TOUCH_SCRIPT = """
+local offline_seconds = tonumber(ARGV[1])
+local back = {}
+for i = 2, #ARGV, 2 do
+    local member, seen_at = ARGV[i], tonumber(ARGV[i + 1])
+    local offline_since = tonumber(redis.call('ZSCORE', KEYS[2], member))
+    if offline_since and seen_at > offline_since then
+        redis.call('ZREM', KEYS[2], member)
+        back[#back + 1] = member
+        offline_since = nil
+    end
+    if not offline_since then
+        local deadline = seen_at + offline_seconds
+        local current = tonumber(redis.call('ZSCORE', KEYS[1], member))
+        if not current or current < deadline then
+            redis.call('ZADD', KEYS[1], deadline, member)
+        end
+    end
+end
+return back
+"""
+
+# Tira do ZSET de prazos os vencidos e marca como sem sinal; cada veículo é
+# reivindicado por um único worker. Devolve o número de vencidos e os pares
+# (veículo, segundos sem sinal) abertos agora
+_POLL_SCRIPT = """
+local now = tonumber(ARGV[1])
+local offline_seconds = tonumber(ARGV[2])
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[3]))
+local result = {math.floor(#due / 2)}
+for i = 1, #due, 2 do
+    local member = due[i]
+    local seen_at = tonumber(due[i + 1]) - offline_seconds
+    redis.call('ZREM', KEYS[1], member)
+    if redis.call('ZADD', KEYS[2], 'NX', seen_at, member) == 1 then
+        result[#result + 1] = member
+        result[#result + 1] = tostring(now - seen_at)
+    end
+end
+return result
+"""
+
+# Alerta "sem sinal" já aberto no banco: o último fix conhecido é o do prazo
+# agendado pelo touch (ou nenhum, e qualquer fix encerra)
+_LOAD_OFFLINE_SCRIPT = """
+local offline_seconds = tonumber(ARGV[1])
+for i = 2, #ARGV do
+    local deadline = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[i]))
+    redis.call('ZADD', KEYS[2], 'NX', deadline and deadline - offline_seconds or 0, ARGV[i])
+end
+return #ARGV - 1
+"""
+
+_EVENT_CODES = {
+    "speeding_raised": (SPEEDING, "raised"),
+    "speeding_resolved": (SPEEDING, "resolved"),
+    "idle_raised": (IDLE, "raised"),
+    "idle_resolved": (IDLE, "resolved")
+}
+
+
+def _rule_key(vehicle_id: int) -> str:
+    return f"rules:vehicle:{vehicle_id}"
+
+
+class RedisRuleState:
+    """Estado das regras no Redis, compartilhado por todos os workers e shards.
+
+    Cada chamada é um script Lua: os fixes de um veículo são avaliados em ordem
+    sobre o estado atual, de qualquer processo, e o "sem sinal" de cada
+    veículo é aberto por um único worker.
+    """
+
+    DEADLINES_KEY = "rules:offline:deadlines"
+    OFFLINE_KEY = "rules:offline:active"
+
+    def __init__(self, redis_client, engine: "RuleEngine", poll_batch: int = 1000):
+        self.redis = redis_client
+        self.engine = engine
+        self.poll_batch = poll_batch
+        self._evaluate = redis_client.register_script(_EVALUATE_SCRIPT)
+        self._touch = redis_client.register_script(_TOUCH_SCRIPT)
+        self._poll = redis_client.register_script(_POLL_SCRIPT)
+        self._load_offline = redis_client.register_script(_LOAD_OFFLINE_SCRIPT)
+
+    def evaluate(self, fixes: List[tuple]) -> List[dict]:
+        """``fixes`` são (vehicle_id, limite, velocidade, epoch) em ordem por veículo e horário"""
+        groups: Dict[int, List[tuple]] = {}
+        for fix in fixes:
+            groups.setdefault(fix[0], []).append(fix)
+        vehicle_ids = list(groups)
+        engine = self.engine
+        args = [engine.hysteresis_kmh, engine.idle_speed_kmh, engine.idle_seconds]
+        for vehicle_id in vehicle_ids:
+            args.append(len(groups[vehicle_id]))
+            for _, limit, speed, ts in groups[vehicle_id]:
+                args += [
+                    repr(float(ts)),
+                    "" if speed is None else repr(float(speed)),
+                    "" if math.isinf(limit) else repr(float(limit))
+                ]
+        raw = self._evaluate(keys=[_rule_key(vehicle_id) for vehicle_id in vehicle_ids], args=args)
+
+        events = []
+        for k in range(0, len(raw), 4):
+            vehicle_id = vehicle_ids[int(raw[k]) - 1]
+            _, _, speed, ts = groups[vehicle_id][int(raw[k + 1]) - 1]
+            rule, state = _EVENT_CODES[raw[k + 2]]
+            if rule == SPEEDING:
+                value = float(speed)
+            elif state == "raised":
+                value = ts - float(raw[k + 3])
+            else:
+                value = None
+            events.append(_event(vehicle_id, rule, state, float(ts), value))
+        return events
+
+    def touch(self, seen: Dict[int, float]) -> List[int]:
+        """Adia o prazo de "sem sinal"; retorna os veículos que voltaram"""
+        args = [self.engine.offline_seconds]
+        for vehicle_id, seen_at in seen.items():
+            args += [vehicle_id, repr(seen_at)]
+        back = self._touch(keys=[self.DEADLINES_KEY, self.OFFLINE_KEY], args=args)
+        return [int(vehicle_id) for vehicle_id in back]
+
+    def poll(self, now: float) -> List[dict]:
+        events = []
+        while True:
+            raw = self._poll(
+                keys=[self.DEADLINES_KEY, self.OFFLINE_KEY],
+                args=[repr(now), self.engine.offline_seconds, self.poll_batch]
+            )
+            for k in range(1, len(raw), 2):
+                events.append(_event(int(raw[k]), OFFLINE, "raised", now, float(raw[k + 1])))
+            if int(raw[0]) < self.poll_batch:
+                return events
+
+    def load_active(self, alerts: Sequence):
+        offline = []
+        pipe = self.redis.pipeline(transaction=False)
+        for vehicle_id, rule in alerts:
+            rule = getattr(rule, "value", rule)
+            if rule == "offline":
+                offline.append(vehicle_id)
+            else:
+                pipe.hset(_rule_key(vehicle_id), rule, "1")
+        pipe.execute()
+        if offline:
+            self._load_offline(
+                keys=[self.DEADLINES_KEY, self.OFFLINE_KEY], args=[self.engine.offline_seconds, *offline]
+            )
+
+    def forget(self, vehicle_id: int):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(_rule_key(vehicle_id))
+        pipe.zrem(self.DEADLINES_KEY, vehicle_id)
+        pipe.zrem(self.OFFLINE_KEY, vehicle_id)
+        pipe.execute()
+
+    def stats(self) -> dict:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(self.DEADLINES_KEY)
+        pipe.zcard(self.OFFLINE_KEY)
+        scheduled, offline = pipe.execute()
+        return {"scheduled": scheduled, "active": {"offline": offline}}
+
+
+class TimerWheel:
+    """Roda de temporização com buckets de ``tick_seconds``.
+
+    Agendar e disparar custam O(1) por chave; prazos além do alcance da roda
+    vão para o último bucket e são reavaliados por quem recebe o disparo.
+    """
+
+    def __init__(self, tick_seconds: float, span_seconds: float, now: float):
+        self.tick = tick_seconds
+        self.size = int(math.ceil(span_seconds / tick_seconds)) + 1
+        self._slots = [set() for _ in range(self.size)]
+        # Último tick já disparado
+        self._current = int(now // tick_seconds)
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def schedule(self, key: Hashable, deadline: float):
+        tick = min(max(math.ceil(deadline / self.tick), self._current + 1), self._current + self.size - 1)
+        self._slots[tick % self.size].add(key)
+
+    def advance(self, now: float) -> list:
+        """Chaves cujos buckets venceram até ``now``"""
+        target = int(now // self.tick)
+        fired = []
+        for tick in range(self._current + 1, self._current + 1 + min(target - self._current, self.size)):
+            slot = self._slots[tick % self.size]
+            fired.extend(slot)
+            slot.clear()
+        self._current = max(self._current, target)
+        return fired
+
+
+class RuleEngine:
+    """Regras de excesso de velocidade, parada prolongada e veículo sem sinal.
+
+    Avaliadas a cada fix gravado (ou vetorizadas por lote), com o estado de
+    cada veículo em arrays NumPy indexados por um slot. Um alerta só é aberto
+    se ainda não estiver ativo e só é encerrado se estiver, então cada episódio
+    gera um par de eventos. "Sem sinal" usa uma roda de temporização: cada
+    veículo tem no máximo uma entrada agendada, reavaliada quando vence.
+
+    Esse estado é do processo: com vários workers, ``use_redis`` passa a
+    guardá-lo no Redis (``RedisRuleState``). Se o Redis falhar, a avaliação
+    segue com o estado local.
+    """
+
+    def __init__(self, speed_limits: Dict[str, float], hysteresis_kmh: float, idle_speed_kmh: float,
+                 idle_seconds: float, offline_seconds: float, tick_seconds: float, enabled: bool = True,
+                 capacity: int = 1024):
+        self.speed_limits = speed_limits
+        self.hysteresis_kmh = hysteresis_kmh
+        self.idle_speed_kmh = idle_speed_kmh
+        self.idle_seconds = idle_seconds
+        self.offline_seconds = offline_seconds
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._slots: Dict[int, int] = {}
+        self._vehicle_ids = np.zeros(capacity, dtype=np.int64)
+        # Epoch do último fix avaliado (fixes mais antigos são ignorados)
+        self._last_ts = np.full(capacity, -np.inf)
+        # Início da parada atual (NaN em movimento)
+        self._idle_since = np.full(capacity, np.nan)
+        # Epoch de recebimento do último fix, para a regra "sem sinal"
+        self._seen_at = np.full(capacity, np.nan)
+        self._scheduled = np.zeros(capacity, dtype=bool)
+        self._flags = np.zeros(capacity, dtype=np.uint8)
+        self._wheel = TimerWheel(tick_seconds, offline_seconds, time.time())
+        # Veículos que voltaram a reportar, encerrados no próximo poll()
+        self._back_online: List[int] = []
+        self._listeners: List[Callable[[List[dict]], None]] = []
+        self.redis_state: Optional[RedisRuleState] = None
+        self.redis_errors = 0
+
+    def use_redis(self, redis_client):
+        """Passa a guardar o estado das regras no Redis, compartilhado entre os processos"""
+        self.redis_state = RedisRuleState(redis_client, self)
+
+    def _redis_failed(self, action: str):
+        self.redis_errors += 1
+        logger.warning("Falha no Redis ao %s; usando o estado local das regras", action, exc_info=True)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _grow(self, capacity: int):
+        extra = capacity - len(self._vehicle_ids)
+        self._vehicle_ids = np.r_[self._vehicle_ids, np.zeros(extra, dtype=np.int64)]
+        self._last_ts = np.r_[self._last_ts, np.full(extra, -np.inf)]
+        self._idle_since = np.r_[self._idle_since, np.full(extra, np.nan)]
+        self._seen_at = np.r_[self._seen_at, np.full(extra, np.nan)]
+        self._scheduled = np.r_[self._scheduled, np.zeros(extra, dtype=bool)]
+        self._flags = np.r_[self._flags, np.zeros(extra, dtype=np.uint8)]
+
+    def _slot(self, vehicle_id: int) -> int:
+        slot = self._slots.get(vehicle_id)
+        if slot is None:
+            slot = self._slots[vehicle_id] = len(self._slots)
+            if slot >= len(self._vehicle_ids):
+                self._grow(len(self._vehicle_ids) * 2)
+            self._vehicle_ids[slot] = vehicle_id
+        return slot
+
+    def _speed_limit(self, vehicle_type) -> float:
+        return self.speed_limits.get(getattr(vehicle_type, "value", vehicle_type), math.inf)
+
+    def evaluate(self, vehicle_id: int, vehicle_type, speed: Optional[float], timestamp: datetime) -> List[dict]:
+        """Velocidade e parada para um único fix; retorna os eventos gerados"""
+        if not self.enabled:
+            return []
+        ts = to_epoch(timestamp)
+        limit = self._speed_limit(vehicle_type)
+        if self.redis_state is not None:
+            try:
+                return self.redis_state.evaluate([(vehicle_id, limit, speed, ts)])
+            except redis.RedisError:
+                self._redis_failed("avaliar as regras")
+        events = []
+        with self._lock:
+            slot = self._slot(vehicle_id)
+            if ts < self._last_ts[slot]:
+                # Fix fora de ordem: não altera o estado
+                return events
+            self._last_ts[slot] = ts
+            if speed is None:
+                return events
+            flags = int(self._flags[slot])
+            if not flags & SPEEDING and speed > limit:
+                flags |= SPEEDING
+                events.append(_event(vehicle_id, SPEEDING, "raised", ts, speed))
+            elif flags & SPEEDING and speed <= limit - self.hysteresis_kmh:
+                flags &= ~SPEEDING
+                events.append(_event(vehicle_id, SPEEDING, "resolved", ts, speed))
+
+            if speed >= self.idle_speed_kmh:
+                self._idle_since[slot] = np.nan
+                if flags & IDLE:
+                    flags &= ~IDLE
+                    events.append(_event(vehicle_id, IDLE, "resolved", ts))
+            elif math.isnan(self._idle_since[slot]):
+                self._idle_since[slot] = ts
+            elif not flags & IDLE and ts - self._idle_since[slot] >= self.idle_seconds:
+                flags |= IDLE
+                events.append(_event(vehicle_id, IDLE, "raised", ts, ts - float(self._idle_since[slot])))
+            self._flags[slot] = flags
+        return events
+
+    def evaluate_batch(self, vehicle_ids: Sequence[int], vehicle_types: Sequence, speeds: Sequence[Optional[float]],
+                       timestamps: Sequence[datetime]) -> List[dict]:
+        """Velocidade e parada para um lote de fixes usando NumPy.
+
+        Gera os mesmos eventos que ``evaluate`` chamado fix a fix em ordem
+        cronológica, inclusive episódios que abrem e encerram dentro do lote.
+        """
+        if not self.enabled or not len(vehicle_ids):
+            return []
+        vid = np.asarray(vehicle_ids, dtype=np.int64)
+        spd = np.array([np.nan if s is None else s for s in speeds], dtype=np.float64)
+        ts = np.array([to_epoch(t) for t in timestamps], dtype=np.float64)
+        limit = np.array([self._speed_limit(t) for t in vehicle_types], dtype=np.float64)
+
+        order = np.lexsort((ts, vid))
+        vid, spd, ts, limit = vid[order], spd[order], ts[order], limit[order]
+        if self.redis_state is not None:
+            try:
+                return self.redis_state.evaluate([
+                    (vehicle_id, limit[i], None if math.isnan(spd[i]) else spd[i], ts[i])
+                    for i, vehicle_id in enumerate(vid.tolist())
+                ])
+            except redis.RedisError:
+                self._redis_failed("avaliar as regras")
+
+        with self._lock:
+            unique_ids, inverse = np.unique(vid, return_inverse=True)
+            slots = np.array([self._slot(v) for v in unique_ids.tolist()], dtype=np.int64)
+            inverse = inverse.reshape(-1)
+            keep = ts >= self._last_ts[slots][inverse]
+            np.maximum.at(self._last_ts, slots[inverse[keep]], ts[keep])
+            keep &= ~np.isnan(spd)
+            if not keep.all():
+                vid, spd, ts, limit = vid[keep], spd[keep], ts[keep], limit[keep]
+                if not len(vid):
+                    return []
+
+            unique_ids, first_idx, group = np.unique(vid, return_index=True, return_inverse=True)
+            group = group.reshape(-1)
+            slots = np.array([self._slots[v] for v in unique_ids.tolist()], dtype=np.int64)
+            n = len(vid)
+            rows = np.arange(n)
+            is_first = rows == first_idx[group]
+            last_idx = np.r_[first_idx[1:], n] - 1
+            flags = self._flags[slots]
+            was_speeding = (flags & SPEEDING) > 0
+            was_idle = (flags & IDLE) > 0
+
+            # Velocidade: cada fix abre (acima do limite), encerra (até o limite menos a
+            # histerese) ou mantém; o estado de um fix é o do último que decidiu
+            decision = np.where(spd > limit, 1, np.where(spd <= limit - self.hysteresis_kmh, 0, -1))
+            decided = np.maximum.accumulate(np.where(decision >= 0, rows, -1))
+            speeding = np.where(
+                decided >= first_idx[group], decision[np.maximum(decided, 0)] == 1, was_speeding[group]
+            )
+            speeding_before = np.where(is_first, was_speeding[group], np.roll(speeding, 1))
+            raise_speeding = speeding & ~speeding_before
+            resolve_speeding = ~speeding & speeding_before
+
+            # Parada: sequências de fixes lentos. A primeira do veículo continua a parada
+            # anterior ao lote (se havia); as demais começam no próprio primeiro fix
+            moving = spd >= self.idle_speed_kmh
+            prev_moving = np.roll(moving, 1)
+            run_start = ~moving & (is_first | prev_moving)
+            run = np.cumsum(run_start) - 1
+            starts = np.flatnonzero(run_start)
+            start_first = is_first[starts]
+            previous_idle = self._idle_since[slots][group[starts]]
+            inherit = start_first & ~np.isnan(previous_idle)
+            run_since = np.where(inherit, previous_idle, ts[starts])
+            run_idle = start_first & was_idle[group[starts]]
+
+            # Abre no primeiro fix da sequência (exceto o que inicia a parada) com tempo suficiente
+            slow_rows = np.flatnonzero(~moving)
+            slow_run = run[slow_rows]
+            eligible = (ts[slow_rows] - run_since[slow_run] >= self.idle_seconds) & (
+                (slow_rows != starts[slow_run]) | inherit[slow_run]
+            )
+            raise_row = np.full(len(starts), n)
+            np.minimum.at(raise_row, slow_run[eligible], slow_rows[eligible])
+            raise_row[run_idle] = n
+            run_end_idle = run_idle | (raise_row < n)
+
+            idle_since_row = np.full(n, np.nan)
+            idle_since_row[slow_rows] = run_since[slow_run]
+            idle_after_run = np.zeros(n, dtype=bool)
+            idle_after_run[slow_rows] = run_end_idle[slow_run]
+            raise_idle = np.zeros(n, dtype=bool)
+            raise_idle[raise_row[raise_row < n]] = True
+            # Encerra no fix em movimento se a parada anterior estava com alerta
+            idle_before = np.where(
+                is_first, was_idle[group], ~prev_moving & idle_after_run[np.maximum(rows - 1, 0)]
+            )
+            resolve_idle = moving & idle_before
+
+            self._idle_since[slots] = idle_since_row[last_idx]
+            self._flags[slots] = (
+                (flags & ~np.uint8(SPEEDING | IDLE))
+                | np.where(speeding[last_idx], SPEEDING, 0).astype(np.uint8)
+                | np.where(idle_after_run[last_idx], IDLE, 0).astype(np.uint8)
+            )
+
+        events = []
+        for i in np.flatnonzero(raise_speeding | resolve_speeding | resolve_idle | raise_idle).tolist():
+            vehicle_id, at = int(vid[i]), float(ts[i])
+            if raise_speeding[i]:
+                events.append(_event(vehicle_id, SPEEDING, "raised", at, float(spd[i])))
+            elif resolve_speeding[i]:
+                events.append(_event(vehicle_id, SPEEDING, "resolved", at, float(spd[i])))
+            if resolve_idle[i]:
+                events.append(_event(vehicle_id, IDLE, "resolved", at))
+            elif raise_idle[i]:
+                events.append(_event(vehicle_id, IDLE, "raised", at, at - float(idle_since_row[i])))
+        return events
+
+    def touch(self, vehicle_id: int, seen_at: Optional[float] = None):
+        """Registra um fix gravado para a regra "sem sinal" """
+        self.touch_many({vehicle_id: seen_at})
+
+    def touch_many(self, seen: Dict[int, Optional[float]]):
+        """``touch`` para vários veículos (vehicle_id -> epoch do fix, None = agora)"""
+        if not self.enabled or not seen:
+            return
+        now = time.time()
+        seen = {vehicle_id: now if seen_at is None else min(seen_at, now) for vehicle_id, seen_at in seen.items()}
+        if self.redis_state is not None:
+            try:
+                back = self.redis_state.touch(seen)
+            except redis.RedisError:
+                self._redis_failed("registrar fixes")
+            else:
+                with self._lock:
+                    self._back_online.extend(back)
+                return
+        with self._lock:
+            for vehicle_id, seen_at in seen.items():
+                slot = self._slot(vehicle_id)
+                if seen_at <= self._seen_at[slot]:
+                    continue
+                self._seen_at[slot] = seen_at
+                if self._flags[slot] & OFFLINE:
+                    self._flags[slot] &= ~np.uint8(OFFLINE)
+                    self._back_online.append(vehicle_id)
+                if not self._scheduled[slot]:
+                    self._scheduled[slot] = True
+                    self._wheel.schedule(vehicle_id, seen_at + self.offline_seconds)
+
+    def poll(self, now: Optional[float] = None) -> List[dict]:
+        """Avança a roda: abre "sem sinal" dos vencidos e encerra os que voltaram"""
+        if not self.enabled:
+            return []
+        now = time.time() if now is None else now
+        with self._lock:
+            events = [_event(vehicle_id, OFFLINE, "resolved", now) for vehicle_id in self._back_online]
+            self._back_online = []
+        if self.redis_state is not None:
+            try:
+                return events + self.redis_state.poll(now)
+            except redis.RedisError:
+                self._redis_failed("verificar veículos sem sinal")
+        with self._lock:
+            fired = self._wheel.advance(now)
+            if not fired:
+                return events
+            slots = np.array([self._slots[v] for v in fired], dtype=np.int64)
+            silent = now - self._seen_at[slots]
+            expired = silent >= self.offline_seconds
+            # Silêncio NaN: veículo esquecido depois de agendado
+            pending = ~expired & ~np.isnan(silent)
+            self._scheduled[slots[~pending]] = False
+            self._flags[slots[expired]] |= np.uint8(OFFLINE)
+            for slot in slots[pending].tolist():
+                # Recebeu fixes desde o agendamento: volta para a roda com o novo prazo
+                self._wheel.schedule(int(self._vehicle_ids[slot]), self._seen_at[slot] + self.offline_seconds)
+        events.extend(
+            _event(int(self._vehicle_ids[slot]), OFFLINE, "raised", now, float(seconds))
+            for slot, seconds in zip(slots[expired].tolist(), silent[expired].tolist())
+        )
+        return events
+
+    def load_active(self, alerts: Sequence):
+        """Marca alertas já abertos no banco, pares (vehicle_id, rule)"""
+        if self.redis_state is not None:
+            try:
+                self.redis_state.load_active(alerts)
+                return
+            except redis.RedisError:
+                self._redis_failed("carregar os alertas ativos")
+        bits = {name: bit for bit, name in _RULE_NAMES.items()}
+        with self._lock:
+            for vehicle_id, rule in alerts:
+                slot = self._slot(vehicle_id)
+                self._flags[slot] |= np.uint8(bits[getattr(rule, "value", rule)])
+
+    def forget(self, vehicle_id: int):
+        if self.redis_state is not None:
+            try:
+                self.redis_state.forget(vehicle_id)
+            except redis.RedisError:
+                self._redis_failed("remover o veículo")
+        with self._lock:
+            slot = self._slots.get(vehicle_id)
+            if slot is not None:
+                self._last_ts[slot] = -np.inf
+                self._idle_since[slot] = np.nan
+                self._seen_at[slot] = np.nan
+                self._flags[slot] = 0
+                # Uma entrada ainda agendada vence sem efeito
+
+    def on_alert(self, listener: Callable[[List[dict]], None]):
+        """Chamado com os alertas gravados (ex.: envio pelo WebSocket)"""
+        self._listeners.append(listener)
+
+    def publish(self, alerts: List[dict]):
+        """Repassa aos listeners os alertas gravados (dicts de ``schemas.VehicleAlert``)"""
+        for alert in alerts:
+            ALERTS[(alert["rule"], "raised" if alert["is_active"] else "resolved")].inc()
+        for listener in self._listeners:
+            listener(alerts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            flags = self._flags[:len(self._slots)]
+            stats = {
+                "enabled": self.enabled,
+                "backend": "redis" if self.redis_state is not None else "memory",
+                "tracked_vehicles": len(self._slots),
+                "scheduled": int(self._scheduled.sum()),
+                "active": {name: int(((flags & bit) > 0).sum()) for bit, name in _RULE_NAMES.items()},
+                "redis_errors": self.redis_errors
+            }
+        if self.redis_state is not None:
+            try:
+                stats.update(self.redis_state.stats())
+            except redis.RedisError:
+                self._redis_failed("ler as estatísticas")
+        return stats
+
+
+rule_engine = RuleEngine(
+    speed_limits={
+        "car": settings.RULES_SPEED_LIMIT_CAR_KMH,
+        "motorcycle": settings.RULES_SPEED_LIMIT_MOTORCYCLE_KMH
+    },
+    hysteresis_kmh=settings.RULES_SPEED_HYSTERESIS_KMH,
+    idle_speed_kmh=settings.STATS_MOVING_SPEED_KMH,
+    idle_seconds=settings.RULES_IDLE_SECONDS,
+    offline_seconds=settings.RULES_OFFLINE_SECONDS,
+    tick_seconds=settings.RULES_TIMER_TICK_SECONDS,
+    enabled=settings.RULES_ENABLED
+)
@@ -0,0 +1,99 @@
+import logging
+from typing import List
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import models
+from app.database import Base
+from app.geo import geohash_encode
+
+logger = logging.getLogger(__name__)
+
+_BACKFILL_CHUNK = 5000
+
+
+def _add_missing_columns(conn, inspector) -> List[str]:
+    """ALTER TABLE para colunas do modelo que ainda não existem no banco"""
+    applied = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} without a default")
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            applied.append(f"column {table.name}.{column.name}")
+    return applied
+
+
+def _create_missing_indexes(conn, inspector) -> List[str]:
+    """Índices declarados nos modelos que create_all não cria em tabelas já existentes"""
+    applied = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=conn)
+                applied.append(f"index {index.name}")
+    return applied
+
+
+def _backfill_geohash(conn) -> int:
+    """Calcula o geohash das posições gravadas antes da coluna existir, em blocos por id"""
+    positions = models.VehiclePosition.__table__
+    update = positions.update().where(positions.c.id == bindparam("row_id")).values(geohash=bindparam("cell"))
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            positions.select()
+            .with_only_columns(positions.c.id, positions.c.latitude, positions.c.longitude)
+            .where(positions.c.id > last_id, positions.c.geohash.is_(None))
+            .order_by(positions.c.id)
+            .limit(_BACKFILL_CHUNK)
+        ).all()
+        if not rows:
+            return total
+        conn.execute(update, [
+            {"row_id": row.id, "cell": geohash_encode(row.latitude, row.longitude)} for row in rows
+        ])
+        total += len(rows)
+        last_id = rows[-1].id
+
+
+def _upgrade(engine: Engine) -> List[str]:
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        applied = _add_missing_columns(conn, inspector)
+        backfilled = _backfill_geohash(conn)
+        if backfilled:
+            applied.append(f"geohash backfill ({backfilled} rows)")
+        # Depois do preenchimento: o índice de cobertura é montado uma vez só
+        applied += _create_missing_indexes(conn, inspect(conn))
+    return applied
+
+
+def upgrade_schema(engine: Engine) -> List[str]:
+    """Leva um banco criado por versões anteriores ao esquema atual dos modelos.
+
+    ``create_all`` só cria tabelas que faltam; aqui entram as colunas e índices
+    adicionados depois (ex.: ``vehicle_positions.geohash``) e o preenchimento
+    das linhas antigas. Idempotente: sem nada a fazer, só inspeciona o banco.
+    """
+    try:
+        applied = _upgrade(engine)
+    except SQLAlchemyError:
+        # Outro worker subindo ao mesmo tempo pode ter aplicado o mesmo passo
+        logger.warning("Atualização do esquema falhou; tentando de novo", exc_info=True)
+        applied = _upgrade(engine)
+    for step in applied:
+        logger.info("Esquema atualizado: %s", step)
+    return applied
@@ -1,8 +1,8 @@
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
-from app.models import VehicleType, VehicleStatus
+from app.models import AlertType, VehicleType, VehicleStatus, CommandStatus
 
 
 class VehicleBase(BaseModel):
@@ -46,6 +46,25 @@ class PositionBase(BaseModel):
 
 class PositionCreate(PositionBase):
     vehicle_id: int
+    # Horário do fix no dispositivo; se omitido, usa o horário do servidor
+    timestamp: Optional[datetime] = None
+
+
+class PositionBatchCreate(BaseModel):
+    positions: List[PositionCreate] = Field(..., min_length=1, max_length=5000)
+
+
+class PositionBatchResult(BaseModel):
+    created: int
+    vehicles: int
+    # Fixes acima do limite por veículo, não gravados
+    shed: int = 0
+
+
+class PositionIngestResult(BaseModel):
+    accepted: int
+    rejected: int
+    shed: int = 0
 
 
 class Position(PositionBase):
@@ -61,8 +80,111 @@ class VehicleWithPositions(Vehicle):
     positions: List[Position] = []
 
 
+class VehicleDailyStats(BaseModel):
+    day: date
+    distance_km: float = 0.0
+    moving_seconds: float = 0.0
+    idle_seconds: float = 0.0
+    fix_count: int = 0
+    max_speed: float = 0.0
+    
+    class Config:
+        from_attributes = True
+
+
+class VehicleStats(BaseModel):
+    vehicle_id: int
+    date_from: date
+    date_to: date
+    distance_km: float
+    moving_seconds: float
+    idle_seconds: float
+    fix_count: int
+    days: List[VehicleDailyStats] = []
+
+
+class VehicleCommandCreate(BaseModel):
+    command: str = Field(..., min_length=1, max_length=50)
+    payload: dict = {}
+
+
+class VehicleCommand(VehicleCommandCreate):
+    id: int
+    vehicle_id: int
+    status: CommandStatus
+    created_at: datetime
+    acked_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class DriverBase(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    email: Optional[str] = Field(None, max_length=100)
+    phone: Optional[str] = Field(None, max_length=20)
+    license_number: Optional[str] = Field(None, max_length=50)
+    is_active: bool = True
+
+
+class DriverCreate(DriverBase):
+    pass
+
+
+class DriverUpdate(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=100)
+    email: Optional[str] = Field(None, max_length=100)
+    phone: Optional[str] = Field(None, max_length=20)
+    license_number: Optional[str] = Field(None, max_length=50)
+    is_active: Optional[bool] = None
+
+
+class Driver(DriverBase):
+    id: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class DriverSummary(BaseModel):
+    id: int
+    name: str
+    phone: Optional[str] = None
+
+
+class VehicleAssignmentCreate(BaseModel):
+    driver_id: int
+
+
+class VehicleAssignment(BaseModel):
+    id: int
+    vehicle_id: int
+    driver_id: Optional[int] = None
+    assigned_at: datetime
+    unassigned_at: Optional[datetime] = None
+    is_active: bool
+    driver: Optional[DriverSummary] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class VehicleAlert(BaseModel):
+    id: int
+    vehicle_id: int
+    rule: AlertType
+    value: Optional[float] = None
+    started_at: datetime
+    resolved_at: Optional[datetime] = None
+    is_active: bool
+    
+    class Config:
+        from_attributes = True
+
+
 class WebSocketMessage(BaseModel):
-    type: str  # "position_update", "vehicle_status", "new_vehicle"
+    type: str  # "position_update", "vehicle_status", "new_vehicle", "alert"
     data: dict
     timestamp: datetime = Field(default_factory=datetime.now)
 
@@ -0,0 +1,358 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from app.config import settings
+from app.metrics import FIXES_INGESTED, registry
+
+logger = logging.getLogger(__name__)
+
+# Contadores devolvidos por lote pelos shards
+_RESULT_COUNTERS = ("stored", "duplicates", "invalid", "unknown", "errors")
+
+
+class _ShardWorker:
+    """Estado e gravação de um shard, dentro do processo filho.
+
+    Todos os fixes de um veículo caem no mesmo shard e chegam por uma única
+    fila, então a ordem por veículo é a de chegada. O shard guarda os horários
+    dos últimos ``dedup_window`` fixes de cada veículo e descarta só repetições
+    exatas; fixes atrasados vão para o histórico, mas não substituem a última
+    posição nem passam pelas regras. Mantém o próprio agregador de
+    estatísticas diárias e grava em lotes. As regras de alerta não rodam aqui:
+    os fixes gravados voltam para o processo da API.
+    """
+
+    def __init__(self, shard_id: int, results: multiprocessing.Queue, vehicle_ttl: float = 60.0,
+                 dedup_window: int = 64):
+        from app import crud, schemas
+        from app.database import SessionLocal
+        from app.stats import stats_aggregator, to_epoch
+
+        self.crud = crud
+        self.schemas = schemas
+        self.session_factory = SessionLocal
+        self.stats_aggregator = stats_aggregator
+        self.to_epoch = to_epoch
+        self.shard_id = shard_id
+        self.results = results
+        self.vehicle_ttl = vehicle_ttl
+        self.dedup_window = dedup_window
+        # vehicle_id -> epoch do fix mais recente gravado
+        self.last_seen: Dict[int, float] = {}
+        # vehicle_id -> epochs dos últimos fixes gravados (dict como conjunto ordenado)
+        self.recent: Dict[int, Dict[float, None]] = {}
+        self.vehicles: Dict[int, object] = {}
+        self.vehicles_loaded_at = time.monotonic()
+        self.stats_flushed_at = time.monotonic()
+
+    def _vehicles(self, db, vehicle_ids: Iterable[int]) -> Dict[int, object]:
+        # Cadastro em memória, recarregado periodicamente (status e tipo mudam pouco)
+        if time.monotonic() - self.vehicles_loaded_at > self.vehicle_ttl:
+            self.vehicles.clear()
+            self.vehicles_loaded_at = time.monotonic()
+        missing = [vid for vid in vehicle_ids if vid not in self.vehicles]
+        if missing:
+            for vehicle in self.crud.VehicleCRUD.get_vehicles_by_ids(db, missing):
+                db.expunge(vehicle)
+                self.vehicles[vehicle.id] = vehicle
+        return self.vehicles
+
+    def process(self, raw_fixes: List[dict]):
+        counts = dict.fromkeys(_RESULT_COUNTERS, 0)
+        received_at = datetime.now(timezone.utc)
+        positions = []
+        for raw in raw_fixes:
+            try:
+                position = self.schemas.PositionCreate(**raw)
+            except (ValueError, TypeError):
+                counts["invalid"] += 1
+                continue
+            if position.timestamp is None:
+                position.timestamp = received_at
+            positions.append(position)
+
+        db = self.session_factory()
+        messages = []
+        # (vehicle_id, tipo, velocidade, horário) dos fixes gravados, para as regras
+        fixes = []
+        try:
+            vehicles = self._vehicles(db, {p.vehicle_id for p in positions})
+            accepted = []
+            # Fixes aceitos neste lote; só entram em ``recent`` depois da gravação
+            batch_seen = set()
+            for position in positions:
+                if position.vehicle_id not in vehicles:
+                    counts["unknown"] += 1
+                    continue
+                key = (position.vehicle_id, self.to_epoch(position.timestamp))
+                if key in batch_seen or key[1] in self.recent.get(position.vehicle_id, ()):
+                    counts["duplicates"] += 1
+                    continue
+                batch_seen.add(key)
+                accepted.append(position)
+
+            if accepted:
+                latest = self.crud.PositionCRUD.create_positions_bulk(
+                    db, accepted, vehicles, evaluate_rules=False, newer_than=self.last_seen
+                )
+                # Só os fixes mais novos que o último gravado passam pelas regras
+                fixes = [
+                    (p.vehicle_id, vehicles[p.vehicle_id].vehicle_type.value, p.speed, p.timestamp)
+                    for p in accepted
+                    if self.to_epoch(p.timestamp) > self.last_seen.get(p.vehicle_id, float("-inf"))
+                ]
+                self._remember(batch_seen)
+                counts["stored"] = len(accepted)
+                messages = [
+                    self.crud.position_message(vehicles[vehicle_id], position, timestamp)
+                    for vehicle_id, (position, timestamp) in latest.items()
+                ]
+
+            if time.monotonic() - self.stats_flushed_at >= settings.STATS_FLUSH_INTERVAL_SECONDS:
+                self.stats_aggregator.flush(db)
+                self.stats_flushed_at = time.monotonic()
+        except Exception:
+            db.rollback()
+            counts["errors"] += len(positions)
+            logger.exception("Shard %d: falha ao gravar lote de %d posições", self.shard_id, len(positions))
+        finally:
+            db.close()
+        self.results.put({
+            "shard": self.shard_id, "received": len(raw_fixes), "messages": messages, "fixes": fixes, **counts
+        })
+
+    def _remember(self, keys: Iterable[tuple]):
+        for vehicle_id, ts in sorted(keys):
+            recent = self.recent.setdefault(vehicle_id, {})
+            recent[ts] = None
+            if len(recent) > self.dedup_window:
+                del recent[next(iter(recent))]
+            if ts > self.last_seen.get(vehicle_id, float("-inf")):
+                self.last_seen[vehicle_id] = ts
+
+    def flush_stats(self):
+        db = self.session_factory()
+        try:
+            self.stats_aggregator.flush(db)
+        finally:
+            db.close()
+
+
+def _shard_main(shard_id: int, inbox: multiprocessing.Queue, results: multiprocessing.Queue,
+                batch_size: int, linger_seconds: float):
+    """Loop do processo de um shard: junta fixes até ``batch_size`` ou ``linger_seconds``"""
+    worker = _ShardWorker(shard_id, results)
+    pending: List[dict] = []
+    deadline = None
+    stopping = False
+    while not stopping:
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            item = inbox.get(timeout=timeout)
+            if item is None:
+                stopping = True
+            else:
+                pending.extend(item)
+                if deadline is None:
+                    deadline = time.monotonic() + linger_seconds
+        except queue.Empty:
+            pass
+        if pending and (stopping or len(pending) >= batch_size or time.monotonic() >= deadline):
+            for start in range(0, len(pending), batch_size):
+                worker.process(pending[start:start + batch_size])
+            pending = []
+            deadline = None
+    worker.flush_stats()
+
+
+class IngestShards:
+    """Ingestão distribuída em processos por ``vehicle_id % N``.
+
+    O processo da API só lê o JSON e encaminha os fixes brutos; validação,
+    gravação em lote, cache e estatísticas rodam nos shards. As mensagens
+    ``position_update`` voltam por uma fila de resultados e seguem pelo broker
+    como na ingestão síncrona; os fixes gravados passam pelas regras de alerta
+    no processo da API, dono do estado de cada veículo.
+
+    Só ``POST /api/positions/ingest`` passa pelos shards: ``POST /api/positions/``,
+    ``/batch`` e o WebSocket dos veículos continuam gravando no processo da API.
+    """
+
+    def __init__(self, num_shards: int, batch_size: int = 500, linger_seconds: float = 0.05,
+                 queue_size: int = 1000):
+        self.num_shards = num_shards
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self.queue_size = queue_size
+        # Fixes enviados a cada shard e ainda não processados, limitados a
+        # ``queue_size`` lotes de ``batch_size``; o leitor de resultados desconta
+        self.in_flight = [0] * num_shards
+        self.max_in_flight = queue_size * batch_size
+        self._lock = threading.Lock()
+        # spawn: cada shard abre as próprias conexões com o banco e o Redis
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._results: Optional[multiprocessing.Queue] = None
+        self._reader: Optional[threading.Thread] = None
+        self.running = False
+        self.submitted = [0] * num_shards
+        self.rejected = [0] * num_shards
+        self.totals = {shard: dict.fromkeys(_RESULT_COUNTERS, 0) for shard in range(num_shards)}
+
+    def start(self, on_messages: Callable[[List[dict]], None]):
+        """``on_messages`` recebe, na thread leitora, as mensagens de cada lote gravado"""
+        if self.running or self.num_shards <= 0:
+            return
+        self._results = self._context.Queue()
+        for shard_id in range(self.num_shards):
+            # Sem maxsize: o limite é ``in_flight``, verificado antes de enfileirar
+            inbox = self._context.Queue()
+            process = self._context.Process(
+                target=_shard_main,
+                args=(shard_id, inbox, self._results, self.batch_size, self.linger_seconds),
+                name=f"ingest-shard-{shard_id}",
+                daemon=True
+            )
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        self._reader = threading.Thread(
+            target=self._read_results, args=(on_messages,), name="ingest-results", daemon=True
+        )
+        self._reader.start()
+        self.running = True
+        logger.info("Ingestão com %d shards iniciada", self.num_shards)
+
+    def _read_results(self, on_messages: Callable[[List[dict]], None]):
+        while True:
+            result = self._results.get()
+            if result is None:
+                return
+            with self._lock:
+                self.in_flight[result["shard"]] -= result["received"]
+            totals = self.totals[result["shard"]]
+            for counter in _RESULT_COUNTERS:
+                totals[counter] += result[counter]
+            FIXES_INGESTED.inc(result["stored"])
+            if result["messages"]:
+                try:
+                    on_messages(result["messages"])
+                except Exception:
+                    logger.exception("Erro ao publicar posições do shard %d", result["shard"])
+            if result["fixes"]:
+                self._evaluate_rules(result["fixes"])
+
+    @staticmethod
+    def _evaluate_rules(fixes: List[tuple]):
+        from app.crud import AlertCRUD
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            AlertCRUD.evaluate_positions(db, *map(list, zip(*fixes)))
+        except Exception:
+            logger.exception("Erro ao avaliar as regras de %d posições dos shards", len(fixes))
+        finally:
+            db.close()
+
+    def shard_of(self, vehicle_id: int) -> int:
+        return vehicle_id % self.num_shards
+
+    def submit(self, fixes: List[dict]) -> int:
+        """Encaminha fixes já decodificados; retorna quantos foram aceitos.
+
+        Tudo ou nada: se algum shard não tem espaço para os fixes dele, nenhum
+        é enfileirado e o retorno é 0. Assim o reenvio do cliente não grava de
+        novo parte do lote (fixes sem horário recebem o do shard e não seriam
+        reconhecidos como repetidos). Uma mensagem por shard e por chamada.
+        """
+        groups: Dict[int, List[dict]] = {}
+        for fix in fixes:
+            groups.setdefault(self.shard_of(fix["vehicle_id"]), []).append(fix)
+        with self._lock:
+            if any(self.in_flight[shard_id] + len(group) > self.max_in_flight for shard_id, group in groups.items()):
+                for shard_id, group in groups.items():
+                    self.rejected[shard_id] += len(group)
+                return 0
+            for shard_id, group in groups.items():
+                self._inboxes[shard_id].put_nowait(group)
+                self.in_flight[shard_id] += len(group)
+                self.submitted[shard_id] += len(group)
+        return len(fixes)
+
+    def stop(self, timeout: float = 10.0):
+        """Grava o que estiver nas filas e encerra os shards"""
+        if not self.running:
+            return
+        self.running = False
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Shard %s não terminou a tempo; encerrando", process.name)
+                process.terminate()
+        self._results.put(None)
+        self._reader.join(timeout)
+        self._inboxes, self._processes = [], []
+        self.in_flight = [0] * self.num_shards
+
+    def queue_depths(self) -> List[Optional[int]]:
+        depths = []
+        for inbox in self._inboxes:
+            try:
+                depths.append(inbox.qsize())
+            except NotImplementedError:
+                # macOS não implementa qsize()
+                depths.append(None)
+        return depths
+
+    def stats(self) -> dict:
+        depths = self.queue_depths()
+        return {
+            "enabled": self.running,
+            "shards": [
+                {
+                    "shard": shard_id,
+                    "alive": self._processes[shard_id].is_alive() if self.running else False,
+                    "queue_depth": depths[shard_id] if self.running else 0,
+                    "in_flight": self.in_flight[shard_id],
+                    "submitted": self.submitted[shard_id],
+                    "rejected": self.rejected[shard_id],
+                    **self.totals[shard_id]
+                }
+                for shard_id in range(self.num_shards)
+            ],
+            "batch_size": self.batch_size,
+            "linger_ms": self.linger_seconds * 1000,
+            "queue_size": self.queue_size,
+            "max_in_flight": self.max_in_flight
+        }
+
+
+ingest_shards = IngestShards(
+    settings.INGEST_SHARDS,
+    batch_size=settings.INGEST_BATCH_SIZE,
+    linger_seconds=settings.INGEST_LINGER_MS / 1000,
+    queue_size=settings.INGEST_QUEUE_SIZE
+)
+
+registry.collector(
+    "tracking_ingest_shard_queue_depth", "gauge", "Lotes aguardando em cada shard de ingestão",
+    lambda: [({"shard": str(i)}, depth) for i, depth in enumerate(ingest_shards.queue_depths())]
+)
+registry.collector(
+    "tracking_ingest_shard_fixes_total", "counter", "Fixes processados pelos shards, por resultado",
+    lambda: [({"shard": str(shard), "result": counter}, totals[counter])
+             for shard, totals in ingest_shards.totals.items() for counter in _RESULT_COUNTERS]
+)
+registry.collector(
+    "tracking_ingest_shard_rejected_total", "counter", "Fixes recusados por fila de shard cheia",
+    lambda: [({"shard": str(i)}, count) for i, count in enumerate(ingest_shards.rejected)]
+)
@@ -0,0 +1,380 @@
+import asyncio
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import redis
+from sqlalchemy import case, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import settings
+from app.geo import haversine_km, haversine_km_np
+
+logger = logging.getLogger(__name__)
+
+_EPOCH_DAY = date(1970, 1, 1)
+
+# Troca a última posição de cada veículo (hash {lat, lng, ts}) pela mais nova do
+# lote, sem voltar no tempo, e devolve a anterior: o trecho entre as duas entra
+# no hodômetro de quem gravou, qualquer que seja o processo. ARGV[1] é a
+# expiração (s), renovada a cada fix
+_SWAP_LAST_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+local result = {}
+for i, key in ipairs(KEYS) do
+    local lat, lng, ts = ARGV[3 * i - 1], ARGV[3 * i], ARGV[3 * i + 1]
+    local prev = redis.call('HMGET', key, 'lat', 'lng', 'ts')
+    if not prev[3] or tonumber(prev[3]) <= tonumber(ts) then
+        redis.call('HSET', key, 'lat', lat, 'lng', lng, 'ts', ts)
+    end
+    redis.call('EXPIRE', key, ttl)
+    if prev[3] then
+        result[i] = prev
+    else
+        result[i] = false
+    end
+end
+return result
+"""
+
+
+def _last_key(vehicle_id: int) -> str:
+    return f"stats:last:{vehicle_id}"
+
+
+def as_utc(value: datetime) -> datetime:
+    """Datetime com fuso em UTC (datetimes sem fuso são UTC)"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_epoch(value: datetime) -> float:
+    """Converte datetime em segundos desde epoch (datetimes sem fuso são UTC)"""
+    return as_utc(value).timestamp()
+
+
+class DailyTotals:
+    __slots__ = ("distance_km", "moving_seconds", "idle_seconds", "fix_count", "max_speed")
+
+    def __init__(self):
+        self.distance_km = 0.0
+        self.moving_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.fix_count = 0
+        self.max_speed = 0.0
+
+    def add(self, distance_km, moving_seconds, idle_seconds, fix_count, max_speed):
+        self.distance_km += distance_km
+        self.moving_seconds += moving_seconds
+        self.idle_seconds += idle_seconds
+        self.fix_count += fix_count
+        if max_speed > self.max_speed:
+            self.max_speed = max_speed
+
+    def merge(self, other: "DailyTotals"):
+        self.add(other.distance_km, other.moving_seconds, other.idle_seconds,
+                 other.fix_count, other.max_speed)
+
+
+def _add_daily_totals(db: Session, rows: List[dict]):
+    """Soma os deltas no rollup diário no próprio banco, sem ler a linha antes.
+
+    Vários processos descarregam ao mesmo tempo: cada linha é um upsert
+    (``INSERT ... ON CONFLICT DO UPDATE SET col = col + excluded.col``) no
+    SQLite e no PostgreSQL; nos demais bancos, ``UPDATE col = col + :delta``
+    e INSERT quando o dia ainda não existe.
+    """
+    table = models.VehicleDailyStats.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        greatest = func.greatest if dialect == "postgresql" else func.max
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.vehicle_id, table.c.day],
+            set_={
+                "distance_km": table.c.distance_km + stmt.excluded.distance_km,
+                "moving_seconds": table.c.moving_seconds + stmt.excluded.moving_seconds,
+                "idle_seconds": table.c.idle_seconds + stmt.excluded.idle_seconds,
+                "fix_count": table.c.fix_count + stmt.excluded.fix_count,
+                "max_speed": greatest(table.c.max_speed, stmt.excluded.max_speed)
+            }
+        )
+        db.execute(stmt, rows)
+        return
+
+    for row in rows:
+        increment = update(table).where(
+            table.c.vehicle_id == row["vehicle_id"], table.c.day == row["day"]
+        ).values(
+            distance_km=table.c.distance_km + row["distance_km"],
+            moving_seconds=table.c.moving_seconds + row["moving_seconds"],
+            idle_seconds=table.c.idle_seconds + row["idle_seconds"],
+            fix_count=table.c.fix_count + row["fix_count"],
+            max_speed=case((table.c.max_speed < row["max_speed"], row["max_speed"]), else_=table.c.max_speed)
+        )
+        if db.execute(increment).rowcount:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(table.insert().values(**row))
+        except IntegrityError:
+            # Outro processo criou o dia entre o UPDATE e o INSERT
+            db.execute(increment)
+
+
+class VehicleStatsAggregator:
+    """Hodômetro incremental e tempos de movimento/parada por veículo e dia.
+
+    Cada fix soma a distância (haversine) desde a última posição conhecida do
+    veículo. Os totais ficam em memória e são descarregados periodicamente na
+    tabela ``vehicle_daily_stats`` somando deltas, o que permite vários workers.
+    Com Redis, a última posição é compartilhada entre os processos (workers,
+    shards); sem ele, ou se o Redis falhar, fica em memória.
+    """
+
+    def __init__(self, moving_speed_kmh: float, max_gap_seconds: float, redis_client=None,
+                 last_ttl_seconds: int = 259200):
+        self.moving_speed_kmh = moving_speed_kmh
+        self.max_gap_seconds = max_gap_seconds
+        self.last_ttl_seconds = last_ttl_seconds
+        self._lock = threading.Lock()
+        # vehicle_id -> (lat, lng, epoch)
+        self._last: Dict[int, Tuple[float, float, float]] = {}
+        # (vehicle_id, dia) -> totais ainda não gravados
+        self._pending: Dict[Tuple[int, date], DailyTotals] = {}
+        self.redis = None
+        self._swap_script = None
+        self.redis_errors = 0
+        if redis_client is not None:
+            self.use_redis(redis_client)
+
+    def use_redis(self, redis_client):
+        """Passa a guardar a última posição de cada veículo no Redis"""
+        self.redis = redis_client
+        self._swap_script = redis_client.register_script(_SWAP_LAST_SCRIPT)
+
+    def _swap_last(self, latest: Dict[int, Tuple[float, float, float]]) -> Dict[int, Optional[Tuple[float, float, float]]]:
+        """Registra a posição mais nova de cada veículo e devolve a anterior"""
+        if self._swap_script is not None:
+            vehicle_ids = list(latest)
+            try:
+                previous = self._swap_script(
+                    keys=[_last_key(vehicle_id) for vehicle_id in vehicle_ids],
+                    args=[
+                        self.last_ttl_seconds,
+                        *(repr(value) for vehicle_id in vehicle_ids for value in latest[vehicle_id])
+                    ]
+                )
+                return {
+                    vehicle_id: tuple(float(v) for v in prev) if prev else None
+                    for vehicle_id, prev in zip(vehicle_ids, previous)
+                }
+            except redis.RedisError:
+                self.redis_errors += 1
+                logger.warning("Falha no Redis ao ler a última posição; usando a memória local", exc_info=True)
+        with self._lock:
+            previous = {vehicle_id: self._last.get(vehicle_id) for vehicle_id in latest}
+            for vehicle_id, value in latest.items():
+                prev = previous[vehicle_id]
+                if prev is None or value[2] >= prev[2]:
+                    self._last[vehicle_id] = value
+        return previous
+
+    def _totals(self, vehicle_id: int, day: date) -> DailyTotals:
+        key = (vehicle_id, day)
+        totals = self._pending.get(key)
+        if totals is None:
+            totals = self._pending[key] = DailyTotals()
+        return totals
+
+    def record(self, vehicle_id: int, latitude: float, longitude: float,
+               speed: Optional[float], timestamp: datetime):
+        """Atualiza os agregados com um único fix"""
+        ts = to_epoch(timestamp)
+        prev = self._swap_last({vehicle_id: (latitude, longitude, ts)})[vehicle_id]
+        if prev is not None and ts < prev[2]:
+            # Fix fora de ordem: não altera o hodômetro
+            return
+        distance = moving = idle = 0.0
+        if prev is not None:
+            distance = haversine_km(prev[0], prev[1], latitude, longitude)
+            dt = ts - prev[2]
+            if 0 < dt <= self.max_gap_seconds:
+                current_speed = speed if speed is not None else distance / dt * 3600
+                if current_speed >= self.moving_speed_kmh:
+                    moving = dt
+                else:
+                    idle = dt
+        day = _EPOCH_DAY + timedelta(days=int(ts // 86400))
+        with self._lock:
+            self._totals(vehicle_id, day).add(distance, moving, idle, 1, speed or 0.0)
+
+    def record_batch(self, vehicle_ids: Sequence[int], latitudes: Sequence[float],
+                     longitudes: Sequence[float], speeds: Sequence[Optional[float]],
+                     timestamps: Sequence[datetime]):
+        """Atualiza os agregados com um lote de fixes usando NumPy"""
+        if not len(vehicle_ids):
+            return
+        vid = np.asarray(vehicle_ids, dtype=np.int64)
+        lat = np.asarray(latitudes, dtype=np.float64)
+        lng = np.asarray(longitudes, dtype=np.float64)
+        spd = np.array([np.nan if s is None else s for s in speeds], dtype=np.float64)
+        ts = np.array([to_epoch(t) for t in timestamps], dtype=np.float64)
+
+        order = np.lexsort((ts, vid))
+        vid, lat, lng, spd, ts = vid[order], lat[order], lng[order], spd[order], ts[order]
+
+        # Posição mais nova de cada veículo no lote (última linha do grupo)
+        unique_ids, first_idx = np.unique(vid, return_index=True)
+        last_rows = np.r_[first_idx[1:], len(vid)] - 1
+        previous = self._swap_last({
+            int(vid[i]): (float(lat[i]), float(lng[i]), float(ts[i])) for i in last_rows.tolist()
+        })
+
+        # Descarta fixes anteriores ao último já processado
+        last_lat, last_lng, last_ts = self._previous_arrays(unique_ids, previous)
+        keep = ts >= np.repeat(last_ts, np.diff(np.r_[first_idx, len(vid)]))
+        if not keep.all():
+            vid, lat, lng, spd, ts = vid[keep], lat[keep], lng[keep], spd[keep], ts[keep]
+            if not len(vid):
+                return
+            unique_ids, first_idx = np.unique(vid, return_index=True)
+            last_lat, last_lng, last_ts = self._previous_arrays(unique_ids, previous)
+
+        # Posição anterior de cada linha: a linha de cima, ou a última conhecida
+        prev_lat = np.roll(lat, 1)
+        prev_lng = np.roll(lng, 1)
+        prev_ts = np.roll(ts, 1)
+        prev_lat[first_idx] = last_lat
+        prev_lng[first_idx] = last_lng
+        prev_ts[first_idx] = last_ts
+
+        has_prev = ~np.isnan(prev_lat)
+        distance = np.where(has_prev, haversine_km_np(prev_lat, prev_lng, lat, lng), 0.0)
+        distance = np.nan_to_num(distance)
+        dt = ts - prev_ts
+        valid = has_prev & (dt > 0) & (dt <= self.max_gap_seconds)
+        dt = np.where(valid, dt, 0.0)
+        implied = np.divide(distance * 3600, dt, out=np.zeros_like(dt), where=dt > 0)
+        current_speed = np.where(np.isnan(spd), implied, spd)
+        is_moving = current_speed >= self.moving_speed_kmh
+        moving = np.where(is_moving, dt, 0.0)
+        idle = np.where(is_moving, 0.0, dt)
+
+        days = (ts // 86400).astype(np.int64)
+        keys = np.stack((vid, days), axis=1)
+        groups, group_idx = np.unique(keys, axis=0, return_inverse=True)
+        group_idx = group_idx.reshape(-1)
+        n = len(groups)
+        sum_distance = np.bincount(group_idx, distance, n)
+        sum_moving = np.bincount(group_idx, moving, n)
+        sum_idle = np.bincount(group_idx, idle, n)
+        fixes = np.bincount(group_idx, minlength=n)
+        max_speed = np.zeros(n)
+        np.maximum.at(max_speed, group_idx, np.nan_to_num(spd))
+
+        with self._lock:
+            for i, (vehicle_id, day) in enumerate(groups.tolist()):
+                self._totals(vehicle_id, _EPOCH_DAY + timedelta(days=day)).add(
+                    float(sum_distance[i]), float(sum_moving[i]), float(sum_idle[i]),
+                    int(fixes[i]), float(max_speed[i])
+                )
+
+    @staticmethod
+    def _previous_arrays(vehicle_ids: np.ndarray, previous: Dict[int, Optional[Tuple[float, float, float]]]):
+        last = [previous.get(v) for v in vehicle_ids.tolist()]
+        return (
+            np.array([p[0] if p else np.nan for p in last]),
+            np.array([p[1] if p else np.nan for p in last]),
+            np.array([p[2] if p else -np.inf for p in last])
+        )
+
+    def pending_for(self, vehicle_id: int, date_from: date, date_to: date) -> Dict[date, DailyTotals]:
+        """Totais ainda não gravados de um veículo no intervalo"""
+        with self._lock:
+            return {
+                day: totals for (vid, day), totals in self._pending.items()
+                if vid == vehicle_id and date_from <= day <= date_to
+            }
+
+    def forget(self, vehicle_id: int):
+        with self._lock:
+            self._last.pop(vehicle_id, None)
+            for key in [k for k in self._pending if k[0] == vehicle_id]:
+                del self._pending[key]
+        if self.redis is not None:
+            try:
+                self.redis.delete(_last_key(vehicle_id))
+            except redis.RedisError:
+                logger.warning("Falha ao remover a última posição do veículo %d do Redis", vehicle_id, exc_info=True)
+
+    def flush(self, db: Session) -> int:
+        """Grava os deltas acumulados no rollup diário; retorna as linhas afetadas"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            vehicle_ids = {vid for vid, _ in pending}
+            known = {
+                row[0] for row in
+                db.query(models.Vehicle.id).filter(models.Vehicle.id.in_(vehicle_ids))
+            }
+            pending = {key: totals for key, totals in pending.items() if key[0] in known}
+            if not pending:
+                return 0
+
+            _add_daily_totals(db, [
+                {
+                    "vehicle_id": vehicle_id,
+                    "day": day,
+                    "distance_km": totals.distance_km,
+                    "moving_seconds": totals.moving_seconds,
+                    "idle_seconds": totals.idle_seconds,
+                    "fix_count": totals.fix_count,
+                    "max_speed": totals.max_speed
+                }
+                for (vehicle_id, day), totals in pending.items()
+            ])
+            db.commit()
+            return len(pending)
+        except Exception:
+            db.rollback()
+            # Devolve os deltas para a próxima tentativa
+            with self._lock:
+                for key, totals in pending.items():
+                    self._totals(*key).merge(totals)
+            raise
+
+    async def run_flusher(self, session_factory, interval_seconds: float):
+        """Loop que descarrega os agregados a cada ``interval_seconds``"""
+        loop = asyncio.get_running_loop()
+
+        def flush_once():
+            db = session_factory()
+            try:
+                return self.flush(db)
+            finally:
+                db.close()
+
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await loop.run_in_executor(None, flush_once)
+            except Exception:
+                logger.exception("Erro ao gravar estatísticas diárias")
+
+
+stats_aggregator = VehicleStatsAggregator(
+    moving_speed_kmh=settings.STATS_MOVING_SPEED_KMH,
+    max_gap_seconds=settings.STATS_MAX_GAP_SECONDS,
+    last_ttl_seconds=settings.STATS_LAST_POSITION_TTL_SECONDS
+)
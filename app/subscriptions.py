@@ -0,0 +1,186 @@
+import math
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+BBox = Tuple[float, float, float, float]  # (min_lng, min_lat, max_lng, max_lat)
+
+
+class Subscription:
+    __slots__ = ("all", "vehicle_ids", "vehicle_types", "bboxes", "cells", "wide")
+
+    def __init__(self):
+        # Sem filtros o cliente recebe a frota inteira (comportamento original)
+        self.all = True
+        self.vehicle_ids: Set[int] = set()
+        self.vehicle_types: Set[str] = set()
+        self.bboxes: List[BBox] = []
+        self.cells: Set[Tuple[int, int]] = set()
+        self.wide = False
+
+    def in_bbox(self, lat: float, lng: float) -> bool:
+        for min_lng, min_lat, max_lng, max_lat in self.bboxes:
+            if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                return True
+        return False
+
+    def matches(self, vehicle_id: int, vehicle_type: Optional[str], lat: float, lng: float) -> bool:
+        return (
+            self.all
+            or vehicle_id in self.vehicle_ids
+            or vehicle_type in self.vehicle_types
+            or self.in_bbox(lat, lng)
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "all": self.all,
+            "vehicle_ids": sorted(self.vehicle_ids),
+            "vehicle_types": sorted(self.vehicle_types),
+            "bboxes": [list(b) for b in self.bboxes]
+        }
+
+
+class SubscriptionIndex:
+    """Índice de interesse dos clientes: veículo, tipo e célula da grade -> clientes.
+
+    Um fix só é entregue aos clientes interessados, sem percorrer todos eles.
+    """
+
+    def __init__(self, cell_size_deg: float = 0.1, max_cells_per_bbox: int = 400):
+        self.cell_size_deg = cell_size_deg
+        self.max_cells_per_bbox = max_cells_per_bbox
+        self._subs: Dict[Hashable, Subscription] = {}
+        self._all: Set[Hashable] = set()
+        self._by_vehicle: Dict[int, Set[Hashable]] = defaultdict(set)
+        self._by_type: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._by_cell: Dict[Tuple[int, int], Set[Hashable]] = defaultdict(set)
+        # Clientes com bbox grande demais para expandir em células
+        self._wide: Set[Hashable] = set()
+
+    def __len__(self):
+        return len(self._subs)
+
+    def cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_size_deg), math.floor(lng / self.cell_size_deg))
+
+    def _bbox_cells(self, bbox: BBox) -> Optional[List[Tuple[int, int]]]:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        i0, j0 = self.cell_of(min_lat, min_lng)
+        i1, j1 = self.cell_of(max_lat, max_lng)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > self.max_cells_per_bbox:
+            return None
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def get(self, client: Hashable) -> Optional[Subscription]:
+        return self._subs.get(client)
+
+    def add_client(self, client: Hashable):
+        self._subs[client] = Subscription()
+        self._all.add(client)
+
+    def remove_client(self, client: Hashable):
+        sub = self._subs.pop(client, None)
+        if sub is None:
+            return
+        self._all.discard(client)
+        self._wide.discard(client)
+        self._discard(self._by_vehicle, sub.vehicle_ids, client)
+        self._discard(self._by_type, sub.vehicle_types, client)
+        self._discard(self._by_cell, sub.cells, client)
+
+    @staticmethod
+    def _discard(index: dict, keys: Iterable, client: Hashable):
+        for key in keys:
+            members = index.get(key)
+            if members is not None:
+                members.discard(client)
+                if not members:
+                    del index[key]
+
+    def subscribe(self, client: Hashable, vehicle_ids: Iterable[int] = (),
+                  vehicle_types: Iterable[str] = (), bbox: Optional[BBox] = None,
+                  all: bool = False) -> Subscription:
+        sub = self._subs[client]
+        vehicle_ids = set(vehicle_ids)
+        vehicle_types = set(vehicle_types)
+        if all:
+            sub.all = True
+            self._all.add(client)
+        elif vehicle_ids or vehicle_types or bbox:
+            # O primeiro filtro troca "tudo" por "apenas o que foi pedido"
+            sub.all = False
+            self._all.discard(client)
+
+        for vehicle_id in vehicle_ids - sub.vehicle_ids:
+            self._by_vehicle[vehicle_id].add(client)
+        sub.vehicle_ids |= vehicle_ids
+        for vehicle_type in vehicle_types - sub.vehicle_types:
+            self._by_type[vehicle_type].add(client)
+        sub.vehicle_types |= vehicle_types
+
+        if bbox is not None:
+            sub.bboxes.append(tuple(bbox))
+            cells = self._bbox_cells(bbox)
+            if cells is None:
+                sub.wide = True
+                self._wide.add(client)
+            else:
+                for cell in cells:
+                    self._by_cell[cell].add(client)
+                sub.cells.update(cells)
+        return sub
+
+    def unsubscribe(self, client: Hashable, vehicle_ids: Iterable[int] = (),
+                    vehicle_types: Iterable[str] = (), bbox: Optional[BBox] = None,
+                    all: bool = False) -> Subscription:
+        sub = self._subs[client]
+        if all:
+            # Remove todos os filtros: o cliente deixa de receber posições
+            self.remove_client(client)
+            sub = self._subs[client] = Subscription()
+            sub.all = False
+            return sub
+
+        vehicle_ids = set(vehicle_ids) & sub.vehicle_ids
+        self._discard(self._by_vehicle, vehicle_ids, client)
+        sub.vehicle_ids -= vehicle_ids
+        vehicle_types = set(vehicle_types) & sub.vehicle_types
+        self._discard(self._by_type, vehicle_types, client)
+        sub.vehicle_types -= vehicle_types
+
+        if bbox is not None and tuple(bbox) in sub.bboxes:
+            sub.bboxes.remove(tuple(bbox))
+            # Recalcula as células a partir das bboxes restantes
+            self._discard(self._by_cell, sub.cells, client)
+            self._wide.discard(client)
+            sub.cells = set()
+            sub.wide = False
+            for remaining in sub.bboxes:
+                cells = self._bbox_cells(remaining)
+                if cells is None:
+                    sub.wide = True
+                    self._wide.add(client)
+                else:
+                    for cell in cells:
+                        self._by_cell[cell].add(client)
+                    sub.cells.update(cells)
+        return sub
+
+    def recipients(self, vehicle_id: int, vehicle_type: Optional[str], lat: float, lng: float) -> Set[Hashable]:
+        """Clientes interessados em um fix"""
+        result = set(self._all)
+        members = self._by_vehicle.get(vehicle_id)
+        if members:
+            result |= members
+        members = self._by_type.get(vehicle_type)
+        if members:
+            result |= members
+        members = self._by_cell.get(self.cell_of(lat, lng))
+        if members:
+            for client in members:
+                if client not in result and self._subs[client].in_bbox(lat, lng):
+                    result.add(client)
+        for client in self._wide:
+            if client not in result and self._subs[client].in_bbox(lat, lng):
+                result.add(client)
+        return result
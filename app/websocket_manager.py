@@ -1,9 +1,24 @@
 import asyncio
 import json
-from typing import Dict, Set
+import time
+import uuid
+from typing import Dict, Iterable, Optional, Set
 from fastapi import WebSocket
 from datetime import datetime
+from app.assignments import assignment_index
+from app.broker import create_broker
+from app.catalog import vehicle_catalog
+from app.config import settings
+from app.delta import DeltaStream
+from app.fanout import FanoutHub
+from app.fleet_index import fleet_index
+from app.metrics import WS_FANOUT, registry
+from app.rules import rule_engine
 from app.schemas import WebSocketMessage
+from app.subscriptions import Subscription, SubscriptionIndex
+
+# Chave fixa dos frames de delta: um frame novo substitui o que ainda está na fila
+DELTA_KEY = ("position_delta",)
 
 
 class WebSocketManager:
@@ -12,38 +27,332 @@ class WebSocketManager:
             "vehicles": set(),
             "monitoring": set()
         }
+        # Filtros dos clientes de monitoramento
+        self.subscriptions = SubscriptionIndex()
+        # Clientes em modo delta (um frame coalescido por tick)
+        self.delta_streams: Dict[WebSocket, DeltaStream] = {}
+        # Conexão de cada veículo, para entrega de comandos em O(1)
+        self.vehicle_sockets: Dict[int, WebSocket] = {}
+        self._socket_vehicles: Dict[WebSocket, int] = {}
+        # Snapshot completo da frota compartilhado por conexões simultâneas
+        self._snapshot_cache = None
+        # Fila de envio e tarefa de escrita por conexão
+        self.hub = FanoutHub(
+            max_queue=settings.WS_SEND_QUEUE_SIZE,
+            policy=settings.WS_SLOW_CONSUMER_POLICY,
+            on_disconnect=self.disconnect,
+            send_timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+            max_connections={
+                "monitoring": settings.WS_MAX_MONITORING_CONNECTIONS,
+                "vehicles": settings.WS_MAX_VEHICLE_CONNECTIONS
+            }
+        )
+        # Mensagens passam pelo broker para chegar aos clientes de todos os workers
+        self.broker = create_broker(
+            settings.BROKER_BACKEND,
+            self._on_broker_messages,
+            channels=["positions", "broadcast", "vehicle_commands", "catalog", "assignments"],
+            redis_url=settings.REDIS_URL,
+            prefix=settings.BROKER_CHANNEL_PREFIX,
+            linger_seconds=settings.BROKER_BATCH_LINGER_MS / 1000
+        )
     
-    async def connect(self, websocket: WebSocket, client_type: str):
+        # Identifica este worker nas invalidações do cadastro
+        self.worker_id = uuid.uuid4().hex
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        vehicle_catalog.on_invalidate(self._publish_catalog_invalidation)
+        assignment_index.on_change(self._publish_assignment_change)
+        rule_engine.on_alert(self._publish_alerts)
+    
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.broker.start()
+        # Só o painel responde ao ping em JSON; dispositivos ficam com o ping do protocolo
+        self.hub.start_heartbeat(
+            settings.WS_PING_INTERVAL_SECONDS, settings.WS_IDLE_TIMEOUT_SECONDS, client_types=("monitoring",)
+        )
+    
+    async def stop(self):
+        self.hub.stop_heartbeat()
+        await self.broker.stop()
+    
+    async def connect(self, websocket: WebSocket, client_type: str) -> bool:
+        """Aceita a conexão; retorna False se o limite do tipo de cliente foi atingido"""
         await websocket.accept()
+        if not self.hub.has_capacity(client_type):
+            # 1013 (try again later): o cliente deve reconectar mais tarde
+            await websocket.close(code=1013, reason="Too many connections")
+            return False
         self.active_connections[client_type].add(websocket)
+        if client_type == "monitoring":
+            self.subscriptions.add_client(websocket)
+        self.hub.register(websocket, client_type)
+        return True
+    
+    async def connect_vehicle(self, websocket: WebSocket, vehicle_id: int) -> bool:
+        if not await self.connect(websocket, "vehicles"):
+            return False
+        previous = self.vehicle_sockets.get(vehicle_id)
+        if previous is not None and previous is not websocket:
+            # Reconexão: a conexão antiga deixa de receber comandos
+            self._socket_vehicles.pop(previous, None)
+        self.vehicle_sockets[vehicle_id] = websocket
+        self._socket_vehicles[websocket] = vehicle_id
+        return True
     
     def disconnect(self, websocket: WebSocket, client_type: str):
         self.active_connections[client_type].discard(websocket)
+        if client_type == "monitoring":
+            self.subscriptions.remove_client(websocket)
+            self.set_delta_mode(websocket, None)
+        elif client_type == "vehicles":
+            vehicle_id = self._socket_vehicles.pop(websocket, None)
+            if vehicle_id is not None and self.vehicle_sockets.get(vehicle_id) is websocket:
+                del self.vehicle_sockets[vehicle_id]
+        self.hub.unregister(websocket)
+    
+    def set_delta_mode(self, websocket: WebSocket, tick_ms=None):
+        """Ativa (tick_ms) ou desativa (None) o modo delta de um cliente"""
+        stream = self.delta_streams.pop(websocket, None)
+        if stream is not None:
+            stream.stop()
+        connection = self.hub.connections.get(websocket)
+        if connection is not None:
+            connection.on_drop = None
+        if tick_ms is None:
+            return
+        stream = DeltaStream(
+            lambda frame: self.hub.publish(frame, (websocket,), key=DELTA_KEY, replace=True) > 0,
+            tick_seconds=min(max(tick_ms, 50), 10000) / 1000
+        )
+
+        def on_drop(key):
+            # Frame de delta perdido na fila: o próximo tick reenvia o estado completo
+            if key == DELTA_KEY:
+                stream.resync()
+
+        if connection is not None:
+            connection.on_drop = on_drop
+        self.delta_streams[websocket] = stream
+        stream.start()
+    
+    def _send(self, connections: Iterable[WebSocket], payload: str, key=None):
+        # Apenas enfileira: clientes lentos não atrasam os demais
+        self.hub.publish(payload, connections, key)
     
     async def broadcast(self, message: WebSocketMessage, client_type: str = "monitoring"):
-        disconnected = set()
-        for connection in self.active_connections[client_type]:
-            try:
-                await connection.send_json(message.model_dump())
-            except Exception:
-                disconnected.add(connection)
-        
-        # Limpar conexões desconectadas
-        for connection in disconnected:
-            self.disconnect(connection, client_type)
+        self.broker.publish("broadcast", {
+            "client_type": client_type,
+            "message": message.model_dump(mode="json")
+        })
     
     async def send_to_vehicle(self, vehicle_id: int, message: WebSocketMessage):
-        # Enviar mensagem específica para um veículo
+        # Enviar mensagem específica para um veículo, em qualquer worker
         message.data["target_vehicle"] = vehicle_id
-        await self.broadcast(message, "vehicles")
+        self.broker.publish("vehicle_commands", {
+            "vehicle_id": vehicle_id,
+            "message": message.model_dump(mode="json")
+        })
+    
+    def deliver_to_vehicle(self, vehicle_id: int, payload: str) -> bool:
+        """Entrega local; retorna False se o veículo não está conectado a este worker"""
+        websocket = self.vehicle_sockets.get(vehicle_id)
+        if websocket is None:
+            return False
+        return self.hub.publish(payload, (websocket,)) > 0
+    
+    def _publish_catalog_invalidation(self):
+        # Chamado a partir das threads dos endpoints síncronos
+        if self._loop is not None:
+            self.broker.publish_threadsafe(self._loop, "catalog", {"origin": self.worker_id})
+    
+    def _publish_assignment_change(self, vehicle_id: int, driver: Optional[dict]):
+        # Mantém o índice de motoristas dos outros workers em dia
+        if self._loop is not None:
+            self.broker.publish_threadsafe(
+                self._loop, "assignments", {"origin": self.worker_id, "vehicle_id": vehicle_id, "driver": driver}
+            )
+    
+    def _publish_alerts(self, alerts: list):
+        # Alertas gravados por este worker (ou pelos shards) para os monitores de todos
+        if self._loop is not None:
+            for alert in alerts:
+                self.broker.publish_threadsafe(self._loop, "broadcast", {
+                    "client_type": "monitoring",
+                    "message": WebSocketMessage(type="alert", data=alert).model_dump(mode="json")
+                })
     
     async def send_position_update(self, position_data: dict):
+        self.broker.publish("positions", position_data)
+    
+    def publish_positions_threadsafe(self, messages: list):
+        """Publica posições gravadas fora do event loop (ex.: pelos shards de ingestão)"""
+        def publish():
+            for position_data in messages:
+                self.broker.publish("positions", position_data)
+        
+        # Uma chamada ao loop por lote
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(publish)
+    
+    async def _on_broker_messages(self, channel: str, messages: list):
+        """Fan-out local das mensagens recebidas do broker"""
+        start = time.perf_counter()
+        self._dispatch(channel, messages)
+        WS_FANOUT.observe_since(start)
+    
+    def _dispatch(self, channel: str, messages: list):
+        if channel == "positions":
+            for position_data in messages:
+                # Mantém o índice da frota deste worker em dia com os demais
+                fleet_index.update_from_message(position_data)
+                self._deliver_position(position_data)
+        elif channel == "vehicle_commands":
+            # Comandos sem conexão ficam pendentes no banco até a reconexão
+            for item in messages:
+                self.deliver_to_vehicle(item["vehicle_id"], json.dumps(item["message"]))
+        elif channel == "assignments":
+            for item in messages:
+                if item["origin"] != self.worker_id:
+                    assignment_index.set(item["vehicle_id"], item["driver"], propagate=False)
+        elif channel == "catalog":
+            if any(item["origin"] != self.worker_id for item in messages):
+                vehicle_catalog.invalidate(propagate=False)
+        elif channel == "broadcast":
+            for item in messages:
+                # Serializa uma única vez para todas as conexões
+                self._send(
+                    list(self.active_connections[item["client_type"]]),
+                    json.dumps(item["message"])
+                )
+    
+    def _deliver_position(self, position_data: dict):
+        vehicle_type = getattr(position_data.get("vehicle_type"), "value", position_data.get("vehicle_type"))
+        recipients = self.subscriptions.recipients(
+            position_data["vehicle_id"],
+            vehicle_type,
+            position_data["latitude"],
+            position_data["longitude"]
+        )
+        if not recipients:
+            return
+        # Motorista atual do índice em memória, sem consulta por fix
+        position_data = assignment_index.enrich(position_data)
+        if self.delta_streams:
+            # Clientes em modo delta recebem no próximo tick
+            streaming = [ws for ws in recipients if ws in self.delta_streams]
+            for websocket in streaming:
+                self.delta_streams[websocket].update(position_data)
+            recipients.difference_update(streaming)
+        if not recipients:
+            return
         message = WebSocketMessage(
             type="position_update",
             data=position_data,
             timestamp=datetime.now()
         )
-        await self.broadcast(message, "monitoring")
+        self._send(recipients, message.model_dump_json(), key=("position", position_data["vehicle_id"]))
+    
+    def _reply(self, websocket: WebSocket, message_type: str, data: dict):
+        # Pela mesma fila das atualizações, para manter a ordem
+        self.hub.publish(json.dumps({"type": message_type, "data": data}), (websocket,))
+    
+    def snapshot_payload(self, subscription: Optional[Subscription] = None) -> str:
+        """Frame ``snapshot`` com as últimas posições, filtrado pela assinatura"""
+        if subscription is None or subscription.all:
+            now = time.monotonic()
+            cached = self._snapshot_cache
+            if cached is not None and now - cached[0] < settings.WS_SNAPSHOT_CACHE_SECONDS:
+                return cached[1]
+            entries = fleet_index.entries()
+        elif subscription.vehicle_types or subscription.bboxes:
+            entries = [
+                e for e in fleet_index.entries()
+                if subscription.matches(e.vehicle_id, e.vehicle_type, e.latitude, e.longitude)
+            ]
+        else:
+            entries = [e for e in map(fleet_index.get, subscription.vehicle_ids) if e is not None]
+        
+        payload = json.dumps({
+            "type": "snapshot",
+            "data": {"count": len(entries), "vehicles": [assignment_index.enrich(e.to_dict()) for e in entries]},
+            "timestamp": datetime.now().isoformat()
+        }, default=str)
+        if subscription is None or subscription.all:
+            self._snapshot_cache = (time.monotonic(), payload)
+        return payload
+    
+    def send_snapshot(self, websocket: WebSocket):
+        self.hub.publish(self.snapshot_payload(self.subscriptions.get(websocket)), (websocket,))
+    
+    async def handle_monitoring_message(self, websocket: WebSocket, text: str):
+        """Processa mensagens subscribe/unsubscribe/configure de um cliente de monitoramento.
+        
+        Formato: {"action": "subscribe", "vehicle_ids": [1, 2], "vehicle_types": ["car"],
+        "bbox": [min_lng, min_lat, max_lng, max_lat], "all": false}
+        ou {"action": "configure", "mode": "delta", "tick_ms": 250}
+        """
+        try:
+            message = json.loads(text)
+            if message.get("type") == "pong":
+                return
+            action = message.get("action")
+            if action == "configure":
+                mode = message.get("mode", "full")
+                if mode not in ("full", "delta"):
+                    raise ValueError("invalid mode")
+                tick_ms = int(message.get("tick_ms", 250)) if mode == "delta" else None
+                self.set_delta_mode(websocket, tick_ms)
+                self._reply(websocket, "configured", {"mode": mode, "tick_ms": tick_ms})
+                return
+            if action not in ("subscribe", "unsubscribe"):
+                return
+            bbox = message.get("bbox")
+            if bbox is not None:
+                bbox = tuple(float(v) for v in bbox)
+                if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                    raise ValueError("invalid bbox")
+            kwargs = {
+                "vehicle_ids": [int(v) for v in message.get("vehicle_ids") or []],
+                "vehicle_types": [str(v) for v in message.get("vehicle_types") or []],
+                "bbox": bbox,
+                "all": bool(message.get("all", False))
+            }
+        except (ValueError, TypeError, AttributeError):
+            self._reply(websocket, "error", {"detail": "Invalid monitoring message"})
+            return
+        
+        if action == "subscribe":
+            subscription = self.subscriptions.subscribe(websocket, **kwargs)
+        else:
+            subscription = self.subscriptions.unsubscribe(websocket, **kwargs)
+        self._reply(websocket, "subscription", subscription.to_dict())
+        if action == "subscribe":
+            # Estado atual do que passou a ser acompanhado
+            self.send_snapshot(websocket)
+
+
+websocket_manager = WebSocketManager()
+
+
+def _queue_depth_samples():
+    stats = websocket_manager.hub.stats()
+    return [({"agg": "total"}, stats["queue_depth_total"]), ({"agg": "max"}, stats["queue_depth_max"])]
 
 
-websocket_manager = WebSocketManager()
\ No newline at end of file
+registry.collector(
+    "tracking_ws_connections", "gauge", "Conexões WebSocket abertas por tipo de cliente",
+    lambda: [({"client_type": t}, len(c)) for t, c in websocket_manager.active_connections.items()]
+)
+registry.collector(
+    "tracking_ws_send_queue_depth", "gauge", "Mensagens aguardando envio nas filas dos clientes",
+    _queue_depth_samples
+)
+registry.collector(
+    "tracking_ws_messages_dropped_total", "counter", "Mensagens descartadas por clientes lentos",
+    lambda: [({}, websocket_manager.hub.stats()["dropped"])]
+)
+registry.collector(
+    "tracking_ws_deliveries_total", "counter", "Mensagens enfileiradas para clientes",
+    lambda: [({}, websocket_manager.hub.deliveries)]
+)
@@ -0,0 +1,286 @@
+"""Casos do benchmark. Importado só depois que run.py configurou o ambiente
+(banco SQLite temporário e Redis de teste), pois os módulos do app leem as
+configurações na importação."""
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+
+from app import crud, models, schemas
+from app.database import Base, SessionLocal, engine
+from app.fleet_index import fleet_index
+from app.websocket_manager import WebSocketManager
+
+CENTER = (-23.5505, -46.6333)
+SPREAD_DEG = 0.2
+
+# Cada caso devolve {nome do resultado: resumo}
+CASES: Dict[str, Callable] = {}
+
+
+def case(name: str):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, max(int(len(ordered) * p / 100 + 0.5) - 1, 0))]
+
+
+def summarize(samples: List[float], items_per_call: int = 1, **extra) -> dict:
+    """Tempos por chamada (s) -> latências em ms e vazão em itens/s"""
+    ordered = sorted(samples)
+    mean = sum(ordered) / len(ordered)
+    return {
+        "iterations": len(ordered),
+        "items_per_call": items_per_call,
+        "mean_ms": round(mean * 1000, 4),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 4),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 4),
+        "ops_per_s": round(items_per_call / mean, 1) if mean else None,
+        **extra
+    }
+
+
+def timed(fn: Callable[[], object], iterations: int, warmup: int = 3) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class Fleet:
+    """Veículos do benchmark, inseridos de uma vez"""
+
+    def __init__(self, size: int):
+        db = SessionLocal()
+        try:
+            db.add_all([
+                models.Vehicle(license_plate=f"BENCH{i:07d}", vehicle_type=models.VehicleType.CAR)
+                for i in range(size)
+            ])
+            db.commit()
+            self.vehicles = db.query(models.Vehicle).order_by(models.Vehicle.id).all()
+            db.expunge_all()
+        finally:
+            db.close()
+        self.by_id = {v.id: v for v in self.vehicles}
+
+    def ids(self, n: int) -> List[int]:
+        return [v.id for v in self.vehicles[:n]]
+
+
+def random_fix(vehicle_id: int, timestamp=None) -> schemas.PositionCreate:
+    return schemas.PositionCreate(
+        vehicle_id=vehicle_id,
+        latitude=CENTER[0] + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+        longitude=CENTER[1] + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+        speed=random.uniform(0, 80),
+        heading=random.uniform(0, 360),
+        timestamp=timestamp
+    )
+
+
+def reset(redis_client):
+    """Banco, Redis e índice da frota vazios entre os casos"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    if redis_client is not None:
+        redis_client.flushall()
+    crud.position_cache.l1.clear()
+    for entry in fleet_index.entries():
+        fleet_index.remove(entry.vehicle_id)
+
+
+def load_positions(fleet: Fleet, ids: List[int], chunk: int = 1000):
+    db = SessionLocal()
+    try:
+        for start in range(0, len(ids), chunk):
+            crud.PositionCRUD.create_positions_bulk(
+                db, [random_fix(vid) for vid in ids[start:start + chunk]], fleet.by_id
+            )
+    finally:
+        db.close()
+
+
+@case("ingest_single")
+def ingest_single(cfg) -> dict:
+    fleet = Fleet(100)
+    db = SessionLocal()
+    try:
+        samples = timed(
+            lambda: crud.PositionCRUD.create_position(db, random_fix(random.choice(fleet.vehicles).id)),
+            cfg.iterations * 5
+        )
+    finally:
+        db.close()
+    return {"ingest_single": summarize(samples)}
+
+
+@case("ingest_bulk")
+def ingest_bulk(cfg) -> dict:
+    fleet = Fleet(1000)
+    batch_size = 500
+    db = SessionLocal()
+    try:
+        samples = timed(
+            lambda: crud.PositionCRUD.create_positions_bulk(
+                db, [random_fix(random.choice(fleet.vehicles).id) for _ in range(batch_size)], fleet.by_id
+            ),
+            cfg.iterations
+        )
+    finally:
+        db.close()
+    return {"ingest_bulk": summarize(samples, batch_size, batch_size=batch_size)}
+
+
+@case("latest_lookup")
+def latest_lookup(cfg) -> dict:
+    fleet = Fleet(2000)
+    ids = fleet.ids(2000)
+    load_positions(fleet, ids)
+    db = SessionLocal()
+    try:
+        single = timed(lambda: crud.PositionCRUD.get_cached_position(db, random.choice(ids)), cfg.iterations * 20)
+        many = timed(lambda: crud.PositionCRUD.get_latest_positions_cached(db, ids[:1000]), cfg.iterations)
+        # Sem cache: uma consulta agrupada no banco
+        database = timed(lambda: crud.PositionCRUD.get_latest_positions(db, ids[:1000]), cfg.iterations)
+    finally:
+        db.close()
+    return {
+        "latest_lookup.single_cached": summarize(single),
+        "latest_lookup.batch_1000_cached": summarize(many, 1000),
+        "latest_lookup.batch_1000_db": summarize(database, 1000)
+    }
+
+
+@case("nearby")
+def nearby(cfg) -> dict:
+    largest = max(cfg.fleet_sizes)
+    fleet = Fleet(largest)
+    results = {}
+    loaded = 0
+    for size in sorted(cfg.fleet_sizes):
+        load_positions(fleet, fleet.ids(size)[loaded:])
+        loaded = size
+        samples = timed(
+            lambda: crud.PositionCRUD.get_positions_in_area(
+                CENTER[0] + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+                CENTER[1] + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+                radius_km=2
+            ),
+            cfg.iterations * 5
+        )
+        results[f"nearby.fleet_{size}"] = summarize(samples, fleet_size=size, radius_km=2)
+    return results
+
+
+@case("history_pagination")
+def history_pagination(cfg) -> dict:
+    fleet = Fleet(1)
+    vehicle_id = fleet.vehicles[0].id
+    total = 5000
+    page_size = 100
+    start_time = datetime.now(timezone.utc) - timedelta(days=1)
+    db = SessionLocal()
+    try:
+        db.add_all([
+            models.VehiclePosition(
+                **random_fix(vehicle_id).model_dump(exclude={"timestamp"}),
+                timestamp=start_time + timedelta(seconds=i * 10)
+            )
+            for i in range(total)
+        ])
+        db.commit()
+
+        def walk():
+            # Percorre todo o histórico de trás para frente, com cursor por horário
+            until = None
+            pages = 0
+            while True:
+                page = crud.PositionCRUD.get_vehicle_positions(db, vehicle_id, page_size, until=until)
+                pages += 1
+                if len(page) < page_size:
+                    return pages
+                until = page[-1].timestamp - timedelta(microseconds=1)
+                db.expunge_all()
+
+        samples = timed(walk, cfg.iterations, warmup=1)
+    finally:
+        db.close()
+    pages = total // page_size + 1
+    return {
+        "history_pagination": summarize(
+            [s / pages for s in samples], page_size, page_size=page_size, history_size=total
+        )
+    }
+
+
+class _FakeSocket:
+    """WebSocket que só conta as mensagens recebidas"""
+
+    received_total = 0
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+    async def send_text(self, text: str):
+        _FakeSocket.received_total += 1
+
+
+async def _broadcast(clients: int, rounds: int, batch: int) -> List[float]:
+    manager = WebSocketManager()
+    sockets = [_FakeSocket() for _ in range(clients)]
+    for websocket in sockets:
+        await manager.connect(websocket, "monitoring")
+    now = datetime.now(timezone.utc).isoformat()
+    samples = []
+    try:
+        for _ in range(rounds):
+            messages = [
+                {
+                    "vehicle_id": i, "license_plate": f"BENCH{i:07d}", "vehicle_type": "car", "status": "active",
+                    "latitude": CENTER[0] + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+                    "longitude": CENTER[1] + random.uniform(-SPREAD_DEG, SPREAD_DEG),
+                    "speed": 40.0, "heading": 90.0, "timestamp": now
+                }
+                for i in range(batch)
+            ]
+            target = _FakeSocket.received_total + clients * batch
+            start = time.perf_counter()
+            await manager._on_broker_messages("positions", messages)
+            # Até a última conexão receber a última mensagem
+            deadline = start + 30
+            while _FakeSocket.received_total < target:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError("Messages dropped during broadcast; raise WS_SEND_QUEUE_SIZE")
+                await asyncio.sleep(0)
+            samples.append(time.perf_counter() - start)
+    finally:
+        for websocket in sockets:
+            manager.disconnect(websocket, "monitoring")
+        await asyncio.sleep(0)
+    return samples
+
+
+@case("ws_broadcast")
+def ws_broadcast(cfg) -> dict:
+    batch = 50
+    results = {}
+    for clients in cfg.client_counts:
+        samples = asyncio.run(_broadcast(clients, cfg.iterations, batch))
+        results[f"ws_broadcast.clients_{clients}"] = summarize(
+            samples, clients * batch, clients=clients, messages_per_round=batch
+        )
+    return results
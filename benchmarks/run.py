@@ -0,0 +1,175 @@
+"""Benchmarks de ingestão, consulta e fan-out, sem serviços externos.
+
+Roda contra um SQLite temporário e um Redis em processo (fakeredis) ou sem
+Redis, usando os mesmos caminhos do app (PositionCRUD, cache, índice da frota,
+WebSocketManager). O resultado é JSON; com --compare, cada caso é comparado
+com um baseline salvo e regressões acima do limite fazem o processo sair com 1.
+
+    python -m benchmarks.run --quick --output bench.json
+    python -m benchmarks.run --compare bench.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+FULL = {"iterations": 50, "fleet_sizes": [1000, 10000, 50000], "client_counts": [10, 100, 1000]}
+QUICK = {"iterations": 10, "fleet_sizes": [1000, 5000], "client_counts": [10, 100]}
+
+
+def configure_environment(redis_backend: str, workdir: str) -> str:
+    """Precisa rodar antes de importar o app: as configurações são lidas na importação"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop("POSTGRES_URL", None)
+    os.environ["BROKER_BACKEND"] = "memory"
+    os.environ["PROFILING_ENABLED"] = "false"
+    os.environ["WS_MAX_MONITORING_CONNECTIONS"] = "1000000"
+
+    if redis_backend == "auto":
+        try:
+            import fakeredis  # noqa: F401
+            redis_backend = "fakeredis"
+        except ImportError:
+            redis_backend = "none"
+
+    if redis_backend == "fakeredis":
+        import fakeredis
+        import redis
+        server = fakeredis.FakeRedis(decode_responses=True)
+        redis.Redis.from_url = classmethod(lambda cls, *args, **kwargs: server)
+    else:
+        # Porta sem servidor: o app segue sem Redis (cache só em memória, buscas pelo índice da frota)
+        os.environ["REDIS_URL"] = "redis://127.0.0.1:1"
+    return redis_backend
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, metric: str, threshold: float) -> dict:
+    """Razão atual/baseline da métrica (menor é melhor) para os casos presentes nos dois"""
+    report = {"metric": metric, "threshold": threshold, "regressions": [], "improvements": [], "cases": {}}
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous.get(metric) or current.get(metric) is None:
+            continue
+        ratio = current[metric] / previous[metric]
+        report["cases"][name] = {"baseline": previous[metric], "current": current[metric], "ratio": round(ratio, 3)}
+        if ratio > 1 + threshold:
+            report["regressions"].append(name)
+        elif ratio < 1 - threshold:
+            report["improvements"].append(name)
+    return report
+
+
+def print_table(results: dict, comparison=None, out=sys.stderr):
+    print(f"{'caso':40} {'p50 ms':>10} {'p95 ms':>10} {'itens/s':>12}  vs baseline", file=out)
+    for name, r in results.items():
+        delta = ""
+        if comparison and name in comparison["cases"]:
+            ratio = comparison["cases"][name]["ratio"]
+            flag = " REGRESSÃO" if name in comparison["regressions"] else ""
+            delta = f"{(ratio - 1) * 100:+.1f}%{flag}"
+        print(f"{name:40} {r['p50_ms']:>10.3f} {r['p95_ms']:>10.3f} {r['ops_per_s']:>12.1f}  {delta}", file=out)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks da plataforma de rastreamento")
+    parser.add_argument("--quick", action="store_true", help="Menos iterações e frotas menores")
+    parser.add_argument("--only", nargs="+", metavar="CASE", help="Roda só estes casos")
+    parser.add_argument("--redis", choices=("auto", "fakeredis", "none"), default="auto",
+                        help="fakeredis: Redis em processo; none: app sem Redis")
+    parser.add_argument("--iterations", type=int, help="Sobrescreve o número de iterações")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Arquivo para o resultado JSON (padrão: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON de uma execução anterior")
+    parser.add_argument("--metric", default="p50_ms", choices=("mean_ms", "p50_ms", "p95_ms", "p99_ms"))
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Piora relativa que conta como regressão (0.15 = 15%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    config = dict(QUICK if args.quick else FULL)
+    if args.iterations:
+        config["iterations"] = args.iterations
+    cfg = argparse.Namespace(**config)
+
+    with tempfile.TemporaryDirectory(prefix="tracking-bench-") as workdir:
+        redis_backend = configure_environment(args.redis, workdir)
+        import random
+        from benchmarks import cases
+        from app.crud import redis_client
+
+        unknown = set(args.only or []) - set(cases.CASES)
+        if unknown:
+            print(f"Casos desconhecidos: {', '.join(sorted(unknown))}; disponíveis: {', '.join(cases.CASES)}",
+                  file=sys.stderr)
+            return 2
+
+        results = {}
+        started = time.perf_counter()
+        for name, fn in cases.CASES.items():
+            if args.only and name not in args.only:
+                continue
+            print(f"[{name}]", file=sys.stderr)
+            random.seed(args.seed)
+            cases.reset(redis_client)
+            results.update(fn(cfg))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "redis": redis_backend,
+            "database": "sqlite",
+            "quick": args.quick,
+            "config": config,
+            "duration_s": round(time.perf_counter() - started, 2)
+        },
+        "results": results
+    }
+
+    comparison = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline, args.metric, args.threshold)
+        comparison["baseline_meta"] = baseline.get("meta")
+        previous = baseline.get("meta") or {}
+        for key in ("redis", "quick", "python"):
+            if previous.get(key) != report["meta"][key]:
+                print(f"Aviso: baseline com {key}={previous.get(key)!r}, atual {report['meta'][key]!r}",
+                      file=sys.stderr)
+        report["comparison"] = comparison
+
+    print_table(results, comparison)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if comparison and comparison["regressions"]:
+        print(f"Regressões: {', '.join(comparison['regressions'])}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -41,6 +41,11 @@ class VehicleTracker {
         
         this.ws.onmessage = (event) => {
             const data = JSON.parse(event.data);
+            if (data.type === 'ping') {
+                // Heartbeat do servidor: sem resposta a conexão é encerrada
+                this.ws.send(JSON.stringify({ type: 'pong' }));
+                return;
+            }
             this.handleWebSocketMessage(data);
         };
         
@@ -63,6 +68,11 @@ class VehicleTracker {
             case 'new_vehicle':
                 this.addVehicleMarker(message.data);
                 break;
+            case 'snapshot':
+                // Estado inicial da frota enviado pelo servidor ao conectar
+                message.data.vehicles.forEach(vehicle => this.addVehicleMarker(vehicle));
+                this.updateCacheCount();
+                break;
         }
         
         // Adicionar à lista de atualizações
@@ -74,11 +84,9 @@ class VehicleTracker {
             const response = await fetch('/api/vehicles');
             const vehicles = await response.json();
             
+            // As posições chegam no snapshot do WebSocket
             vehicles.forEach(vehicle => {
                 this.vehicles.set(vehicle.id, vehicle);
-                
-                // Buscar última posição
-                this.loadVehiclePosition(vehicle.id);
             });
             
             document.getElementById('active-vehicles').textContent = vehicles.length;
@@ -87,29 +95,8 @@ class VehicleTracker {
         }
     }
     
-    async loadVehiclePosition(vehicleId) {
-        try {
-            const response = await fetch(`/api/vehicles/${vehicleId}/position/latest`);
-            const position = await response.json();
-            
-            if (position.latitude && position.longitude) {
-                this.addVehicleMarker({
-                    vehicle_id: vehicleId,
-                    license_plate: position.license_plate,
-                    vehicle_type: position.vehicle_type,
-                    latitude: position.latitude,
-                    longitude: position.longitude,
-                    speed: position.speed,
-                    heading: position.heading
-                });
-            }
-        } catch (error) {
-            console.error(`Erro ao carregar posição do veículo ${vehicleId}:`, error);
-        }
-    }
-    
     addVehicleMarker(data) {
-        const { vehicle_id, license_plate, vehicle_type, latitude, longitude, speed, heading } = data;
+        const { vehicle_id, license_plate, vehicle_type, latitude, longitude, speed, heading, driver } = data;
         
         // Remover marcador existente
         if (this.markers.has(vehicle_id)) {
@@ -120,7 +107,7 @@ class VehicleTracker {
         const el = document.createElement('div');
         el.className = `vehicle-marker ${vehicle_type}`;
         el.innerHTML = vehicle_type === 'car' ? '🚗' : '🏍️';
-        el.title = `${license_plate} - ${vehicle_type}`;
+        el.title = `${license_plate} - ${vehicle_type}${driver ? ` - ${driver.name}` : ''}`;
         
         // Criar marcador
         const marker = new mapboxgl.Marker(el)
@@ -132,6 +119,7 @@ class VehicleTracker {
             .setHTML(`
                 <strong>${license_plate}</strong><br>
                 Tipo: ${vehicle_type === 'car' ? 'Carro' : 'Moto'}<br>
+                ${driver ? `Motorista: ${driver.name}${driver.phone ? ` (${driver.phone})` : ''}<br>` : ''}
                 ${speed ? `Velocidade: ${speed.toFixed(1)} km/h<br>` : ''}
                 ${heading ? `Direção: ${heading.toFixed(0)}°` : ''}
             `);
@@ -176,6 +164,16 @@ class VehicleTracker {
             case 'vehicle_status':
                 text = `${time}: ${message.data.vehicle_id} status: ${message.data.status}`;
                 break;
+            case 'snapshot':
+                text = `${time}: ${message.data.count} veículos carregados`;
+                break;
+            case 'alert': {
+                const rules = { speeding: 'excesso de velocidade', idle: 'parado', offline: 'sem sinal' };
+                const vehicle = this.vehicles.get(message.data.vehicle_id);
+                const name = vehicle ? vehicle.license_plate : message.data.vehicle_id;
+                text = `${time}: ${name} ${message.data.is_active ? '⚠️' : '✅'} ${rules[message.data.rule] || message.data.rule}`;
+                break;
+            }
             default:
                 text = `${time}: Nova mensagem recebida`;
         }
@@ -1,112 +1,289 @@
+"""Gerador de carga da plataforma de rastreamento.
+
+Cria N veículos sintéticos, move-os por passeio aleatório ou por rotas e envia
+as posições por REST, lote ou WebSocket a uma taxa agregada fixa. Clientes de
+monitoramento medem a latência fix -> dashboard. O relatório final é JSON.
+
+Exemplos:
+    python simulate_vehicles.py                                  # demo leve
+    python simulate_vehicles.py --vehicles 2000 --rate 1000 --mode batch --monitors 20 --duration 60
+    python simulate_vehicles.py --vehicles 500 --rate 500 --mode ws --path route --output report.json
+"""
+import argparse
 import asyncio
+import json
+import math
 import random
+import sys
 import time
+import uuid
+from datetime import datetime, timezone
+
 import httpx
-from datetime import datetime
-
-BASE_URL = "http://localhost:8000/api"
-VEHICLES = []
-
-
-async def create_vehicles():
-    """Cria veículos de exemplo"""
-    vehicles_data = [
-        {
-            "license_plate": "ABC1D23",
-            "vehicle_type": "car",
-            "brand": "Toyota",
-            "model": "Corolla",
-            "color": "Prata"
-        },
-        {
-            "license_plate": "MOT0R01",
-            "vehicle_type": "motorcycle",
-            "brand": "Honda",
-            "model": "CB 500",
-            "color": "Vermelha"
-        },
-        {
-            "license_plate": "XYZ9A87",
-            "vehicle_type": "car",
-            "brand": "Volkswagen",
-            "model": "Golf",
-            "color": "Azul"
-        },
-        {
-            "license_plate": "MOT0R02",
-            "vehicle_type": "motorcycle",
-            "brand": "Yamaha",
-            "model": "MT-07",
-            "color": "Preta"
-        },
-        {
-            "license_plate": "DEF4G56",
-            "vehicle_type": "car",
-            "brand": "Ford",
-            "model": "Focus",
-            "color": "Branca"
+import websockets
+
+CENTER = (-23.5505, -46.6333)  # São Paulo
+KM_PER_DEG = 111.32
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not values:
+        return {**{f"p{p}": None for p in points}, "max": None, "count": 0}
+    ordered = sorted(values)
+    result = {
+        f"p{p}": round(ordered[min(len(ordered) - 1, int(math.ceil(p / 100 * len(ordered))) - 1)], 3)
+        for p in points
+    }
+    result["max"] = round(ordered[-1], 3)
+    result["count"] = len(ordered)
+    return result
+
+
+class SimVehicle:
+    """Estado de movimento de um veículo sintético"""
+
+    __slots__ = ("id", "lat", "lng", "heading", "speed", "route", "waypoint", "last_move")
+
+    def __init__(self, vehicle_id: int, path: str, spread_km: float):
+        self.id = vehicle_id
+        spread = spread_km / KM_PER_DEG
+        self.lat = CENTER[0] + random.uniform(-spread, spread)
+        self.lng = CENTER[1] + random.uniform(-spread, spread)
+        self.heading = random.uniform(0, 360)
+        self.speed = random.uniform(10, 60)
+        self.route = None
+        self.waypoint = 0
+        if path == "route":
+            # Circuito fechado de 4 a 8 pontos em torno da posição inicial
+            self.route = [
+                (self.lat + random.uniform(-0.02, 0.02), self.lng + random.uniform(-0.02, 0.02))
+                for _ in range(random.randint(4, 8))
+            ]
+        self.last_move = time.monotonic()
+
+    def step(self) -> dict:
+        now = time.monotonic()
+        dt = now - self.last_move
+        self.last_move = now
+        self.speed = min(100.0, max(0.0, self.speed + random.uniform(-5, 5)))
+        if self.route is not None:
+            target_lat, target_lng = self.route[self.waypoint]
+            d_lat, d_lng = target_lat - self.lat, target_lng - self.lng
+            if math.hypot(d_lat, d_lng) < 0.0005:
+                self.waypoint = (self.waypoint + 1) % len(self.route)
+            self.heading = math.degrees(math.atan2(d_lng * math.cos(math.radians(self.lat)), d_lat)) % 360
+        else:
+            self.heading = (self.heading + random.uniform(-20, 20)) % 360
+        distance_deg = self.speed * dt / 3600 / KM_PER_DEG
+        self.lat += distance_deg * math.cos(math.radians(self.heading))
+        self.lng += distance_deg * math.sin(math.radians(self.heading)) / math.cos(math.radians(self.lat))
+        return {
+            "vehicle_id": self.id,
+            "latitude": round(self.lat, 6),
+            "longitude": round(self.lng, 6),
+            "speed": round(self.speed, 1),
+            "heading": round(self.heading, 1),
+            "accuracy": round(random.uniform(1, 10), 1),
+            # Horário de envio: o monitor calcula a latência fim a fim a partir dele
+            "timestamp": datetime.now(timezone.utc).isoformat()
         }
-    ]
-    
-    async with httpx.AsyncClient() as client:
-        for vehicle in vehicles_data:
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.api = args.base_url.rstrip("/") + "/api"
+        self.ws_base = args.base_url.rstrip("/").replace("http", "ws", 1)
+        self.vehicles = []
+        self.sent = 0
+        self.accepted = 0
+        self.errors = 0
+        self.request_latency_ms = []
+        self.e2e_latency_ms = []
+        self.monitor_messages = 0
+        self.monitors_connected = 0
+        self.stop = asyncio.Event()
+
+    async def create_vehicles(self, client: httpx.AsyncClient):
+        """Cria os veículos em paralelo, com prefixo de placa único por execução"""
+        prefix = self.args.plate_prefix or f"LT{uuid.uuid4().hex[:6].upper()}"
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def create(i: int):
+            payload = {
+                "license_plate": f"{prefix}{i:06d}",
+                "vehicle_type": "motorcycle" if i % 3 == 0 else "car",
+                "brand": "Sim",
+                "model": "Load"
+            }
+            async with semaphore:
+                response = await client.post(f"{self.api}/vehicles/", json=payload)
+            if response.status_code == 200:
+                return response.json()["id"]
+            if response.status_code == 400:
+                # Placa já existe (prefixo reutilizado): procura o veículo
+                found = await client.get(f"{self.api}/vehicles/", params={"plate_prefix": payload["license_plate"]})
+                if found.status_code == 200 and found.json():
+                    return found.json()[0]["id"]
+            raise RuntimeError(f"Falha ao criar veículo: HTTP {response.status_code}")
+
+        ids = await asyncio.gather(*(create(i) for i in range(self.args.vehicles)))
+        self.vehicles = [SimVehicle(vehicle_id, self.args.path, self.args.spread_km) for vehicle_id in ids]
+
+    async def monitor(self):
+        """Cliente de monitoramento: mede a latência de cada position_update recebido"""
+        try:
+            async with websockets.connect(f"{self.ws_base}/ws/monitoring", max_size=None) as ws:
+                self.monitors_connected += 1
+                while not self.stop.is_set():
+                    try:
+                        raw = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    received = datetime.now(timezone.utc)
+                    message = json.loads(raw)
+                    if message.get("type") == "ping":
+                        await ws.send(json.dumps({"type": "pong"}))
+                        continue
+                    if message.get("type") != "position_update":
+                        continue
+                    self.monitor_messages += 1
+                    sent_at = datetime.fromisoformat(message["data"]["timestamp"])
+                    if sent_at.tzinfo is None:
+                        sent_at = sent_at.replace(tzinfo=timezone.utc)
+                    self.e2e_latency_ms.append((received - sent_at).total_seconds() * 1000)
+        except (OSError, websockets.WebSocketException) as e:
+            print(f"Monitor desconectado: {e}", file=sys.stderr)
+
+    async def _post(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str, payload, count: int):
+        async with semaphore:
+            start = time.perf_counter()
             try:
-                response = await client.post(f"{BASE_URL}/vehicles/", json=vehicle)
-                if response.status_code == 200:
-                    created = response.json()
-                    VEHICLES.append(created)
-                    print(f"Veículo criado: {created['license_plate']}")
-            except Exception as e:
-                print(f"Erro ao criar veículo: {e}")
-
-
-async def simulate_position(vehicle):
-    """Simula movimento do veículo"""
-    # Posição inicial (São Paulo)
-    lat = -23.5505 + random.uniform(-0.05, 0.05)
-    lng = -46.6333 + random.uniform(-0.05, 0.05)
-    
-    while True:
-        # Mover aleatoriamente
-        lat += random.uniform(-0.001, 0.001)
-        lng += random.uniform(-0.001, 0.001)
-        
-        # Manter dentro de limites
-        lat = max(-23.6, min(-23.5, lat))
-        lng = max(-46.7, min(-46.6, lng))
-        
-        position = {
-            "vehicle_id": vehicle["id"],
-            "latitude": lat,
-            "longitude": lng,
-            "speed": random.uniform(0, 80),
-            "heading": random.uniform(0, 360),
-            "accuracy": random.uniform(1, 10)
+                response = await client.post(url, json=payload)
+                ok = response.status_code in (200, 202)
+            except httpx.HTTPError:
+                ok = False
+            self.request_latency_ms.append((time.perf_counter() - start) * 1000)
+        if ok:
+            self.accepted += count
+        else:
+            self.errors += count
+
+    async def drive(self, client: httpx.AsyncClient):
+        """Gera fixes na taxa agregada pedida, distribuídos entre os veículos"""
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        sockets = {}
+        if self.args.mode == "ws":
+            for vehicle in self.vehicles:
+                sockets[vehicle.id] = await websockets.connect(f"{self.ws_base}/ws/vehicle/{vehicle.id}")
+
+        pending = set()
+        batch = []
+        last_flush = time.monotonic()
+        start = time.monotonic()
+        deadline = start + self.args.duration
+        index = 0
+        try:
+            while time.monotonic() < deadline:
+                due = int((time.monotonic() - start) * self.args.rate) - self.sent
+                for _ in range(max(due, 0)):
+                    vehicle = self.vehicles[index % len(self.vehicles)]
+                    index += 1
+                    fix = vehicle.step()
+                    self.sent += 1
+                    if self.args.mode == "rest":
+                        task = asyncio.create_task(self._post(client, semaphore, f"{self.api}/positions/", fix, 1))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                    elif self.args.mode in ("batch", "ingest"):
+                        batch.append(fix)
+                    else:
+                        try:
+                            await sockets[vehicle.id].send(json.dumps({"type": "position", **fix}))
+                            self.accepted += 1
+                        except websockets.WebSocketException:
+                            self.errors += 1
+                if batch and (len(batch) >= self.args.batch_size or time.monotonic() - last_flush >= 0.1):
+                    task = asyncio.create_task(self._post(
+                        client, semaphore, f"{self.api}/positions/{self.args.mode}", {"positions": batch}, len(batch)
+                    ))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    batch = []
+                    last_flush = time.monotonic()
+                await asyncio.sleep(0.005)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            for ws in sockets.values():
+                await ws.close()
+        return time.monotonic() - start
+
+    async def run(self) -> dict:
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            print(f"Criando {self.args.vehicles} veículos...", file=sys.stderr)
+            await self.create_vehicles(client)
+            monitors = [asyncio.create_task(self.monitor()) for _ in range(self.args.monitors)]
+            await asyncio.sleep(0.5 if monitors else 0)
+            print(f"Enviando {self.args.rate} fixes/s por {self.args.duration}s via {self.args.mode}...", file=sys.stderr)
+            elapsed = await self.drive(client)
+            # Espera as últimas mensagens chegarem aos monitores
+            await asyncio.sleep(self.args.drain)
+            self.stop.set()
+            await asyncio.gather(*monitors)
+
+        return {
+            "config": {
+                "base_url": self.args.base_url,
+                "mode": self.args.mode,
+                "path": self.args.path,
+                "vehicles": self.args.vehicles,
+                "target_rate": self.args.rate,
+                "duration_s": self.args.duration,
+                "batch_size": self.args.batch_size if self.args.mode in ("batch", "ingest") else None,
+                "monitors": self.args.monitors
+            },
+            "elapsed_s": round(elapsed, 3),
+            "fixes_sent": self.sent,
+            "fixes_accepted": self.accepted,
+            "errors": self.errors,
+            "throughput_fixes_per_s": round(self.accepted / elapsed, 1) if elapsed else None,
+            "request_latency_ms": percentiles(self.request_latency_ms),
+            "e2e_latency_ms": percentiles(self.e2e_latency_ms),
+            "monitors_connected": self.monitors_connected,
+            "monitor_messages": self.monitor_messages
         }
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(f"{BASE_URL}/positions/", json=position)
-                if response.status_code == 200:
-                    print(f"Posição atualizada: {vehicle['license_plate']} "
-                          f"({lat:.4f}, {lng:.4f})")
-            except Exception as e:
-                print(f"Erro ao atualizar posição: {e}")
-        
-        await asyncio.sleep(random.uniform(5, 15))  # Intervalo entre 5-15 segundos
-
-
-async def main():
-    print("Criando veículos...")
-    await create_vehicles()
-    
-    print(f"{len(VEHICLES)} veículos criados")
-    print("Iniciando simulação de movimento...")
-    
-    # Iniciar simulação para cada veículo
-    tasks = [simulate_position(vehicle) for vehicle in VEHICLES]
-    await asyncio.gather(*tasks)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Gerador de carga da plataforma de rastreamento")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--vehicles", type=int, default=5, help="Veículos sintéticos")
+    parser.add_argument("--rate", type=float, default=1.0, help="Fixes por segundo (agregado)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Duração em segundos")
+    parser.add_argument("--mode", choices=("rest", "batch", "ingest", "ws"), default="rest")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--path", choices=("random", "route"), default="random",
+                        help="Passeio aleatório ou circuito fixo por veículo")
+    parser.add_argument("--spread-km", type=float, default=5.0, help="Raio da área inicial")
+    parser.add_argument("--monitors", type=int, default=1, help="Clientes de monitoramento medindo latência")
+    parser.add_argument("--concurrency", type=int, default=100, help="Requisições HTTP simultâneas")
+    parser.add_argument("--plate-prefix", default=None, help="Reutiliza veículos com este prefixo de placa")
+    parser.add_argument("--drain", type=float, default=1.0, help="Espera final pelas mensagens (s)")
+    parser.add_argument("--output", default=None, help="Arquivo para o relatório JSON (padrão: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(LoadTest(args).run())
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
@@ -0,0 +1,60 @@
+import pytest
+
+from app import admission
+from app.admission import VehicleRateLimiter
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    limiter = VehicleRateLimiter(rate=2, burst=5)
+    assert limiter.admit({1: 4}) == {1: 4}
+    assert limiter.admit({1: 4}) == {1: 1}
+    assert limiter.admit({1: 1}) == {1: 0}
+    clock.now += 1
+    assert limiter.admit({1: 10}) == {1: 2}
+    # Nunca acumula mais que o burst
+    clock.now += 60
+    assert limiter.admit({1: 10}) == {1: 5}
+
+
+def test_buckets_are_per_vehicle(clock):
+    limiter = VehicleRateLimiter(rate=1, burst=2)
+    assert limiter.admit({1: 3, 2: 1}) == {1: 2, 2: 1}
+    assert limiter.admit({1: 1, 2: 1}) == {1: 0, 2: 1}
+
+
+def test_disabled_limiter_admits_everything(clock):
+    limiter = VehicleRateLimiter(rate=0, burst=1)
+    assert limiter.admit({1: 1000}) == {1: 1000}
+    items = list(range(10))
+    assert limiter.admit_items(items, lambda item: 1) == (items, 0)
+
+
+def test_admit_items_keeps_spaced_fixes_including_the_last(clock):
+    limiter = VehicleRateLimiter(rate=1, burst=3)
+    items = [(1, t) for t in range(9)] + [(2, 0)]
+    kept, shed = limiter.admit_items(items, lambda item: item[0])
+    assert shed == 6
+    assert kept == [(1, 2), (1, 5), (1, 8), (2, 0)]
+
+
+def test_idle_buckets_are_pruned(clock):
+    limiter = VehicleRateLimiter(rate=1, burst=2, max_vehicles=3)
+    limiter.admit({vehicle_id: 1 for vehicle_id in range(5)})
+    clock.now += 10
+    limiter.admit({99: 1})
+    assert limiter.stats()["tracked_vehicles"] == 1
@@ -0,0 +1,109 @@
+import json
+import random
+
+import pytest
+
+from app.delta import DeltaStream
+from app.fanout import ClientConnection, SlowConsumerPolicy
+from app.websocket_manager import DELTA_KEY
+
+
+class _Client:
+    """Fila de um cliente sem tarefa de escrita: ``drain`` faz o papel do envio"""
+
+    def __init__(self, max_queue=3, policy=SlowConsumerPolicy.DROP_OLDEST):
+        self.connection = ClientConnection(object(), "monitoring", max_queue, policy, lambda c: None)
+        self.stream = DeltaStream(lambda frame: self.connection.enqueue(frame, DELTA_KEY, replace=True))
+        self.connection.on_drop = lambda key: self.stream.resync() if key == DELTA_KEY else None
+        self.frames = []
+        # Estado do mapa do cliente, montado só com os frames recebidos
+        self.state = {}
+
+    def drain(self):
+        while self.connection._keys:
+            key = self.connection._keys.popleft()
+            message = json.loads(self.connection._payloads.pop(key))
+            if message["type"] != "position_delta":
+                continue
+            self.frames.append(message)
+            for vehicle in message["data"]["vehicles"]:
+                self.state.setdefault(vehicle["vehicle_id"], {}).update(vehicle)
+
+
+def _fix(vehicle_id, lat, speed):
+    return {"vehicle_id": vehicle_id, "latitude": lat, "longitude": -46.6, "speed": speed}
+
+
+def test_dropped_frame_is_followed_by_full_state():
+    client = _Client(max_queue=2)
+    client.stream.update(_fix(1, -23.5, 10.0))
+    client.stream.tick()
+    # Pings enchem a fila e derrubam o frame de delta
+    client.connection.enqueue('{"type": "ping"}')
+    client.connection.enqueue('{"type": "ping"}')
+    assert client.stream.resyncs == 1
+    client.stream.update(_fix(1, -23.5, 20.0))
+    client.stream.tick()
+    client.drain()
+    assert client.state == {1: _fix(1, -23.5, 20.0)}
+
+
+def test_replaced_frame_is_followed_by_full_state():
+    client = _Client()
+    client.stream.update(_fix(1, -23.5, 10.0))
+    client.stream.update(_fix(2, -23.6, 5.0))
+    client.stream.tick()
+    client.drain()
+    client.stream.update(_fix(1, -23.4, 10.0))
+    client.stream.tick()
+    # Substitui o frame com a latitude nova, ainda na fila
+    client.stream.update(_fix(1, -23.4, 30.0))
+    client.stream.tick()
+    assert client.connection.queue_depth == 1
+    assert client.stream.resyncs == 1
+    # O frame completo substitui o parcial sem novo resync
+    client.stream.tick()
+    assert client.stream.resyncs == 1
+    client.drain()
+    assert client.state == {1: _fix(1, -23.4, 30.0), 2: _fix(2, -23.6, 5.0)}
+    assert len(client.frames[-1]["data"]["vehicles"]) == 2
+    # Depois do estado completo, volta a mandar só o que mudou
+    client.stream.update(_fix(2, -23.6, 7.0))
+    client.stream.tick()
+    client.drain()
+    assert client.frames[-1]["data"]["vehicles"] == [{"speed": 7.0, "vehicle_id": 2}]
+
+
+def test_rejected_emit_resends_full_state():
+    accepted = []
+    stream = DeltaStream(lambda frame: bool(accepted.append(frame)) and False)
+    stream.update(_fix(1, -23.5, 10.0))
+    assert stream.tick() is False
+    assert stream.resyncs == 1
+    stream.update(_fix(1, -23.5, 20.0))
+    stream.tick()
+    assert json.loads(accepted[-1])["data"]["vehicles"] == [_fix(1, -23.5, 20.0)]
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("policy", [SlowConsumerPolicy.DROP_OLDEST, SlowConsumerPolicy.COALESCE])
+def test_client_state_matches_under_drops(seed, policy):
+    rng = random.Random(seed)
+    client = _Client(max_queue=2, policy=policy)
+    latest = {}
+    for _ in range(300):
+        action = rng.random()
+        if action < 0.5:
+            fix = _fix(rng.randint(1, 5), round(rng.uniform(-24, -23), 4), float(rng.randint(0, 3) * 10))
+            latest[fix["vehicle_id"]] = fix
+            client.stream.update(fix)
+        elif action < 0.7:
+            client.stream.tick()
+        elif action < 0.85:
+            client.connection.enqueue('{"type": "ping"}')
+        else:
+            client.drain()
+    client.stream.tick()
+    client.drain()
+    assert client.connection.dropped or client.connection.coalesced
+    assert client.state == latest
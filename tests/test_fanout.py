@@ -0,0 +1,107 @@
+import asyncio
+
+from app.fanout import ClientConnection, FanoutHub, SlowConsumerPolicy
+
+
+class _FakeWebSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, payload):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(payload)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def _connection(policy, max_queue=3):
+    closed = []
+    connection = ClientConnection(_FakeWebSocket(), "monitoring", max_queue, policy, closed.append)
+    return connection, closed
+
+
+def _queued(connection):
+    return [connection._payloads[key] for key in connection._keys]
+
+
+def test_drop_oldest_keeps_the_newest_messages():
+    connection, _ = _connection(SlowConsumerPolicy.DROP_OLDEST)
+    results = [connection.enqueue(f"m{i}") for i in range(5)]
+    assert results == [True] * 5
+    assert connection.queue_depth == 3
+    assert connection.dropped == 2
+    assert _queued(connection) == ["m2", "m3", "m4"]
+
+
+def test_drop_oldest_does_not_coalesce_repeated_keys():
+    connection, _ = _connection(SlowConsumerPolicy.DROP_OLDEST)
+    connection.enqueue("a1", key="a")
+    connection.enqueue("a2", key="a")
+    assert _queued(connection) == ["a1", "a2"]
+    assert connection.coalesced == 0
+
+
+def test_coalesce_keeps_one_message_per_key_in_place():
+    connection, _ = _connection(SlowConsumerPolicy.COALESCE)
+    connection.enqueue("a1", key="a")
+    connection.enqueue("b1", key="b")
+    connection.enqueue("a2", key="a")
+    assert _queued(connection) == ["a2", "b1"]
+    assert connection.coalesced == 1
+    # Chaves novas com a fila cheia descartam a mais antiga
+    connection.enqueue("c1", key="c")
+    connection.enqueue("d1", key="d")
+    assert _queued(connection) == ["b1", "c1", "d1"]
+    assert connection.queue_depth == 3
+    assert connection.dropped == 1
+
+
+def test_disconnect_closes_the_slow_client():
+    async def scenario():
+        hub = FanoutHub(max_queue=2, policy=SlowConsumerPolicy.DISCONNECT, send_timeout=1.0)
+        websocket = _FakeWebSocket(delay=10)
+        hub.register(websocket, "monitoring")
+        results = [hub.publish(f"m{i}", (websocket,)) for i in range(4)]
+        await asyncio.sleep(0)
+        return hub, websocket, results
+
+    hub, websocket, results = asyncio.run(scenario())
+    # Sem ceder o loop, a escrita não começou: a terceira excede a fila
+    assert results == [1, 1, 0, 0]
+    assert websocket not in hub.connections
+    assert websocket.closed_with == 1013
+    stats = hub.stats()
+    assert stats["slow_disconnects"] == 1
+    assert stats["dropped"] == 1
+    assert stats["closed"] == {"slow_consumer": 1}
+
+
+def test_writer_delivers_in_order_and_hub_counts_drops():
+    async def scenario():
+        hub = FanoutHub(max_queue=2, policy=SlowConsumerPolicy.DROP_OLDEST)
+        slow, fast = _FakeWebSocket(delay=0.05), _FakeWebSocket()
+        hub.register(slow, "monitoring")
+        hub.register(fast, "monitoring")
+        for i in range(6):
+            hub.publish(f"m{i}", (slow, fast))
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.3)
+        stats = hub.stats()
+        hub.unregister(slow)
+        hub.unregister(fast)
+        return slow, fast, stats, hub.stats()
+
+    slow, fast, live, after = asyncio.run(scenario())
+    assert fast.sent == [f"m{i}" for i in range(6)]
+    assert slow.sent[0] == "m0" and slow.sent[-1] == "m5"
+    assert slow.sent == sorted(slow.sent)
+    assert len(slow.sent) < 6
+    assert live["dropped"] == 6 - len(slow.sent)
+    assert live["queue_depth_total"] == 0
+    # Contadores das conexões encerradas continuam somados no hub
+    assert after["dropped"] == live["dropped"]
+    assert after["connections"] == 0
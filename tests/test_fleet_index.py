@@ -0,0 +1,73 @@
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app.fleet_index import FleetIndex
+from app.geo import haversine_km
+
+
+def _vehicle(vehicle_id, vehicle_type="car", status="active"):
+    return SimpleNamespace(id=vehicle_id, license_plate=f"ABC{vehicle_id:04d}", vehicle_type=vehicle_type, status=status)
+
+
+def _brute_force(points, lat, lng, k, vehicle_type=None, max_radius_km=50.0):
+    distances = sorted(
+        (haversine_km(lat, lng, p_lat, p_lng), vehicle_id)
+        for vehicle_id, (p_lat, p_lng, p_type) in points.items()
+        if (not vehicle_type or p_type == vehicle_type) and haversine_km(lat, lng, p_lat, p_lng) <= max_radius_km
+    )
+    return [distance for distance, _ in distances[:k]]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_nearest_matches_brute_force(seed):
+    rng = random.Random(seed)
+    index = FleetIndex(cell_size_deg=rng.choice([0.005, 0.01, 0.05]))
+    center_lat, center_lng = rng.uniform(-60, 60), rng.uniform(-170, 170)
+    points = {}
+    for vehicle_id in range(1, rng.randint(1, 300) + 1):
+        spread = rng.choice([0.01, 0.1, 1.0])
+        lat = center_lat + rng.uniform(-spread, spread)
+        lng = center_lng + rng.uniform(-spread, spread)
+        vehicle_type = rng.choice(["car", "motorcycle", "truck"])
+        index.update(_vehicle(vehicle_id, vehicle_type), lat, lng)
+        points[vehicle_id] = (lat, lng, vehicle_type)
+
+    for _ in range(20):
+        lat = center_lat + rng.uniform(-0.5, 0.5)
+        lng = center_lng + rng.uniform(-0.5, 0.5)
+        k = rng.randint(1, 20)
+        vehicle_type = rng.choice([None, "car"])
+        radius = rng.choice([1.0, 10.0, 50.0])
+        nearest = index.nearest(lat, lng, k, vehicle_type=vehicle_type, max_radius_km=radius)
+        expected = _brute_force(points, lat, lng, k, vehicle_type, radius)
+        assert [distance for _, distance in nearest] == pytest.approx(expected)
+
+
+def test_moved_and_removed_vehicles_leave_their_cells():
+    index = FleetIndex()
+    index.update(_vehicle(1), 10.0, 10.0)
+    index.update(_vehicle(1), 11.0, 11.0)
+    index.update(_vehicle(2), 10.001, 10.001)
+    assert [entry.vehicle_id for entry, _ in index.nearest(10.0, 10.0, k=5, max_radius_km=5)] == [2]
+    index.remove(2)
+    assert index.nearest(10.0, 10.0, k=5, max_radius_km=5) == []
+    assert [entry.vehicle_id for entry, _ in index.nearest(11.0, 11.0, k=5)] == [1]
+
+
+def test_older_fix_does_not_move_the_vehicle():
+    index = FleetIndex()
+    now = datetime.now(timezone.utc)
+    index.update(_vehicle(1), 10.0, 10.0, timestamp=now)
+    index.update(_vehicle(1), 20.0, 20.0, timestamp=now - timedelta(seconds=5))
+    entry = index.get(1)
+    assert (entry.latitude, entry.longitude) == (10.0, 10.0)
+
+
+def test_status_filter():
+    index = FleetIndex()
+    index.update(_vehicle(1, status="active"), 0.0, 0.0)
+    index.update(_vehicle(2, status="maintenance"), 0.0, 0.001)
+    assert [entry.vehicle_id for entry, _ in index.nearest(0.0, 0.0, k=5, status="maintenance")] == [2]
@@ -0,0 +1,111 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from app.geo import (
+    EARTH_RADIUS_KM, geohash_encode, geohash_query_cells, radius_bbox, simplification_weights, simplify_track
+)
+
+
+def test_geohash_encode_known_value():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash_encode(-23.5505, -46.6333, 5) == "6gyf4"
+
+
+@pytest.mark.parametrize("radius_km", [0.05, 0.5, 5, 50, 500])
+def test_query_cells_cover_the_bbox(radius_km):
+    rng = random.Random(radius_km)
+    bbox = radius_bbox(-23.55, -46.63, radius_km)
+    cells = geohash_query_cells(bbox, max_cells=32)
+    assert 0 < len(cells) <= 32
+    assert len({len(cell) for cell in cells}) == 1
+    min_lat, min_lng, max_lat, max_lng = bbox
+    for _ in range(500):
+        point = geohash_encode(rng.uniform(min_lat, max_lat), rng.uniform(min_lng, max_lng))
+        assert any(point.startswith(cell) for cell in cells)
+
+
+def test_query_cells_are_coarser_for_larger_areas():
+    small = geohash_query_cells(radius_bbox(10.0, 10.0, 0.1))
+    large = geohash_query_cells(radius_bbox(10.0, 10.0, 100))
+    assert len(small[0]) > len(large[0])
+
+
+def test_query_cells_at_the_antimeridian():
+    bbox = radius_bbox(0.0, 179.99, 5)
+    cells = geohash_query_cells(bbox, max_cells=32)
+    assert len(cells) <= 32
+    assert any(geohash_encode(0.0, 179.999).startswith(cell) for cell in cells)
+
+
+def _project(lat, lng):
+    # Mesma projeção local de simplification_weights
+    cos_lat = math.cos(math.radians(float(np.mean(lat))))
+    x = np.radians(lng) * cos_lat * EARTH_RADIUS_KM * 1000
+    y = np.radians(lat) * EARTH_RADIUS_KM * 1000
+    return x, y
+
+
+def _douglas_peucker(x, y, first, last, tolerance):
+    """Douglas-Peucker recursivo, como referência"""
+    if last - first < 2:
+        return [first, last]
+    ax, ay, dx, dy = x[first], y[first], x[last] - x[first], y[last] - y[first]
+    seg2 = dx * dx + dy * dy
+    best, index = -1.0, first
+    for i in range(first + 1, last):
+        t = 0.0 if seg2 == 0 else min(1.0, max(0.0, ((x[i] - ax) * dx + (y[i] - ay) * dy) / seg2))
+        distance = math.hypot(x[i] - ax - t * dx, y[i] - ay - t * dy)
+        if distance > best:
+            best, index = distance, i
+    if best <= tolerance:
+        return [first, last]
+    return _douglas_peucker(x, y, first, index, tolerance)[:-1] + _douglas_peucker(x, y, index, last, tolerance)
+
+
+def _track(rng, n):
+    lat = -23.55 + np.cumsum([rng.uniform(-0.001, 0.001) for _ in range(n)])
+    lng = -46.63 + np.cumsum([rng.uniform(-0.001, 0.001) for _ in range(n)])
+    return lat, lng
+
+
+def test_straight_track_keeps_only_endpoints():
+    lat = np.linspace(-23.5, -23.6, 50)
+    lng = np.linspace(-46.6, -46.7, 50)
+    assert simplify_track(lat, lng, tolerance_m=1).tolist() == [0, 49]
+
+
+def test_spike_is_kept():
+    lat = [0.0, 0.0, 0.01, 0.0, 0.0]
+    lng = [0.0, 0.01, 0.02, 0.03, 0.04]
+    assert simplify_track(lat, lng, tolerance_m=600).tolist() == [0, 2, 4]
+
+
+def test_empty_and_short_tracks():
+    assert simplify_track([], [], tolerance_m=10).tolist() == []
+    assert simplify_track([1.0], [2.0], tolerance_m=10).tolist() == [0]
+    assert simplify_track([1.0, 1.1], [2.0, 2.1], max_points=1).tolist() == [0]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_tolerance_matches_douglas_peucker(seed):
+    rng = random.Random(seed)
+    lat, lng = _track(rng, rng.randint(3, 200))
+    x, y = _project(lat, lng)
+    for tolerance in (1, 10, 50, 200):
+        expected = _douglas_peucker(x, y, 0, len(lat) - 1, tolerance)
+        assert simplify_track(lat, lng, tolerance_m=tolerance).tolist() == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_max_points_keeps_heaviest_points_in_order(seed):
+    rng = random.Random(seed)
+    lat, lng = _track(rng, 300)
+    weights = simplification_weights(lat, lng)
+    kept = simplify_track(lat, lng, max_points=20)
+    assert len(kept) == 20
+    assert kept.tolist() == sorted(kept.tolist())
+    assert {0, 299} <= set(kept.tolist())
+    assert weights[kept].min() >= np.delete(weights, kept).max()
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.database import get_db
+from app.geo import geohash_encode
+from app.routes import positions, vehicles
+
+T0 = datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def client():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    db = session_factory()
+    db.add(models.Vehicle(id=1, license_plate="ABC1234", vehicle_type=models.VehicleType.CAR))
+    for i in range(10):
+        lat, lng = -23.55, -46.63 + i * 0.001
+        db.add(models.VehiclePosition(
+            vehicle_id=1, latitude=lat, longitude=lng, speed=30.0,
+            timestamp=T0 + timedelta(minutes=i), geohash=geohash_encode(lat, lng)
+        ))
+    db.commit()
+    db.close()
+
+    def override_db():
+        session = session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(vehicles.router)
+    app.include_router(positions.router)
+    app.dependency_overrides[get_db] = override_db
+    return TestClient(app)
+
+
+# Mesmo instante com e sem fuso: 12:02 UTC == 09:02-03:00
+MIXED = [("2024-03-01T12:02:00", "2024-03-01T09:05:00-03:00"), ("2024-03-01T09:02:00-03:00", "2024-03-01T12:05:00")]
+
+
+@pytest.mark.parametrize("start,end", MIXED)
+def test_track_accepts_mixed_timezones(client, start, end):
+    for extra in ({}, {"simplify": 1}, {"max_points": 3}):
+        response = client.get("/api/vehicles/1/positions", params={"start": start, "end": end, **extra})
+        assert response.status_code == 200
+        assert len(response.json()) == (4 if not extra else 2 if "simplify" in extra else 3)
+
+
+@pytest.mark.parametrize("start,end", MIXED)
+def test_history_search_accepts_mixed_timezones(client, start, end):
+    response = client.get("/api/positions/history/search", params={
+        "lat": -23.55, "lng": -46.63, "radius_m": 2000, "start": start, "end": end
+    })
+    assert response.status_code == 200
+    assert response.json()["count"] == 1
+
+
+def test_start_after_end_across_timezones_is_rejected(client):
+    params = {"start": "2024-03-01T12:00:00", "end": "2024-03-01T11:00:00-03:00"}
+    assert client.get("/api/vehicles/1/positions", params=params).status_code == 200
+    params = {"start": "2024-03-01T12:00:00", "end": "2024-03-01T08:00:00-03:00"}
+    assert client.get("/api/vehicles/1/positions", params=params).status_code == 400
+    response = client.get("/api/positions/history/search", params={"lat": 0, "lng": 0, **params})
+    assert response.status_code == 400
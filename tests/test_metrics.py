@@ -0,0 +1,34 @@
+import threading
+
+from app.metrics import MetricsRegistry
+
+
+def _hammer(fn, threads=8, repeat=20000):
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(repeat):
+            fn()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return threads * repeat
+
+
+def test_counter_does_not_lose_increments_across_threads():
+    counter = MetricsRegistry().counter("test_total", "teste")
+    expected = _hammer(counter.inc)
+    assert counter.value == expected
+
+
+def test_histogram_is_consistent_across_threads():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "teste", buckets=(0.001, 0.01))
+    expected = _hammer(lambda: histogram.observe(0.005))
+    assert histogram.count == expected
+    assert sum(histogram.counts) == expected
+    assert f'test_seconds_bucket{{le="+Inf"}} {expected}' in registry.render()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.replay import ReplayCursor, stream_replay
+from app.stats import to_epoch
+
+T0 = datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class _Sessions:
+    """Fábrica de sessões que conta as abertas"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.opened = 0
+        self.open_now = 0
+
+    def __call__(self):
+        session = self.factory()
+        self.opened += 1
+        self.open_now += 1
+        close = session.close
+
+        def closing():
+            self.open_now -= 1
+            close()
+
+        session.close = closing
+        return session
+
+
+@pytest.fixture
+def sessions():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    for vehicle_id in (1, 2):
+        db.add(models.Vehicle(id=vehicle_id, license_plate=f"ABC000{vehicle_id}", vehicle_type=models.VehicleType.CAR))
+    # Veículo 1 a cada 10 s, com dois fixes no mesmo segundo; veículo 2 a cada 15 s
+    offsets = {1: [0, 10, 20, 20, 30, 40, 50], 2: [5, 20, 35, 50]}
+    for vehicle_id, seconds in offsets.items():
+        for second in seconds:
+            db.add(models.VehiclePosition(
+                vehicle_id=vehicle_id, latitude=0.0, longitude=second / 1000,
+                timestamp=T0 + timedelta(seconds=second)
+            ))
+    db.commit()
+    db.close()
+    return _Sessions(factory)
+
+
+def _offsets(rows):
+    return [(row.vehicle_id, int(to_epoch(row.timestamp) - to_epoch(T0))) for row in rows]
+
+
+def test_cursor_merges_vehicles_in_order_across_chunks(sessions):
+    cursor = ReplayCursor(sessions, [1, 2], T0, T0 + timedelta(seconds=45), chunk_size=2)
+    first = cursor.take_until(to_epoch(T0) + 20, limit=100)
+    assert _offsets(first) == [(1, 0), (2, 5), (1, 10), (1, 20), (1, 20), (2, 20)]
+    assert not cursor.exhausted
+    rest = cursor.take_until(to_epoch(T0) + 100, limit=100)
+    assert _offsets(rest) == [(1, 30), (2, 35), (1, 40)]
+    assert cursor.exhausted
+    # Nenhuma sessão fica aberta entre as leituras
+    assert sessions.open_now == 0
+
+
+def test_cursor_respects_the_batch_limit(sessions):
+    cursor = ReplayCursor(sessions, [1, 2], T0, T0 + timedelta(minutes=5), chunk_size=3)
+    batches = []
+    while not cursor.exhausted:
+        batches.append(cursor.take_until(to_epoch(T0) + 3600, limit=4))
+    assert [len(batch) for batch in batches] == [4, 4, 3]
+    assert sessions.open_now == 0
+
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text):
+        self.frames.append(json.loads(text))
+
+
+def test_stream_sends_one_batch_frame_per_tick(sessions):
+    websocket = _FakeWebSocket()
+    asyncio.run(stream_replay(
+        websocket, sessions, [1, 2], T0, T0 + timedelta(minutes=1), speed=1000, tick_seconds=0.01
+    ))
+    *batches, complete = websocket.frames
+    assert complete["type"] == "replay_complete"
+    assert batches and all(frame["type"] == "position_batch" for frame in batches)
+    positions = [position for frame in batches for position in frame["data"]]
+    assert len(positions) == 11
+    assert [p["timestamp"] for p in positions] == sorted(p["timestamp"] for p in positions)
+    assert positions[0]["license_plate"] == "ABC0001"
+    # Bem menos frames que posições: as que vencem no mesmo tick vão juntas
+    assert len(batches) < len(positions)
+    assert sessions.open_now == 0
@@ -0,0 +1,208 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from app.rules import RuleEngine, TimerWheel
+
+
+def _engine():
+    return RuleEngine(
+        speed_limits={"car": 80.0, "motorcycle": 60.0},
+        hysteresis_kmh=5.0,
+        idle_speed_kmh=3.0,
+        idle_seconds=30.0,
+        offline_seconds=900.0,
+        tick_seconds=5.0
+    )
+
+
+def _at(epoch: float) -> datetime:
+    return datetime.fromtimestamp(epoch, timezone.utc)
+
+
+def _events(events):
+    return [(e["vehicle_id"], e["rule"], e["state"], e["at"], e["value"]) for e in events]
+
+
+def _state(engine):
+    return {
+        vehicle_id: (int(engine._flags[slot]), str(engine._idle_since[slot]), float(engine._last_ts[slot]))
+        for vehicle_id, slot in engine._slots.items()
+    }
+
+
+def _sequential(engine, fixes):
+    events = []
+    for fix in sorted(fixes, key=lambda f: (f[0], f[3])):
+        events += engine.evaluate(*fix)
+    return events
+
+
+def _batch(engine, fixes):
+    return engine.evaluate_batch(*zip(*fixes))
+
+
+def test_timer_wheel_fires_keys_after_their_deadline():
+    wheel = TimerWheel(tick_seconds=5, span_seconds=60, now=100)
+    wheel.schedule("a", 112)
+    wheel.schedule("b", 130)
+    wheel.schedule("c", 101)
+    assert len(wheel) == 3
+    assert wheel.advance(109) == ["c"]
+    assert wheel.advance(114) == []
+    assert wheel.advance(115) == ["a"]
+    assert wheel.advance(140) == ["b"]
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_clamps_deadlines_to_its_span():
+    wheel = TimerWheel(tick_seconds=5, span_seconds=20, now=0)
+    # Além do alcance: cai no último bucket e é reavaliado por quem recebe
+    wheel.schedule("far", 1000)
+    # No passado: dispara no próximo tick
+    wheel.schedule("late", -50)
+    assert wheel.advance(5) == ["late"]
+    assert wheel.advance(15) == []
+    assert wheel.advance(20) == ["far"]
+
+
+def test_timer_wheel_advance_past_a_full_turn():
+    wheel = TimerWheel(tick_seconds=1, span_seconds=10, now=0)
+    for key in range(1, 11):
+        wheel.schedule(key, key)
+    assert sorted(wheel.advance(500)) == list(range(1, 11))
+    wheel.schedule("next", 503)
+    assert wheel.advance(502) == []
+    assert wheel.advance(503) == ["next"]
+
+
+def test_speeding_episode_inside_one_batch():
+    # 90 abre, 70 fica abaixo de 80 - 5 e encerra; 76 não reabre
+    fixes = [(1, "car", speed, _at(t)) for t, speed in enumerate([90, 70, 76], start=1)]
+    single, batch = _engine(), _engine()
+    expected = [
+        (1, "speeding", "raised", _at(1), 90.0),
+        (1, "speeding", "resolved", _at(2), 70.0)
+    ]
+    assert _events(_sequential(single, fixes)) == expected
+    assert _events(_batch(batch, fixes)) == expected
+    assert _state(single) == _state(batch)
+
+
+def test_idle_episode_inside_one_batch():
+    speeds = [0, 0, 0, 0, 50, 0, 0]
+    fixes = [(7, "car", speed, _at(t * 20)) for t, speed in enumerate(speeds)]
+    single, batch = _engine(), _engine()
+    assert _events(_batch(batch, fixes)) == _events(_sequential(single, fixes)) == [
+        (7, "idle", "raised", _at(40), 40.0),
+        (7, "idle", "resolved", _at(80), None)
+    ]
+    assert _state(single) == _state(batch)
+
+
+def test_batch_continues_state_from_previous_fixes():
+    single, batch = _engine(), _engine()
+    for engine in (single, batch):
+        engine.evaluate(3, "motorcycle", 70, _at(0))
+        engine.evaluate(3, "motorcycle", 1, _at(10))
+    fixes = [(3, "motorcycle", 58, _at(20)), (3, "motorcycle", 0, _at(45)), (3, "motorcycle", 54, _at(50))]
+    assert _events(_batch(batch, fixes)) == _events(_sequential(single, fixes))
+    assert _state(single) == _state(batch)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_batch_matches_single_fix_evaluation(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        single, batch = _engine(), _engine()
+        types = {vehicle_id: rng.choice(["car", "motorcycle", "truck"]) for vehicle_id in range(1, rng.randint(1, 4) + 1)}
+        for vehicle_id, vehicle_type in types.items():
+            for t in range(rng.randint(0, 3)):
+                fix = (vehicle_id, vehicle_type, rng.choice([0, 2, 50, 76, 90, None]), _at(1000 + t * 7))
+                single.evaluate(*fix)
+                batch.evaluate(*fix)
+            if rng.random() < 0.2:
+                single.load_active([(vehicle_id, "idle")])
+                batch.load_active([(vehicle_id, "idle")])
+
+        start = 1100
+        for _ in range(rng.randint(1, 3)):
+            fixes = []
+            for _ in range(rng.randint(1, 15)):
+                vehicle_id = rng.choice(list(types))
+                speed = rng.choice([0, 1, 2.9, 3, 50, 70, 74, 75, 76, 80, 81, 90, None])
+                epoch = start + rng.choice([-200, 0, 5, 20, 40]) + rng.randint(0, 100)
+                fixes.append((vehicle_id, types[vehicle_id], speed, _at(epoch)))
+            start += 120
+            assert _events(_batch(batch, fixes)) == _events(_sequential(single, fixes))
+        assert _state(single) == _state(batch)
+
+
+def _redis_engine(client):
+    engine = _engine()
+    engine.use_redis(client)
+    return engine
+
+
+@pytest.fixture
+def fake_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_redis_state_matches_memory_state(fake_redis, seed):
+    rng = random.Random(seed)
+    memory = _engine()
+    # Dois workers com o mesmo estado: um fix pode cair em qualquer um
+    workers = [_redis_engine(fake_redis), _redis_engine(fake_redis)]
+    types = {vehicle_id: rng.choice(["car", "motorcycle", "truck"]) for vehicle_id in range(1, 5)}
+    start = 1000
+    for _ in range(30):
+        fixes = []
+        for _ in range(rng.randint(1, 10)):
+            vehicle_id = rng.choice(list(types))
+            speed = rng.choice([0, 1, 2.9, 3, 50, 70, 74, 75, 76, 80, 81, 90, None])
+            epoch = start + rng.choice([-200, 0, 5, 20, 40]) + rng.randint(0, 100)
+            fixes.append((vehicle_id, types[vehicle_id], speed, _at(epoch)))
+        start += 60
+        worker = rng.choice(workers)
+        if rng.random() < 0.5:
+            assert _events(_batch(worker, fixes)) == _events(_batch(memory, fixes))
+        else:
+            assert _events(_sequential(worker, fixes)) == _events(_sequential(memory, fixes))
+    assert workers[0].stats()["redis_errors"] == 0
+
+
+def test_offline_alert_has_a_single_owner(fake_redis):
+    first, second = _redis_engine(fake_redis), _redis_engine(fake_redis)
+    first.touch(1, seen_at=1000.0)
+    first.touch(2, seen_at=1500.0)
+    second.touch(1, seen_at=900.0)
+
+    assert second.poll(now=1800.0) == []
+    raised = first.poll(now=1900.0) + second.poll(now=1900.0)
+    assert _events(raised) == [(1, "offline", "raised", _at(1900.0), 900.0)]
+    assert first.poll(now=1950.0) + second.poll(now=1950.0) == []
+
+    # Fix antigo não encerra; o mais novo encerra no worker que o recebeu
+    second.touch(1, seen_at=950.0)
+    first.touch(1, seen_at=1960.0)
+    assert second.poll(now=1970.0) == []
+    assert _events(first.poll(now=1970.0)) == [(1, "offline", "resolved", _at(1970.0), None)]
+    assert first.stats()["active"] == {"offline": 0}
+
+
+def test_loaded_offline_alert_survives_restart_touch(fake_redis):
+    engine = _redis_engine(fake_redis)
+    engine.touch(4, seen_at=1000.0)
+    engine.load_active([(4, "offline"), (4, "speeding")])
+    # Outro worker iniciando: touch com a mesma última posição não encerra
+    restarted = _redis_engine(fake_redis)
+    restarted.touch(4, seen_at=1000.0)
+    assert restarted.poll(now=3000.0) == []
+    assert _events(restarted.evaluate(4, "car", 70, _at(3000.0))) == [
+        (4, "speeding", "resolved", _at(3000.0), 70.0)
+    ]
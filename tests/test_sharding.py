@@ -0,0 +1,109 @@
+import queue
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import models
+from app.sharding import IngestShards, _ShardWorker
+
+T0 = datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _fix(vehicle_id, seconds=None, lat=-23.55):
+    fix = {"vehicle_id": vehicle_id, "latitude": lat, "longitude": -46.63, "speed": 30.0}
+    if seconds is not None:
+        fix["timestamp"] = (T0 + timedelta(seconds=seconds)).isoformat()
+    return fix
+
+
+@pytest.fixture
+def worker():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    db = session_factory()
+    db.add(models.Vehicle(id=901, license_plate="SHD0901", vehicle_type=models.VehicleType.CAR))
+    db.commit()
+    db.close()
+    worker = _ShardWorker(0, queue.Queue())
+    worker.session_factory = session_factory
+    return worker
+
+
+def _run(worker, fixes):
+    worker.process(fixes)
+    return worker.results.get_nowait()
+
+
+def _stored(worker):
+    db = worker.session_factory()
+    try:
+        return sorted(
+            int((row.timestamp.replace(tzinfo=timezone.utc) - T0).total_seconds())
+            for row in db.query(models.VehiclePosition).all()
+        )
+    finally:
+        db.close()
+
+
+def test_out_of_order_fixes_are_stored_and_only_exact_repeats_dropped(worker):
+    result = _run(worker, [_fix(901, 0), _fix(901, 20), _fix(901, 10), _fix(901, 20)])
+    assert (result["stored"], result["duplicates"]) == (3, 1)
+    assert [message["timestamp"] for message in result["messages"]] == [(T0 + timedelta(seconds=20)).isoformat()]
+
+    # Lote só com um fix atrasado: vai para o histórico, sem mensagem nem regras
+    result = _run(worker, [_fix(901, 5), _fix(901, 10)])
+    assert (result["stored"], result["duplicates"]) == (1, 1)
+    assert result["messages"] == [] and result["fixes"] == []
+    assert _stored(worker) == [0, 5, 10, 20]
+
+    result = _run(worker, [_fix(901, 30)])
+    assert result["stored"] == 1 and len(result["messages"]) == 1 and len(result["fixes"]) == 1
+
+
+def test_dedup_window_is_bounded(worker):
+    worker.dedup_window = 3
+    _run(worker, [_fix(901, second) for second in range(5)])
+    epoch = T0.timestamp()
+    assert [ts - epoch for ts in worker.recent[901]] == [2, 3, 4]
+    assert worker.last_seen[901] - epoch == 4
+
+
+class _Inbox:
+    def __init__(self):
+        self.items = []
+
+    def put_nowait(self, item):
+        self.items.append(item)
+
+
+def _drain(shards, shard_id, received):
+    """Simula o resultado de um shard chegando ao leitor"""
+    shards._results = queue.Queue()
+    shards._results.put({"shard": shard_id, "received": received, "messages": [], "fixes": [],
+                         "stored": received, "duplicates": 0, "invalid": 0, "unknown": 0, "errors": 0})
+    shards._results.put(None)
+    shards._read_results(lambda messages: None)
+
+
+def test_submit_is_all_or_nothing_so_resends_do_not_double_store():
+    shards = IngestShards(2, batch_size=2, queue_size=1)
+    shards._inboxes = [_Inbox(), _Inbox()]
+    assert shards.submit([_fix(1)]) == 1
+
+    # Shard 1 sem espaço para dois fixes: o do shard 0 também é recusado
+    batch = [_fix(2), _fix(2), _fix(1), _fix(1)]
+    assert shards.submit(batch) == 0
+    assert shards._inboxes[0].items == []
+    assert shards.rejected == [2, 2]
+
+    _drain(shards, 1, 1)
+    assert shards.in_flight == [0, 0]
+    # O reenvio do lote inteiro grava cada fix (mesmo sem horário) uma única vez
+    assert shards.submit(batch) == 4
+    assert shards._inboxes[0].items == [[_fix(2), _fix(2)]]
+    assert shards._inboxes[1].items == [[_fix(1)], [_fix(1), _fix(1)]]
+    assert shards.in_flight == [2, 2]
@@ -0,0 +1,112 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.geo import haversine_km
+from app.stats import VehicleStatsAggregator
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(models.Vehicle(id=1, license_plate="ABC1234", vehicle_type=models.VehicleType.CAR))
+    session.commit()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def fake_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def _aggregator(redis_client=None):
+    return VehicleStatsAggregator(moving_speed_kmh=3.0, max_gap_seconds=600, redis_client=redis_client)
+
+
+def _at(day: int, seconds: float) -> datetime:
+    return datetime(2024, 3, day, tzinfo=timezone.utc) + timedelta(seconds=seconds)
+
+
+def _row(db, day: date):
+    return db.query(models.VehicleDailyStats).filter_by(vehicle_id=1, day=day).one()
+
+
+def test_flushes_merge_into_the_same_row(db):
+    # Dois processos descarregando o mesmo dia: os deltas somam e a velocidade máxima é a maior
+    first, second = _aggregator(), _aggregator()
+    first.record_batch([1, 1], [0.0, 0.0], [0.0, 0.01], [40.0, 90.0], [_at(1, 0), _at(1, 60)])
+    second.record_batch([1, 1], [0.0, 0.0], [0.02, 0.03], [50.0, 70.0], [_at(1, 120), _at(1, 180)])
+    assert first.flush(db) == 1
+    assert second.flush(db) == 1
+    first.record(1, 0.0, 0.04, 0.0, _at(1, 240))
+    assert first.flush(db) == 1
+
+    row = _row(db, date(2024, 3, 1))
+    assert row.fix_count == 5
+    assert row.max_speed == 90.0
+    assert row.moving_seconds == 120.0
+    # Sem Redis cada processo só conhece as próprias posições: o último fix segue do minuto 1
+    assert row.idle_seconds == 180.0
+    assert row.distance_km == pytest.approx(
+        2 * haversine_km(0.0, 0.0, 0.0, 0.01) + haversine_km(0.0, 0.01, 0.0, 0.04)
+    )
+    assert db.query(models.VehicleDailyStats).count() == 1
+
+
+def test_flush_skips_deleted_vehicles(db):
+    aggregator = _aggregator()
+    aggregator.record(2, 0.0, 0.0, 10.0, _at(1, 0))
+    assert aggregator.flush(db) == 0
+    assert aggregator.flush(db) == 0
+
+
+def test_odometer_carries_over_to_the_next_day(db):
+    aggregator = _aggregator()
+    aggregator.record(1, 0.0, 0.0, 60.0, _at(1, 86400 - 30))
+    aggregator.record_batch([1, 1], [0.0, 0.0], [0.01, 0.02], [60.0, 60.0], [_at(2, 30), _at(2, 90)])
+    aggregator.flush(db)
+
+    day1, day2 = _row(db, date(2024, 3, 1)), _row(db, date(2024, 3, 2))
+    assert (day1.fix_count, day1.distance_km, day1.moving_seconds) == (1, 0.0, 0.0)
+    # O trecho que atravessa a meia-noite entra no dia do fix que o fecha
+    assert day2.fix_count == 2
+    assert day2.distance_km == pytest.approx(2 * haversine_km(0.0, 0.0, 0.0, 0.01))
+    assert day2.moving_seconds == 120.0
+
+
+def test_batch_matches_single_fixes(db):
+    fixes = [(1, 0.0, 0.001 * i, speed, _at(1, 50 * i)) for i, speed in enumerate([0, 20, None, 0, 80, 2])]
+    single, batch = _aggregator(), _aggregator()
+    for fix in fixes:
+        single.record(*fix)
+    # Ordem embaralhada e um fix atrasado, descartado nos dois casos
+    late = (1, 5.0, 5.0, 100.0, _at(1, 10))
+    single.record(*late)
+    batch.record_batch(*zip(*reversed(fixes)))
+    batch.record_batch(*zip(late))
+
+    expected = single.pending_for(1, date(2024, 3, 1), date(2024, 3, 1))[date(2024, 3, 1)]
+    totals = batch.pending_for(1, date(2024, 3, 1), date(2024, 3, 1))[date(2024, 3, 1)]
+    for field in ("distance_km", "moving_seconds", "idle_seconds", "fix_count", "max_speed"):
+        assert getattr(totals, field) == pytest.approx(getattr(expected, field))
+
+
+def test_last_position_is_shared_through_redis(db, fake_redis):
+    first, second = _aggregator(fake_redis), _aggregator(fake_redis)
+    first.record(1, 0.0, 0.0, 30.0, _at(1, 0))
+    second.record_batch([1], [0.0], [0.01], [30.0], [_at(1, 60)])
+    first.flush(db)
+    second.flush(db)
+
+    row = _row(db, date(2024, 3, 1))
+    assert row.distance_km == pytest.approx(haversine_km(0.0, 0.0, 0.0, 0.01))
+    assert row.moving_seconds == 60.0
+    assert 0 < fake_redis.ttl("stats:last:1") <= first.last_ttl_seconds
@@ -0,0 +1,124 @@
+import random
+
+import pytest
+
+from app.subscriptions import SubscriptionIndex
+
+SAO_PAULO = (-46.8, -23.7, -46.4, -23.4)
+
+
+def _brute_force(index, clients, vehicle_id, vehicle_type, lat, lng):
+    return {client for client in clients if index.get(client).matches(vehicle_id, vehicle_type, lat, lng)}
+
+
+def test_new_client_receives_everything_until_the_first_filter():
+    index = SubscriptionIndex()
+    index.add_client("a")
+    assert index.recipients(1, "car", 0.0, 0.0) == {"a"}
+    index.subscribe("a", vehicle_ids=[7])
+    assert index.recipients(1, "car", 0.0, 0.0) == set()
+    assert index.recipients(7, "car", 0.0, 0.0) == {"a"}
+
+
+def test_type_filter():
+    index = SubscriptionIndex()
+    index.add_client("a")
+    index.subscribe("a", vehicle_types=["motorcycle"])
+    assert index.recipients(1, "motorcycle", 10.0, 10.0) == {"a"}
+    assert index.recipients(1, "car", 10.0, 10.0) == set()
+    index.unsubscribe("a", vehicle_types=["motorcycle"])
+    assert index.recipients(1, "motorcycle", 10.0, 10.0) == set()
+
+
+def test_bbox_filter_is_inclusive_and_exact_inside_cells():
+    index = SubscriptionIndex(cell_size_deg=0.1)
+    index.add_client("a")
+    index.subscribe("a", bbox=SAO_PAULO)
+    assert index.recipients(1, "car", -23.55, -46.63) == {"a"}
+    assert index.recipients(1, "car", -23.7, -46.8) == {"a"}
+    assert index.recipients(1, "car", -23.4, -46.4) == {"a"}
+    # Mesma célula da grade, mas fora da bbox
+    assert index.recipients(1, "car", -23.39, -46.35) == set()
+    assert index.recipients(1, "car", -22.9, -43.2) == set()
+
+
+def test_wide_bbox_is_matched_without_cells():
+    index = SubscriptionIndex(cell_size_deg=0.1, max_cells_per_bbox=10)
+    index.add_client("a")
+    sub = index.subscribe("a", bbox=(-60.0, -30.0, -40.0, -10.0))
+    assert sub.wide and not sub.cells
+    assert index.recipients(1, "car", -23.55, -46.63) == {"a"}
+    assert index.recipients(1, "car", 40.0, -3.0) == set()
+    index.unsubscribe("a", bbox=(-60.0, -30.0, -40.0, -10.0))
+    assert index.recipients(1, "car", -23.55, -46.63) == set()
+
+
+def test_removing_one_of_two_bboxes_keeps_the_other():
+    index = SubscriptionIndex()
+    index.add_client("a")
+    index.subscribe("a", bbox=SAO_PAULO)
+    index.subscribe("a", bbox=(-43.3, -23.0, -43.1, -22.8))
+    index.unsubscribe("a", bbox=SAO_PAULO)
+    assert index.recipients(1, "car", -23.55, -46.63) == set()
+    assert index.recipients(1, "car", -22.9, -43.2) == {"a"}
+
+
+def test_unsubscribe_all_stops_everything_and_subscribe_all_restores():
+    index = SubscriptionIndex()
+    index.add_client("a")
+    index.subscribe("a", vehicle_ids=[1], bbox=SAO_PAULO)
+    index.unsubscribe("a", all=True)
+    assert index.recipients(1, "car", -23.55, -46.63) == set()
+    index.subscribe("a", all=True)
+    assert index.recipients(99, "truck", 50.0, 50.0) == {"a"}
+
+
+def test_remove_client_clears_every_index():
+    index = SubscriptionIndex()
+    index.add_client("a")
+    index.subscribe("a", vehicle_ids=[1], vehicle_types=["car"], bbox=SAO_PAULO)
+    index.remove_client("a")
+    assert len(index) == 0
+    assert index.recipients(1, "car", -23.55, -46.63) == set()
+    assert not index._by_vehicle and not index._by_type and not index._by_cell
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_recipients_match_every_subscription_under_live_updates(seed):
+    rng = random.Random(seed)
+    index = SubscriptionIndex(cell_size_deg=0.5, max_cells_per_bbox=20)
+    clients = [f"c{i}" for i in range(8)]
+    for client in clients:
+        index.add_client(client)
+
+    def random_bbox():
+        lng, lat = rng.uniform(-5, 5), rng.uniform(-5, 5)
+        size = rng.choice([0.1, 1.0, 4.0])
+        return (lng, lat, lng + size, lat + size)
+
+    for _ in range(200):
+        client = rng.choice(clients)
+        sub = index.get(client)
+        action = rng.random()
+        if action < 0.4:
+            index.subscribe(
+                client,
+                vehicle_ids=rng.sample(range(1, 20), rng.randint(0, 2)),
+                vehicle_types=rng.sample(["car", "motorcycle"], rng.randint(0, 1)),
+                bbox=random_bbox() if rng.random() < 0.5 else None
+            )
+        elif action < 0.7:
+            index.unsubscribe(
+                client,
+                vehicle_ids=rng.sample(sorted(sub.vehicle_ids), min(1, len(sub.vehicle_ids))),
+                vehicle_types=list(sub.vehicle_types)[:1],
+                bbox=rng.choice(sub.bboxes) if sub.bboxes and rng.random() < 0.5 else None
+            )
+        elif action < 0.75:
+            index.unsubscribe(client, all=True)
+        elif action < 0.8:
+            index.subscribe(client, all=True)
+
+        for _ in range(5):
+            fix = (rng.randint(1, 20), rng.choice(["car", "motorcycle", "truck"]), rng.uniform(-6, 6), rng.uniform(-6, 6))
+            assert index.recipients(*fix) == _brute_force(index, clients, *fix)
@@ -1,17 +1,133 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from app import models
-from app.database import engine
-from app.routes import vehicles, positions, websocket
+from app.database import engine, SessionLocal
+from app.routes import admin, alerts, drivers, vehicles, positions, websocket
 from app.config import settings
+from app.stats import stats_aggregator
+from app.catalog import vehicle_catalog
+from app.crud import AlertCRUD, AssignmentCRUD, PositionCRUD, position_cache
+from app.metrics import registry
+from app.profiling import ProfilingMiddleware, instrument_engine, trace_recorder
+from app.schema_upgrade import upgrade_schema
+from app.sharding import ingest_shards
+from app.websocket_manager import websocket_manager
+import asyncio
+import logging
 import os
 
-# Criar tabelas
+logger = logging.getLogger(__name__)
+
+# Criar tabelas e atualizar bancos criados por versões anteriores
 models.Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+
+
+def warm_fleet_index():
+    db = SessionLocal()
+    try:
+        reconciled = PositionCRUD.reconcile_last_seen()
+        if reconciled:
+            logger.info("%d veículos do Geo sem horário de última posição entraram na expiração", reconciled)
+        loaded = PositionCRUD.warm_fleet_index(db)
+        logger.info("Índice da frota carregado com %d veículos", loaded)
+    except Exception:
+        logger.exception("Não foi possível carregar o índice da frota do Redis")
+    finally:
+        db.close()
+
+
+def warm_assignment_index():
+    db = SessionLocal()
+    try:
+        loaded = AssignmentCRUD.warm_assignment_index(db)
+        logger.info("Índice de motoristas carregado com %d vínculos ativos", loaded)
+    except Exception:
+        logger.exception("Não foi possível carregar os vínculos de motoristas")
+    finally:
+        db.close()
+
+
+def warm_rule_engine():
+    db = SessionLocal()
+    try:
+        loaded = AlertCRUD.warm_rule_engine(db)
+        logger.info("Motor de regras iniciado com %d alertas ativos", loaded)
+    except Exception:
+        logger.exception("Não foi possível carregar os alertas ativos")
+    finally:
+        db.close()
+
+
+def check_offline_vehicles():
+    db = SessionLocal()
+    try:
+        return AlertCRUD.check_offline(db)
+    finally:
+        db.close()
+
+
+async def run_rule_timer(interval: float):
+    """Avança a roda de "sem sinal" a cada tick"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, check_offline_vehicles)
+        except Exception:
+            logger.exception("Erro ao verificar veículos sem sinal")
 
-app = FastAPI(title=settings.APP_NAME)
+
+async def run_geo_sweeper(interval: float):
+    """Remove periodicamente do índice geográfico os veículos que pararam de reportar"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await loop.run_in_executor(
+                None, PositionCRUD.sweep_stale_locations, settings.GEO_MAX_AGE_SECONDS
+            )
+            if removed:
+                logger.info("%d veículos inativos removidos do índice geográfico", removed)
+        except Exception:
+            logger.exception("Erro ao limpar o índice geográfico")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: índice da frota em memória a partir do cache
+    await asyncio.get_running_loop().run_in_executor(None, warm_fleet_index)
+    await asyncio.get_running_loop().run_in_executor(None, warm_assignment_index)
+    # Depois do índice da frota: agenda "sem sinal" pela última posição conhecida
+    await asyncio.get_running_loop().run_in_executor(None, warm_rule_engine)
+    # Assinatura do broker para receber mensagens de todos os workers
+    await websocket_manager.start()
+    # Shards de ingestão (INGEST_SHARDS > 0): posições gravadas voltam pelo broker
+    ingest_shards.start(websocket_manager.publish_positions_threadsafe)
+    # Gravação periódica das estatísticas diárias
+    stats_task = asyncio.create_task(
+        stats_aggregator.run_flusher(SessionLocal, settings.STATS_FLUSH_INTERVAL_SECONDS)
+    )
+    sweeper_task = asyncio.create_task(run_geo_sweeper(settings.GEO_SWEEP_INTERVAL_SECONDS))
+    rules_task = asyncio.create_task(run_rule_timer(settings.RULES_TIMER_TICK_SECONDS))
+    yield
+    # Shutdown: grava o que ainda estiver em memória
+    rules_task.cancel()
+    sweeper_task.cancel()
+    stats_task.cancel()
+    await asyncio.get_running_loop().run_in_executor(None, ingest_shards.stop)
+    await websocket_manager.stop()
+    db = SessionLocal()
+    try:
+        stats_aggregator.flush(db)
+    finally:
+        db.close()
+
+
+app = FastAPI(title=settings.APP_NAME, lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -22,10 +138,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Amostragem de requisições com tempo por etapa (desligada por padrão)
+if settings.PROFILING_ENABLED:
+    trace_recorder.slow_seconds = settings.PROFILING_SLOW_MS / 1000
+    instrument_engine(engine)
+    app.add_middleware(ProfilingMiddleware, sample_rate=settings.PROFILING_SAMPLE_RATE)
+
 # Rotas da API
 app.include_router(vehicles.router)
+app.include_router(drivers.router)
+app.include_router(alerts.router)
 app.include_router(positions.router)
 app.include_router(websocket.router)
+app.include_router(admin.router)
 
 # Servir frontend
 frontend_dir = os.path.join(os.path.dirname(__file__), "..", "frontend")
@@ -58,6 +183,18 @@ async def health_check():
     return {"status": "healthy", "service": settings.APP_NAME}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas no formato texto do Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Acertos, faltas e descartes dos caches"""
+    return {"positions": position_cache.stats(), "catalog": vehicle_catalog.stats()}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file